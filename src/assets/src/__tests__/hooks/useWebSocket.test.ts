@@ -17,6 +17,7 @@ describe("useWebSocket", () => {
       onmessage: null,
       onclose: null,
       close: jest.fn(),
+      send: jest.fn(),
     } as any;
     MockWebSocket.mockImplementation(() => mockWebSocket);
   });
@@ -89,4 +90,40 @@ describe("useWebSocket", () => {
     
     expect(result.current).toBeUndefined();
   });
+
+  it("should apply sequenced deltas to the last snapshot", () => {
+    const mockApplyDelta = jest.fn((content: any, m: any) => ({ ...content, ...m.content }));
+    renderHook(() => useWebSocket("ws://test-url", mockOnUpdate, mockOnDelete, mockApplyDelta));
+
+    act(() => {
+      mockWebSocket.onmessage!({ data: JSON.stringify({ type: "init", seq: 0, content: { a: 1 } }) } as MessageEvent);
+      mockWebSocket.onmessage!({ data: JSON.stringify({ type: "queue_fields_changed", seq: 1, content: { b: 2 } }) } as MessageEvent);
+    });
+
+    expect(mockApplyDelta).toHaveBeenCalledTimes(1);
+    expect(mockOnUpdate).toHaveBeenLastCalledWith({ a: 1, b: 2 });
+    expect(mockWebSocket.send).not.toHaveBeenCalled();
+  });
+
+  it("should request a resync when a sequence number is skipped", () => {
+    const mockApplyDelta = jest.fn((content: any, m: any) => ({ ...content, ...m.content }));
+    renderHook(() => useWebSocket("ws://test-url", mockOnUpdate, mockOnDelete, mockApplyDelta));
+
+    act(() => {
+      mockWebSocket.onmessage!({ data: JSON.stringify({ type: "init", seq: 0, content: { a: 1 } }) } as MessageEvent);
+      mockWebSocket.onmessage!({ data: JSON.stringify({ type: "queue_fields_changed", seq: 2, content: { b: 2 } }) } as MessageEvent);
+      mockWebSocket.onmessage!({ data: JSON.stringify({ type: "queue_fields_changed", seq: 3, content: { c: 3 } }) } as MessageEvent);
+    });
+
+    expect(mockApplyDelta).not.toHaveBeenCalled();
+    expect(mockWebSocket.send).toHaveBeenCalledTimes(1);
+    expect(mockWebSocket.send).toHaveBeenCalledWith(JSON.stringify({ type: "resync" }));
+
+    act(() => {
+      mockWebSocket.onmessage!({ data: JSON.stringify({ type: "update", seq: 4, content: { a: 1, b: 2, c: 3 } }) } as MessageEvent);
+      mockWebSocket.onmessage!({ data: JSON.stringify({ type: "queue_fields_changed", seq: 5, content: { d: 4 } }) } as MessageEvent);
+    });
+
+    expect(mockOnUpdate).toHaveBeenLastCalledWith({ a: 1, b: 2, c: 3, d: 4 });
+  });
 });
@@ -0,0 +1,32 @@
+import { applyQueueDelta } from "../../services/sockets";
+import { QueueAttendee, QueueHost } from "../../models";
+
+describe("applyQueueDelta", () => {
+  const meeting = (id: number, agenda = "") => ({ id, agenda } as any);
+  const hostQueue = {
+    id: 1,
+    name: "Queue",
+    status: "open",
+    meeting_set: [meeting(1), meeting(2)],
+  } as unknown as QueueHost;
+  const attendeeQueue = { id: 1, name: "Queue", status: "open" } as unknown as QueueAttendee;
+
+  it("should merge changed queue fields", () => {
+    const q = applyQueueDelta(attendeeQueue, { type: "queue_fields_changed", seq: 1, content: { status: "closed" } });
+    expect(q.status).toBe("closed");
+    expect(q.name).toBe("Queue");
+  });
+
+  it("should add, change and remove meetings", () => {
+    let q = applyQueueDelta(hostQueue, { type: "meeting_added", seq: 1, content: meeting(3) }) as QueueHost;
+    expect(q.meeting_set.map((m) => m.id)).toEqual([1, 2, 3]);
+    q = applyQueueDelta(q, { type: "meeting_changed", seq: 2, content: meeting(2, "Updated") }) as QueueHost;
+    expect(q.meeting_set[1].agenda).toBe("Updated");
+    q = applyQueueDelta(q, { type: "meeting_removed", seq: 3, content: { id: 1 } }) as QueueHost;
+    expect(q.meeting_set.map((m) => m.id)).toEqual([2, 3]);
+  });
+
+  it("should ignore meeting deltas for attendee views", () => {
+    expect(applyQueueDelta(attendeeQueue, { type: "meeting_added", seq: 1, content: meeting(3) })).toBe(attendeeQueue);
+  });
+});
@@ -31,6 +31,7 @@ enum OtpStatusValue {
 export function PhoneVerification(props: PhoneVerificationProps) {
     const [digits, setDigits] = useState(["", "", "", ""]);
     const [timeToResendCode, setTimeToResendCode] = useState(0);
+    const [stillSending, setStillSending] = useState(false);
 
     const alreadyVerified = props.verifiedPhoneNumber === props.phoneField && props.phoneField !== "";
     const [otpStatus, setOtpStatus] = useState(alreadyVerified ? OtpStatusValue.Verified : OtpStatusValue.NotSent);
@@ -138,7 +139,8 @@ export function PhoneVerification(props: PhoneVerificationProps) {
         }
 
         try {
-            await props.onGetOneTimePassword(phoneNumberToSubmit); // send otp & save in db
+            const otp = await props.onGetOneTimePassword(phoneNumberToSubmit) as { otp_delivery_status?: string | null }; // send otp & save in db
+            setStillSending(otp?.otp_delivery_status === "pending");
             oneTimePasswordTimer(); // start timer to resend code
         }
         catch (error: any) {
@@ -202,6 +204,7 @@ export function PhoneVerification(props: PhoneVerificationProps) {
                     <a onClick={() => setOtpStatus(OtpStatusValue.NotSent)} className="link-primary">edit</a>
                     )
                 </p>
+                {stillSending && <p className="text-warning">Your code is still being sent. It may take a few minutes to arrive.</p>}
                 <Form className="mb-3">
                     <Row>
                         {digits.map((digit, i) => (
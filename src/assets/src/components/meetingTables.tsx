@@ -4,7 +4,7 @@ import { Badge, Button, Col, Form, Row, Table } from "react-bootstrap";
 
 import { UserDisplay, RemoveButton } from "./common";
 import { getBackendByName } from "./meetingType";
-import { Meeting, MeetingBackend, QueueHost, User } from "../models";
+import { Meeting, MeetingBackend, MeetingStatus, QueueHost, User } from "../models";
 
 
 interface MeetingEditorComponentProps {
@@ -129,6 +129,7 @@ function UnstartedMeetingEditor (props: UnstartedMeetingEditorProps) {
         />
     );
 
+    const starting = props.meeting.status === MeetingStatus.STARTING;
     const meetingActions = assignee?.id === props.user.id
         ? (
             <>
@@ -138,9 +139,9 @@ function UnstartedMeetingEditor (props: UnstartedMeetingEditorProps) {
                     size='sm'
                     onClick={() => props.onStartMeeting(props.meeting)}
                     aria-label={`${props.meeting.backend_type === 'inperson' ? 'Ready for Attendee' : 'Create Meeting with'} ${attendeeString}`}
-                    disabled={props.disabled}
+                    disabled={props.disabled || starting}
                 >
-                    {props.meeting.backend_type === 'inperson' ? 'Ready for Attendee' : 'Create Meeting'}
+                    {starting ? 'Starting...' : props.meeting.backend_type === 'inperson' ? 'Ready for Attendee' : 'Create Meeting'}
                 </Button>
             </Col>
             <Col lg={5}>{removeButton}</Col>
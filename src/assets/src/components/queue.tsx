@@ -6,6 +6,7 @@ import { Alert, Button, Card, Col, Modal, Row } from "react-bootstrap";
 
 import {
   EnabledBackendName,
+  isStarted,
   Meeting,
   MeetingBackend,
   MeetingStatus,
@@ -225,7 +226,7 @@ interface JoinedClosedAlertProps {
 
 const JoinedClosedAlert = (props: JoinedClosedAlertProps) => {
   const statusClause =
-    props.meetingStatus === MeetingStatus.STARTED
+    isStarted(props.meetingStatus)
       ? "your meeting is still in progress"
       : "you are still in line";
   return (
@@ -293,7 +294,7 @@ function QueueAttendingJoined(props: QueueAttendingProps) {
   const meeting = props.queue.my_meeting!;
   const meetingBackend = getBackendByName(meeting.backend_type, props.backends);
   const isVideoMeeting = VideoBackendNames.includes(meetingBackend.name);
-  const inProgress = meeting.status === MeetingStatus.STARTED;
+  const inProgress = isStarted(meeting.status);
 
   // Alerts and head
   const closedAlert = props.queue.status === "closed" && (
@@ -633,7 +634,7 @@ export function QueuePage(props: PageProps) {
     meetingStatus: MeetingStatus
   ) => {
     const dialogParts =
-      meetingStatus === MeetingStatus.STARTED
+      isStarted(meetingStatus)
         ? {
             title: "Cancel Meeting?",
             action: "cancel the meeting",
@@ -721,7 +722,7 @@ export function QueuePage(props: PageProps) {
       queueTitle = `Join Queue: ${displayName}`;
     } else {
       // User has a meeting associated with this queue (queue.my_meeting exists).
-      if (queue.my_meeting.status === MeetingStatus.STARTED) {
+      if (isStarted(queue.my_meeting.status)) {
         // The meeting has started.
         queueTitle = `${displayName} - In Meeting`;
       } else {
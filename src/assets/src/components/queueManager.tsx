@@ -17,7 +17,7 @@ import { useDialogState } from "../hooks/useDialogState";
 import { usePromise } from "../hooks/usePromise";
 import { useStringValidation } from "../hooks/useValidation";
 import {
-    isQueueHost, Meeting, MeetingBackend, MeetingStatus, MyUser, QueueAttendee, QueueHost,
+    isQueueHost, isStarted, Meeting, MeetingBackend, MyUser, QueueAttendee, QueueHost,
     User, VideoBackendNames
 } from "../models"; 
 import * as api from "../services/api";
@@ -116,7 +116,7 @@ function QueueManager(props: QueueManagerProps) {
     let startedMeetings = [];
     let unstartedMeetings = [];
     for (const meeting of props.queue.meeting_set) {
-        if (meeting.status ===  MeetingStatus.STARTED) {
+        if (isStarted(meeting.status)) {
             startedMeetings.push(meeting);
         } else {
             unstartedMeetings.push(meeting);
@@ -328,7 +328,15 @@ export function QueueManagerPage(props: PageProps) {
     const [visibleMeetingDialog, setVisibleMeetingDialog] = useState(undefined as Meeting | undefined);
 
     const [myUser, setMyUser] = useState(undefined as MyUser | undefined);
-    const userWebSocketError = useUserWebSocket(props.user!.id, (u) => setMyUser(u as MyUser));
+    // Meetings started in the background report failures over the user socket
+    const [startMeetingFailure, setStartMeetingFailure] = useState(undefined as Error | undefined);
+    const userWebSocketError = useUserWebSocket(props.user!.id, (u) => setMyUser(u as MyUser), (m) => {
+        if (m.type === "meeting_start_failed") {
+            setStartMeetingFailure(new Error(m.content.detail));
+        } else if (m.type === "meeting_started") {
+            setStartMeetingFailure(undefined);
+        }
+    });
 
     if (myUser && queue) {
         checkBackendAuth(myUser, queue);
@@ -370,6 +378,7 @@ export function QueueManagerPage(props: PageProps) {
 
     const startMeeting = async (meeting: Meeting) => {
         recordQueueManagementEvent("Started Meeting");
+        setStartMeetingFailure(undefined);
         await api.startMeeting(meeting.id);
     }
     const [doStartMeeting, startMeetingLoading, startMeetingError] = usePromise(startMeeting);
@@ -383,7 +392,7 @@ export function QueueManagerPage(props: PageProps) {
         {source: 'Remove Meeting', error: removeMeetingError},
         {source: 'Queue Status', error: setStatusError},
         {source: 'Assignee', error: changeAssigneeError},
-        {source: 'Start Meeting', error: startMeetingError},
+        {source: 'Start Meeting', error: startMeetingError ?? startMeetingFailure},
     ].filter(e => e.error) as FormError[];
     const addMeetingErrorSource = addMeetingError && { source: 'Add Meeting', error: addMeetingError } as FormError;
     const loginDialogVisible = globalErrorSources.some(checkForbiddenError);
@@ -1,8 +1,9 @@
 import { useState, useEffect } from "react";
 import { WebSocket } from "partysocket";
 
-interface OfficeHoursMessage<T> {
-  type: "init" | "update" | "deleted";
+export interface OfficeHoursMessage<T> {
+  type: "init" | "update" | "deleted" | string;
+  seq?: number;
   content: T;
 }
 
@@ -11,20 +12,40 @@ export const useWebSocket = <T>(
   onUpdate: (content: T) => void,
   onDelete?: (
     setError: React.Dispatch<React.SetStateAction<Error | undefined>>
-  ) => void
+  ) => void,
+  applyDelta?: (content: T, m: OfficeHoursMessage<any>) => T,
+  onEvent?: (m: OfficeHoursMessage<any>) => void
 ) => {
   const [error, setError] = useState(undefined as Error | undefined);
   useEffect(() => {
     const ws = new WebSocket(url, undefined, {
       maxRetries: 10,
     });
+    // Delta messages are applied to the last full snapshot, in sequence
+    let current = undefined as T | undefined;
+    let lastSeq = undefined as number | undefined;
+    let awaitingResync = false;
     ws.onmessage = (e: MessageEvent) => {
       const m = JSON.parse(e.data) as OfficeHoursMessage<T>;
       console.debug(m);
+      const isSnapshot = m.type === "init" || m.type === "update";
+      if (m.seq !== undefined) {
+        if (!isSnapshot && (lastSeq === undefined || m.seq !== lastSeq + 1)) {
+          // A message was missed; ask for a full snapshot and ignore deltas until it arrives
+          if (!awaitingResync) {
+            awaitingResync = true;
+            ws.send(JSON.stringify({ type: "resync" }));
+          }
+          return;
+        }
+        lastSeq = m.seq;
+      }
       switch (m.type) {
         case "init":
         case "update":
-          onUpdate(m.content as T);
+          awaitingResync = false;
+          current = m.content as T;
+          onUpdate(current);
           break;
         case "deleted":
           if (onDelete) {
@@ -33,6 +54,15 @@ export const useWebSocket = <T>(
             throw new Error("Unexpected message type 'deleted': " + e);
           }
           break;
+        default:
+          if (applyDelta && m.seq !== undefined && current !== undefined) {
+            current = applyDelta(current, m);
+            onUpdate(current);
+          } else if (onEvent && m.seq === undefined) {
+            // Notifications that aren't part of the content, e.g. meeting start results
+            onEvent(m);
+          }
+          break;
       }
     };
     ws.onclose = (e) => {
@@ -43,6 +43,7 @@ export enum MeetingStatus {
   UNASSIGNED = 0,
   ASSIGNED = 1,
   STARTED = 2,
+  STARTING = 3, // Being started in the background (ASYNC_MEETING_START)
 }
 
 export interface Meeting {
@@ -89,6 +90,11 @@ export interface QueueAnnouncement {
   active: boolean;
 }
 
+// Starting meetings have left the line just like started ones
+export const isStarted = (status: MeetingStatus): boolean => {
+  return status === MeetingStatus.STARTED || status === MeetingStatus.STARTING;
+};
+
 export const isQueueHost = (q: QueueAttendee | QueueHost): q is QueueHost => {
   return (q as QueueHost).meeting_set !== undefined;
 };
@@ -269,7 +269,21 @@ export const getOneTimePassword = async (
     }),
   });
   await handleErrors(resp);
-  return await resp.json();
+  let otp = await resp.json();
+  // The code is texted in the background; wait until it has been sent or has failed.
+  // If it's still pending after that, the caller shows that it's still being sent.
+  for (let attempt = 0; otp.otp_delivery_status === "pending" && attempt < 30; attempt++) {
+    await new Promise((resolve) => setTimeout(resolve, 1000));
+    const pollResp = await fetch(`/api/users/${user_id}/otp/`, { method: "GET" });
+    await handleErrors(pollResp);
+    otp = await pollResp.json();
+  }
+  if (otp.otp_delivery_status === "failed") {
+    throw new Error(
+      "Failed to send verification code; please check your phone number and try again."
+    );
+  }
+  return otp;
 };
 
 export const verifyOneTimePassword = async (user_id: number, otp: string) => {
@@ -1,10 +1,32 @@
-import { useWebSocket } from "../hooks/useWebSocket";
-import { QueueHost, QueueAttendee, User, MyUser } from "../models";
+import { OfficeHoursMessage, useWebSocket } from "../hooks/useWebSocket";
+import { QueueHost, QueueAttendee, User, MyUser, Meeting, isQueueHost } from "../models";
 
 const getProtocol = () => {
     return location.protocol === "https:" ? "wss:" : "ws:";
 }
 
+const applyMeetingDelta = (meetings: Meeting[], m: OfficeHoursMessage<any>): Meeting[] => {
+    switch (m.type) {
+        case "meeting_added":
+            return [...meetings, m.content as Meeting];
+        case "meeting_changed":
+            return meetings.map((meeting) => meeting.id === m.content.id ? m.content as Meeting : meeting);
+        case "meeting_removed":
+            return meetings.filter((meeting) => meeting.id !== m.content.id);
+        default:
+            return meetings;
+    }
+}
+
+export const applyQueueDelta = (q: QueueHost | QueueAttendee, m: OfficeHoursMessage<any>): QueueHost | QueueAttendee => {
+    if (m.type === "queue_fields_changed") {
+        return { ...q, ...m.content };
+    }
+    return isQueueHost(q)
+        ? { ...q, meeting_set: applyMeetingDelta(q.meeting_set, m) }
+        : q;
+}
+
 export const useQueueWebSocket = (queue_id: any, onUpdate: (q: QueueHost | QueueAttendee | undefined) => void) => {
     return useWebSocket(
         `${getProtocol()}//${location.host}/ws/queues/${queue_id}/`,
@@ -13,15 +35,22 @@ export const useQueueWebSocket = (queue_id: any, onUpdate: (q: QueueHost | Queue
             onUpdate(undefined);
             setError(new Error("The queue was deleted."));
         },
+        applyQueueDelta,
     );
 }
 
-export const useUserWebSocket = (user_id: number | undefined, onUpdate: (user: User | MyUser) => void) => {
+export const useUserWebSocket = (
+    user_id: number | undefined,
+    onUpdate: (user: User | MyUser) => void,
+    onEvent?: (m: OfficeHoursMessage<any>) => void,
+) => {
     return typeof user_id === "number"
         ? useWebSocket(
             `${getProtocol()}//${location.host}/ws/users/${user_id}/`,
             onUpdate,
             () => onUpdate(undefined!),
+            undefined,
+            onEvent,
         )
         : undefined;
 }
@@ -1,5 +1,5 @@
 import { string, StringSchema, SchemaDescription, ValidationError } from 'yup';
-import { MeetingBackend, MeetingStatus, QueueHost } from "./models";
+import { isStarted, MeetingBackend, QueueHost } from "./models";
 import { getUser } from "./services/api";
 
 // Yup: https://github.com/jquense/yup
@@ -125,7 +125,7 @@ export function validateMeetingTypes (value: Set<string>, backends: MeetingBacke
 
     let existingMeetingConflict = false;
     if (queue) {
-        const unstartedMeetings = queue!.meeting_set.filter(m => m.status !== MeetingStatus.STARTED);
+        const unstartedMeetings = queue!.meeting_set.filter(m => !isStarted(m.status));
         const uniqueUnstartedMeetingTypes = new Set(unstartedMeetings.map(m => m.backend_type));
         const conflictingTypes = [...uniqueUnstartedMeetingTypes]
             .filter(uniqueMeetingType => !value.has(uniqueMeetingType));
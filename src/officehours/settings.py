@@ -79,7 +79,7 @@ if DEBUG:
 
 WATCHMAN_TOKENS = os.getenv('WATCHMAN_TOKENS')
 WATCHMAN_TOKEN_NAME = os.getenv('WATCHMAN_TOKEN_NAME', 'officehours-watchman-token')
-WATCHMAN_CHECKS = ('watchman.checks.caches', 'watchman.checks.databases')
+WATCHMAN_CHECKS = ('watchman.checks.caches', 'watchman.checks.databases', 'officehours_api.checks.backends')
 WATCHMAN_DISABLE_APM = str_to_bool(os.getenv('WATCHMAN_DISABLE_APM', 'false'))
 EXPOSE_WATCHMAN_VERSION = str_to_bool(os.getenv('EXPOSE_WATCHMAN_VERSION', 'false'))
 
@@ -303,6 +303,12 @@ DRF_TRACKING_ADMIN_LOG_READONLY = True
 LOGGING_METHODS = csv_to_list(
     os.getenv('LOGGING_METHODS', 'POST, PUT, PATCH, DELETE')
 )
+# Used by the prune_api_request_logs command
+API_REQUEST_LOG_RETENTION_DAYS = int(os.getenv('API_REQUEST_LOG_RETENTION_DAYS', '180'))
+API_REQUEST_LOG_ARCHIVE_DIR = os.getenv('API_REQUEST_LOG_ARCHIVE_DIR')
+# Seconds a meeting start is left out of incremental meeting start log exports, so a start still being committed
+# isn't skipped by the next one
+MEETING_START_LOG_EXPORT_DELAY = int(os.getenv('MEETING_START_LOG_EXPORT_DELAY', '60'))
 
 
 # Email
@@ -334,12 +340,60 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Seconds to wait after a committed change before broadcasting it to websocket groups,
+# so that a burst of changes to the same queue or user produces a single update
+WEBSOCKET_BROADCAST_WINDOW = float(os.getenv('WEBSOCKET_BROADCAST_WINDOW', '0.2'))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Rendered queue snapshots shared by every web and websocket process
+    'queues': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': f"redis://{os.getenv('REDIS_HOST', 'redis').strip()}:{int(os.getenv('REDIS_PORT', '6379'))}",
+        'KEY_PREFIX': 'queues',
+        'TIMEOUT': int(os.getenv('QUEUE_CACHE_TIMEOUT', '300')),
+    },
+    # SMS dedupe markers and per-number rate limits
+    'notifications': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': f"redis://{os.getenv('REDIS_HOST', 'redis').strip()}:{int(os.getenv('REDIS_PORT', '6379'))}",
+        'KEY_PREFIX': 'notifications',
+    },
+    # Zoom access tokens, so a token refreshed by one process is used by all of them
+    'zoom_tokens': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': f"redis://{os.getenv('REDIS_HOST', 'redis').strip()}:{int(os.getenv('REDIS_PORT', '6379'))}",
+        'KEY_PREFIX': 'zoom_tokens',
+    },
+}
+
+# Keeps the shared caches in memory under test
+TEST_RUNNER = 'officehours.test_runner.TestRunner'
+
+# Start meetings in the start_meetings command instead of in the request
+ASYNC_MEETING_START = str_to_bool(os.getenv('ASYNC_MEETING_START', 'off'))
+
 # Notifications
 TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
 TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
 TWILIO_MESSAGING_SERVICE_SID = os.getenv('TWILIO_MESSAGING_SERVICE_SID')
 OTP_REQUEST_BUFFER = int(os.getenv('OTP_REQUEST_BUFFER', "30"))
 UM_SMS_IDENTIFIER = os.getenv('UM_SMS_IDENTIFIER', '[U-M Office Hours]')
+# Log and record texts instead of sending them when Twilio isn't configured
+TWILIO_STAND_IN = str_to_bool(os.getenv('TWILIO_STAND_IN', 'off'))
+# Used by the send_sms command
+SMS_CONCURRENCY = int(os.getenv('SMS_CONCURRENCY', '8'))
+SMS_MAX_ATTEMPTS = int(os.getenv('SMS_MAX_ATTEMPTS', '5'))
+SMS_RETRY_DELAY = float(os.getenv('SMS_RETRY_DELAY', '30'))
+# Seconds after which a message claimed by a worker that didn't record how it went is sent again
+SMS_CLAIM_TIMEOUT = int(os.getenv('SMS_CLAIM_TIMEOUT', '300'))
+# Seconds during which a notification of the same kind for the same queue isn't texted to a number again
+SMS_DEDUPE_WINDOW = int(os.getenv('SMS_DEDUPE_WINDOW', '120'))
+# Texts a number can receive in a burst, and how many more it's allowed per hour after that
+SMS_RATE_LIMIT_BURST = int(os.getenv('SMS_RATE_LIMIT_BURST', '5'))
+SMS_RATE_LIMIT_PER_HOUR = int(os.getenv('SMS_RATE_LIMIT_PER_HOUR', '20'))
 
 # Backends
 DOCS_BASE_URL = 'https://its.umich.edu/communication/videoconferencing/'
@@ -356,10 +410,31 @@ DEFAULT_BACKEND = "inperson"
 
 ZOOM_CLIENT_ID = os.getenv('ZOOM_CLIENT_ID', '').strip()
 ZOOM_CLIENT_SECRET = os.getenv('ZOOM_CLIENT_SECRET', '').strip()
+# Used by the refresh_zoom_tokens command
+ZOOM_TOKEN_REFRESH_AHEAD = float(os.getenv('ZOOM_TOKEN_REFRESH_AHEAD', '900'))
+ZOOM_OAUTH_URL = os.getenv('ZOOM_OAUTH_URL', 'https://zoom.us')
+ZOOM_API_URL = os.getenv('ZOOM_API_URL', 'https://api.zoom.us/v2')
+# Connection pooling, timeouts and retries for requests to Zoom
+ZOOM_HTTP_POOL_SIZE = int(os.getenv('ZOOM_HTTP_POOL_SIZE', '10'))
+ZOOM_HTTP_TIMEOUT = float(os.getenv('ZOOM_HTTP_TIMEOUT', '10'))
+ZOOM_HTTP_RETRIES = int(os.getenv('ZOOM_HTTP_RETRIES', '3'))
+ZOOM_HTTP_BACKOFF = float(os.getenv('ZOOM_HTTP_BACKOFF', '0.5'))
+# Meetings kept ready per host of an open queue by the provision_zoom_meetings command; 0 turns the pool off
+ZOOM_MEETING_POOL_SIZE = int(os.getenv('ZOOM_MEETING_POOL_SIZE', '0'))
+# Days before an unclaimed provisioned meeting is deleted and replaced
+ZOOM_MEETING_POOL_MAX_AGE = float(os.getenv('ZOOM_MEETING_POOL_MAX_AGE', '7'))
 if ZOOM_CLIENT_ID and ZOOM_CLIENT_SECRET:
     ENABLED_BACKENDS.add("zoom")
     DEFAULT_BACKEND = "zoom"
 
+# Circuit breaker for each backend: stop calling it for BACKEND_CIRCUIT_OPEN_SECONDS once at least
+# BACKEND_CIRCUIT_MINIMUM_CALLS calls ended in the last BACKEND_CIRCUIT_WINDOW seconds and
+# BACKEND_CIRCUIT_FAILURE_RATE of them failed
+BACKEND_CIRCUIT_WINDOW = float(os.getenv('BACKEND_CIRCUIT_WINDOW', '60'))
+BACKEND_CIRCUIT_MINIMUM_CALLS = int(os.getenv('BACKEND_CIRCUIT_MINIMUM_CALLS', '5'))
+BACKEND_CIRCUIT_FAILURE_RATE = float(os.getenv('BACKEND_CIRCUIT_FAILURE_RATE', '0.5'))
+BACKEND_CIRCUIT_OPEN_SECONDS = float(os.getenv('BACKEND_CIRCUIT_OPEN_SECONDS', '30'))
+
 DEFAULT_ALLOWED_BACKENDS = (
     csv_to_list(os.getenv('DEFAULT_ALLOWED_BACKENDS'))
     if os.getenv('DEFAULT_ALLOWED_BACKENDS', None)
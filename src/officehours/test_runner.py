@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+# Caches shared between processes through Redis in deployments
+SHARED_CACHES = ('queues', 'notifications', 'zoom_tokens')
+
+
+class TestRunner(DiscoverRunner):
+    '''
+    Runs tests with the shared caches kept in memory, rather than reaching for Redis on every save.
+    '''
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        caches = {
+            alias: {**config, 'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': alias}
+            if alias in SHARED_CACHES else config
+            for alias, config in settings.CACHES.items()
+        }
+        self._caches_override = override_settings(CACHES=caches)
+        self._caches_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._caches_override.disable()
+        super().teardown_test_environment(**kwargs)
@@ -3,10 +3,9 @@ import logging
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
-from django.http import HttpResponse
 from officehours_api.admin_filters import ActiveHosts, ActiveQueues
-from officehours_api.models import Queue, Meeting, Attendee, Profile, QueueAnnouncement
-from officehours_api.views import ExportMeetingStartLogs
+from officehours_api.models import Queue, Meeting, Attendee, Profile, QueueAnnouncement, OutboundSMS, ProvisionedMeeting
+from officehours_api.views import ExportMeetingStartLogs, stream_csv
 from safedelete.admin import SafeDeleteAdmin, highlight_deleted
 
 logger = logging.getLogger(__name__)
@@ -43,13 +42,12 @@ class ExporterAdminMixin:
         queue_ids = list(map(lambda λ: λ.id, queues_queryset))
 
         if len(queue_ids) > 0:
-            response = HttpResponse(content_type='text/csv')
-            response['Content-Disposition'] = \
-                'attachment; filename=meeting_data.csv'
-
-            ExportMeetingStartLogs.extract_log(queue_ids, response)
-
-            return response
+            return stream_csv(
+                request,
+                ExportMeetingStartLogs.log_columns,
+                ExportMeetingStartLogs.extract_log(queue_ids),
+                'meeting_data.csv',
+            )
 
     export_as_csv.short_description = 'Export meeting data for selection'
 
@@ -102,6 +100,22 @@ class QueueAnnouncementAdmin(admin.ModelAdmin):
         super().save_model(request, obj, form, change)
 
 
+@admin.register(OutboundSMS)
+class OutboundSMSAdmin(admin.ModelAdmin):
+    list_display = ('id', 'to', 'status', 'attempts', 'created_at', 'sent_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ['to', 'dedupe_key']
+    readonly_fields = ('created_at', 'sent_at')
+
+
+@admin.register(ProvisionedMeeting)
+class ProvisionedMeetingAdmin(admin.ModelAdmin):
+    list_display = ('id', 'host', 'created_at', 'claimed_at')
+    list_select_related = ('host',)
+    search_fields = ['host__username']
+    readonly_fields = ('created_at', 'claimed_at')
+
+
 class ProfileInline(admin.StackedInline):
     model = Profile
     can_delete = False
@@ -1,10 +1,108 @@
 from abc import ABC, abstractclassmethod, abstractmethod
-from typing import Optional
+from collections import deque
+import logging
+import threading
+from time import monotonic
+from typing import Deque, NamedTuple, Optional, Tuple, Type
 
+from django.conf import settings
 from django.contrib.auth.models import User
+from requests.exceptions import RequestException
 
 from officehours_api.backends.types import BackendDict, IMPLEMENTED_BACKEND_NAME
 
+logger = logging.getLogger(__name__)
+
+
+class Permit(NamedTuple):
+    '''Lets a call to a backend go ahead; the probe is the call that decides whether a half-open circuit closes.'''
+    probe: bool = False
+
+
+class CircuitBreaker:
+    '''
+    Tracks how calls to a backend ended over the last `window` seconds. Once at least
+    `minimum_calls` ended and `failure_rate` of them failed, the circuit opens and calls
+    fail fast for `open_seconds`. Then it's half-open: one call at a time is let through
+    as a probe, and the circuit closes if it succeeds or opens again if it fails.
+    Only the probe changes the state of an open circuit; calls that were already under way
+    when it opened are only counted in the window. State is kept per process.
+    '''
+
+    def __init__(self, name: str, window: float, minimum_calls: int, failure_rate: float, open_seconds: float):
+        self.name = name
+        self.window = window
+        self.minimum_calls = minimum_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        # (ended at, failed) for each call in the window
+        self._calls: Deque[Tuple[float, bool]] = deque()
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    def _prune(self, now: float):
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            return 'open' if monotonic() < self._opened_at + self.open_seconds else 'half_open'
+
+    @property
+    def current_failure_rate(self) -> float:
+        with self._lock:
+            self._prune(monotonic())
+            return sum(failed for _, failed in self._calls) / len(self._calls) if self._calls else 0.0
+
+    def allow(self) -> Optional[Permit]:
+        '''
+        Returns a permit if a call may go ahead, which the caller passes back with how its call ended,
+        or None if it should fail fast. While half-open, only one permit at a time is for a probe.
+        '''
+        with self._lock:
+            if self._opened_at is None:
+                return Permit()
+            if monotonic() < self._opened_at + self.open_seconds or self._probing:
+                return None
+            self._probing = True
+            return Permit(probe=True)
+
+    def record_success(self, permit: Permit):
+        with self._lock:
+            self._record(False)
+            if permit.probe:
+                logger.info(f'Closing the circuit for {self.name} after a successful probe')
+                self._opened_at = None
+                self._probing = False
+                self._calls.clear()
+
+    def record_failure(self, permit: Permit):
+        with self._lock:
+            now = monotonic()
+            self._record(True)
+            if permit.probe:
+                # A failed probe keeps the circuit open for another period
+                self._opened_at = now
+                self._probing = False
+                return
+            if self._opened_at is not None:
+                return
+            failures = sum(failed for _, failed in self._calls)
+            if len(self._calls) >= self.minimum_calls and failures / len(self._calls) >= self.failure_rate:
+                logger.warning(
+                    f'Opening the circuit for {self.name}: {failures} of the last {len(self._calls)} calls failed'
+                )
+                self._opened_at = now
+
+    def _record(self, failed: bool):
+        now = monotonic()
+        self._calls.append((now, failed))
+        self._prune(now)
+
 
 class BackendBase(ABC):
 
@@ -15,6 +113,17 @@ class BackendBase(ABC):
     profile_url: Optional[str] = None
     telephone_num: Optional[str] = None
     intl_telephone_url: Optional[str] = None
+    # Exceptions that mean the backend itself is failing, rather than e.g. a user's authorization
+    failure_exceptions: Tuple[Type[Exception], ...] = (RequestException,)
+
+    def __init__(self):
+        self.circuit_breaker = CircuitBreaker(
+            self.name,
+            window=settings.BACKEND_CIRCUIT_WINDOW,
+            minimum_calls=settings.BACKEND_CIRCUIT_MINIMUM_CALLS,
+            failure_rate=settings.BACKEND_CIRCUIT_FAILURE_RATE,
+            open_seconds=settings.BACKEND_CIRCUIT_OPEN_SECONDS,
+        )
 
     @classmethod
     def get_public_data(cls) -> BackendDict:
@@ -2,7 +2,7 @@ import logging
 from typing import List
 
 from officehours_api.backends.types import IMPLEMENTED_BACKEND_NAME
-from officehours_api.models import Meeting, MeetingStatus, Queue
+from officehours_api.models import Meeting, Queue
 
 
 logger = logging.getLogger(__name__)
@@ -19,14 +19,11 @@ class BackendPhaser:
     def get_queues_allowing_backend(self) -> List[Queue]:
         return list(Queue.objects.filter(allowed_backends__contains=[self.backend_name]))
 
-    def get_all_meetings_with_backend(self) -> List[Meeting]:
-        return list(Meeting.objects.filter(backend_type=self.backend_name))
+    def get_started_meetings_with_backend(self) -> List[Meeting]:
+        return list(Meeting.objects.started().filter(backend_type=self.backend_name))
 
-    def get_meetings_with_backend_through_queues(self, queues: List[Queue]) -> List[Meeting]:
-        meetings_with_backend = []
-        for queue in queues:
-            meetings_with_backend += list(queue.meeting_set.filter(backend_type=self.backend_name))
-        return meetings_with_backend
+    def get_unstarted_meetings_with_backend_through_queues(self, queues: List[Queue]) -> List[Meeting]:
+        return list(Meeting.objects.unstarted().filter(queue__in=queues, backend_type=self.backend_name))
 
     def replace_backend_in_queue_allowed_backends(self, queues_allowing_backend: List[Queue]) -> List[Queue]:
         for queue in queues_allowing_backend:
@@ -34,21 +31,11 @@ class BackendPhaser:
         return queues_allowing_backend
 
     @staticmethod
-    def set_unstarted_meetings_to_other_backend(meetings_with_backend: List[Meeting]) -> List[Meeting]:
-        unstarted_meetings_with_backend: List[Meeting] = [
-            meeting for meeting in meetings_with_backend if meeting.status != MeetingStatus.STARTED
-        ]
+    def set_unstarted_meetings_to_other_backend(unstarted_meetings_with_backend: List[Meeting]) -> List[Meeting]:
         for meeting in unstarted_meetings_with_backend:
             meeting.change_backend_type()  # Set to default backend or other enabled backend if applicable
         return unstarted_meetings_with_backend
 
-    @staticmethod
-    def get_started_meetings_to_delete(meetings_with_backend: List[Meeting]) -> List[Meeting]:
-        started_meetings_with_backend: List[Meeting] = [
-            meeting for meeting in meetings_with_backend if meeting.status == MeetingStatus.STARTED
-        ]
-        return started_meetings_with_backend
-
     def phase_out(self, replace_allowed_and_unstarted: bool, delete_started: bool, dry_run: bool):
         logger.info(f'Disabled backend: {self.backend_name}')
         if dry_run:
@@ -69,7 +56,7 @@ class BackendPhaser:
                 logger.info('Persisted changes to queue(s) to the database.')
 
             logger.info('Replacing backend_type of unstarted meetings from the modified queues with another backend...')
-            meetings_with_backend = self.get_meetings_with_backend_through_queues(modified_queues)
+            meetings_with_backend = self.get_unstarted_meetings_with_backend_through_queues(modified_queues)
             modified_meetings = self.set_unstarted_meetings_to_other_backend(meetings_with_backend)
             logger.info(
                 f'Set the backend_type for {len(modified_meetings)} meeting(s) '
@@ -82,8 +69,7 @@ class BackendPhaser:
 
         if delete_started:
             logger.info(f'Finding started meetings with {self.backend_name} as backend_type...')
-            meetings_with_backend = self.get_all_meetings_with_backend()
-            started_meetings_to_delete = self.get_started_meetings_to_delete(meetings_with_backend)
+            started_meetings_to_delete = self.get_started_meetings_with_backend()
             logger.info(
                 f'Will delete {len(started_meetings_to_delete)} '
                 f'started meeting(s) with backend_type {self.backend_name}.'
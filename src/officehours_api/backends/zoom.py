@@ -1,21 +1,26 @@
 import json
-from typing import List, Literal, TypedDict
+from typing import List, Literal, Optional, TypedDict
 from time import time
-from datetime import datetime
 import logging
 
 from django.contrib.auth.models import User
 from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import QuerySet
 from django.shortcuts import redirect
+from django.utils import timezone
 
 from officehours_api.backends.backend_base import BackendBase
 from officehours_api.backends.types import IMPLEMENTED_BACKEND_NAME
 from officehours_api.patches import pyzoom_patch
+from officehours_api.patches.pyzoom_patch import ZoomServerError
 
 from pyzoom import ZoomClient
 from pyzoom.err import APIError as ZoomAPIError
 from pyzoom.oauth import refresh_tokens, request_tokens
 from pyzoom.schemas import ZoomMeetingSettings
+from requests.exceptions import RequestException
 
 logger = logging.getLogger(__name__)
 
@@ -83,11 +88,13 @@ class Backend(BackendBase):
     intl_telephone_url: str = settings.ZOOM_INTL_URL
     sign_in_help: str = settings.ZOOM_SIGN_IN_HELP
 
-    base_url = 'https://zoom.us'
+    base_url = settings.ZOOM_OAUTH_URL
+    api_url = settings.ZOOM_API_URL
     base_domain_url = settings.ZOOM_BASE_DOMAIN_URL
     expiry_buffer_seconds = 60
     client_id = settings.ZOOM_CLIENT_ID
     client_secret = settings.ZOOM_CLIENT_SECRET
+    failure_exceptions = (RequestException, ZoomServerError)
 
     @classmethod
     def _spend_authorization_code(cls, code: str, request) -> ZoomAccessToken:
@@ -98,8 +105,30 @@ class Backend(BackendBase):
         logger.debug("Received authorization code from Zoom")
         return tokens
 
+    @staticmethod
+    def _token_cache_key(user_id: int) -> str:
+        return f'access_token:{user_id}'
+
+    @classmethod
+    def _cache_access_token(cls, user_id: int, zoom_meta: dict) -> None:
+        timeout = zoom_meta['access_token_expires'] - time()
+        if timeout <= 0:
+            return
+        try:
+            caches['zoom_tokens'].set(cls._token_cache_key(user_id), zoom_meta['access_token'], timeout=timeout)
+        except Exception as e:
+            logger.warning(f'Zoom token cache unavailable: {e}')
+
+    @classmethod
+    def _forget_access_token(cls, user_id: int) -> None:
+        try:
+            caches['zoom_tokens'].delete(cls._token_cache_key(user_id))
+        except Exception as e:
+            logger.warning(f'Zoom token cache unavailable: {e}')
+
     @classmethod
     def _clear_backend_metadata(cls, user: User) -> None:
+        cls._forget_access_token(user.id)
         user.profile.backend_metadata['zoom'] = {}
         user.profile.save()
         logger.info(f'Removed Zoom metadata for user {user.id} to prompt re-authorization.')
@@ -110,32 +139,79 @@ class Backend(BackendBase):
 
     @classmethod
     def _get_access_token(cls, user: User) -> str:
+        '''
+        Access tokens are kept in the shared "zoom_tokens" cache until they expire, so a token
+        refreshed by any process (e.g. refresh_zoom_tokens) replaces the one every process uses.
+        If the cache is unreachable, the token is read from the profile.
+        '''
+        try:
+            cached = caches['zoom_tokens'].get(cls._token_cache_key(user.id))
+        except Exception as e:
+            logger.warning(f'Zoom token cache unavailable: {e}')
+            cached = None
+        if cached:
+            return cached
         zoom_meta = user.profile.backend_metadata['zoom']
         logger.debug(f'Checking access token for {user.id} expires at {zoom_meta["access_token_expires"]} time {time()}')
-        if time() > zoom_meta['access_token_expires']:
-            logger.debug(f'Refreshing token for {user.id}')
-            # The refresh_tokens function from the PyZoom library replaces the request to /oauth/token
-            # for the refresh token grant type
-            try:
-                token = refresh_tokens(cls.client_id, cls.client_secret, zoom_meta['refresh_token'])
-            except ZoomAPIError:
-                logger.info(f'Access token for user {user.id} seems to be invalid, attempting to clear.')
-                cls._clear_backend_metadata(user)
-                raise
-
-            new_zoom_data = {
-                'refresh_token': token['refresh_token'],
-                'access_token': token['access_token'],
-                'access_token_expires': cls._calculate_expires_at(token['expires_in']),
-            }
-            user.profile.backend_metadata['zoom'].update(new_zoom_data)
-            user.profile.save()
-        return user.profile.backend_metadata['zoom']['access_token']
+        if time() < zoom_meta['access_token_expires']:
+            cls._cache_access_token(user.id, zoom_meta)
+            return zoom_meta['access_token']
+        return cls.refresh_access_token(user)
+
+    @classmethod
+    def refresh_access_token(cls, user: User, refresh_ahead: float = 0) -> str:
+        '''
+        Refreshes the user's access token unless it's valid for more than refresh_ahead seconds.
+        The profile row is locked while refreshing, so concurrent requests and processes
+        refresh once and the rest pick up the new token, rather than spending the same
+        (single-use) refresh token.
+        '''
+        from officehours_api.models import Profile
+        try:
+            with transaction.atomic():
+                profile = Profile.objects.select_for_update().get(user_id=user.id)
+                zoom_meta = profile.backend_metadata.get('zoom')
+                if not zoom_meta:
+                    raise ZoomAPIError('User is no longer authorized with Zoom.')
+                if time() + refresh_ahead < zoom_meta['access_token_expires']:
+                    logger.debug(f'Access token for {user.id} was already refreshed')
+                else:
+                    logger.debug(f'Refreshing token for {user.id}')
+                    # The refresh_tokens function from the PyZoom library replaces the request to /oauth/token
+                    # for the refresh token grant type
+                    token = refresh_tokens(cls.client_id, cls.client_secret, zoom_meta['refresh_token'])
+                    zoom_meta.update({
+                        'refresh_token': token['refresh_token'],
+                        'access_token': token['access_token'],
+                        'access_token_expires': cls._calculate_expires_at(token['expires_in']),
+                    })
+                    profile.save(update_fields=['backend_metadata'])
+        except ZoomServerError:
+            # Zoom is failing, which says nothing about the user's authorization
+            raise
+        except ZoomAPIError:
+            logger.info(f'Access token for user {user.id} seems to be invalid, attempting to clear.')
+            cls._clear_backend_metadata(user)
+            raise
+        # Keep the loaded profile current, so saving it later doesn't restore a spent refresh token
+        user.profile.backend_metadata['zoom'] = zoom_meta
+        cls._cache_access_token(user.id, zoom_meta)
+        return zoom_meta['access_token']
 
     @classmethod
     def _get_client(cls, user: User) -> ZoomClient:
-        """Gets a ZoomClient instance for the given user. Replaces the _get_session method."""
-        return ZoomClient(cls._get_access_token(user))
+        """
+        Gets a ZoomClient instance for the given user. Replaces the _get_session method.
+        Clients are cheap; their requests share one pooled session (see pyzoom_patch).
+        """
+        return ZoomClient(cls._get_access_token(user), base_url=cls.api_url)
+
+    @classmethod
+    def _meeting_topic(cls, attendee_names=None) -> str:
+        topic = 'Remote Office Hours Queue Meeting'
+        if attendee_names:
+            topic = f'{topic} with {attendee_names}'
+        return topic
 
     @classmethod
     def _create_meeting(cls, user: User, attendee_names=None) -> ZoomMeeting:
@@ -160,20 +236,20 @@ class Backend(BackendBase):
             use_pmi=False,
             waiting_room=True,
             watermark=False)
-        topic = 'Remote Office Hours Queue Meeting'
-        if attendee_names:
-            topic = f'{topic} with {attendee_names}'
+        topic = cls._meeting_topic(attendee_names)
         try:
             created_meeting_dict = client.meetings.create_meeting(
                 user_id=zoom_user_id, # Need this for the patched_create_meeting method
                 topic=topic,
-                start_time=datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ'),
+                start_time=timezone.now().strftime('%Y-%m-%dT%H:%M:%SZ'),
                 duration_min=60,
                 timezone='America/Detroit',
                 password=None,
                 default_password=False,
                 settings=meeting_settings
             )
+        except ZoomServerError:
+            raise
         except ZoomAPIError:
             logger.info(f'Access token for user {user.id} seems to be invalid, attempting to clear.')
             cls._clear_backend_metadata(user)
@@ -193,19 +269,75 @@ class Backend(BackendBase):
         return resp.json()
 
     @classmethod
-    def save_user_meeting(cls, backend_metadata: dict, assignee: User, attendee_names=None):
-        if not backend_metadata:
-            backend_metadata = {}
-        if backend_metadata.get('meeting_id'):
-            return backend_metadata
-        meeting = cls._create_meeting(assignee, attendee_names=attendee_names)
-        backend_metadata.update({
+    def _meeting_metadata(cls, meeting: ZoomMeeting) -> dict:
+        return {
             'user_id': meeting['host_id'],
             'meeting_id': meeting['id'],
             'numeric_meeting_id': meeting['id'],
             'meeting_url': meeting['join_url'],
             'host_meeting_url': f"{cls.base_domain_url}/s/{meeting['id']}",
+        }
+
+    @classmethod
+    def _claim_provisioned_meeting(cls, user: User, attendee_names=None) -> Optional[dict]:
+        """
+        Claims the oldest meeting provisioned for the user, if there is one.
+        Its topic is left for the provision_zoom_meetings command to update.
+        """
+        from officehours_api.models import ProvisionedMeeting
+        zoom_user_id = user.profile.backend_metadata.get('zoom', {}).get('user_id')
+        with transaction.atomic():
+            provisioned = (
+                ProvisionedMeeting.objects
+                .select_for_update(skip_locked=True)
+                .filter(host=user, claimed_at__isnull=True, backend_metadata__user_id=zoom_user_id)
+                .order_by('created_at')
+                .first()
+            )
+            if not provisioned:
+                return None
+            provisioned.claimed_at = timezone.now()
+            provisioned.topic = cls._meeting_topic(attendee_names)
+            provisioned.save(update_fields=['claimed_at', 'topic'])
+        logger.info("Claimed provisioned meeting %s for user %s", provisioned.backend_metadata['meeting_id'], user.id)
+        return provisioned.backend_metadata
+
+    @classmethod
+    def provision_meeting(cls, user: User) -> dict:
+        """Creates a meeting for the user to claim later, returning its metadata."""
+        from officehours_api.models import ProvisionedMeeting
+        metadata = cls._meeting_metadata(cls._create_meeting(user))
+        ProvisionedMeeting.objects.create(host=user, backend_metadata=metadata)
+        return metadata
+
+    @classmethod
+    def update_meeting_topic(cls, user: User, meeting_id: str, topic: str) -> None:
+        client = cls._get_client(user)
+        client.raw.patch(f'/meetings/{meeting_id}', body={
+            'topic': topic,
+            'start_time': timezone.now().strftime('%Y-%m-%dT%H:%M:%SZ'),
         })
+
+    @classmethod
+    def delete_meeting(cls, user: User, meeting_id: str) -> None:
+        client = cls._get_client(user)
+        client.raw.delete(f'/meetings/{meeting_id}')
+
+    @classmethod
+    def save_user_meeting(cls, backend_metadata: dict, assignee: User, attendee_names=None):
+        if not backend_metadata:
+            backend_metadata = {}
+        if backend_metadata.get('meeting_id'):
+            return backend_metadata
+        provisioned = (
+            cls._claim_provisioned_meeting(assignee, attendee_names=attendee_names)
+            if settings.ZOOM_MEETING_POOL_SIZE else None
+        )
+        if provisioned:
+            backend_metadata.update(provisioned)
+            return backend_metadata
+        meeting = cls._create_meeting(assignee, attendee_names=attendee_names)
+        backend_metadata.update(cls._meeting_metadata(meeting))
         return backend_metadata
 
     @classmethod
@@ -220,6 +352,7 @@ class Backend(BackendBase):
             'access_token_expires': cls._calculate_expires_at(token['expires_in']),
         })
         request.user.profile.backend_metadata['zoom'] = zoom_meta
+        cls._forget_access_token(request.user.id)
         me = cls._get_me(request.user)
         zoom_meta.update({
             'user_id': me['id'],
@@ -246,3 +379,21 @@ class Backend(BackendBase):
     @classmethod
     def is_authorized(cls, user: User) -> bool:
         return bool(user.profile.backend_metadata.get('zoom'))
+
+    @classmethod
+    def get_active_hosts(cls) -> QuerySet:
+        '''
+        Zoom-authorized hosts of open queues that allow Zoom meetings; the hosts
+        the background commands keep tokens and meetings ready for.
+        '''
+        return (
+            User.objects
+            .filter(
+                queue__status='open',
+                queue__deleted__isnull=True,
+                queue__allowed_backends__contains=['zoom'],
+                profile__backend_metadata__zoom__has_key='refresh_token',
+            )
+            .select_related('profile')
+            .distinct()
+        )
@@ -0,0 +1,26 @@
+from watchman.decorators import check
+
+from officehours_api.models import BACKEND_INSTANCES
+
+
+@check
+def _check_backend(name: str) -> dict:
+    breaker = BACKEND_INSTANCES[name].circuit_breaker
+    state = breaker.state
+    # Always ok: /status is a liveness probe, and restarting the app won't bring a backend back
+    status = {
+        'ok': True,
+        'circuit': state,
+        'failure_rate': round(breaker.current_failure_rate, 2),
+    }
+    if state != 'closed':
+        status['detail'] = f'Calls to {name} are failing fast until a probe succeeds.'
+    return {name: status}
+
+
+def backends() -> dict:
+    '''
+    Watchman check reporting the circuit breaker of each enabled backend, as seen by this process.
+    It's informational and never fails, so one failing backend doesn't take the app out of service.
+    '''
+    return {'backends': [_check_backend(name) for name in sorted(BACKEND_INSTANCES)]}
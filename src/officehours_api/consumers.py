@@ -1,25 +1,170 @@
+import logging
+import threading
+import time
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
 from asgiref.sync import async_to_sync
-from typing import Union
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.dispatch import receiver
-from django.db import transaction
-from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.db import connections, transaction
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
 
-from channels.generic.websocket import JsonWebsocketConsumer
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from channels.layers import get_channel_layer
 from safedelete.signals import post_softdelete
 
 from officehours_api.models import Queue, Meeting, Profile, QueueAnnouncement
-from officehours_api.permissions import is_host
+from officehours_api.permissions import invalidate_host_memberships
 from officehours_api.serializers import (
-    QueueHostSerializer, QueueAttendeeSerializer, MyUserSerializer
+    MyUserSerializer, get_active_announcements, get_queue_snapshot, invalidate_queue_snapshot,
+    render_announcements, render_queue_for_user,
 )
 
+logger = logging.getLogger(__name__)
+
+
+class BroadcastCoalescer:
+    '''
+    Collapses repeated group events (e.g. queue.update for the same queue) into
+    a single call of their send function. Within a transaction, only one
+    on_commit callback is registered per (group, event type); after commit,
+    further requests arriving within `window` seconds are absorbed into one
+    trailing broadcast. Send functions read the database when they run, so the
+    trailing broadcast always reflects every change made during the window.
+    Trailing broadcasts are sent by one long-lived dispatcher thread, which
+    keeps its database connection between them.
+    '''
+
+    def __init__(self, window: float):
+        self.window = window
+        # Guards the deadlines, senders and dispatcher, and wakes the dispatcher
+        self._condition = threading.Condition()
+        self._deadlines: Dict[Tuple[str, str], float] = {}
+        self._senders: Dict[Tuple[str, str], Callable[[], None]] = {}
+        self._dispatcher: Optional[threading.Thread] = None
+        # Database connections are thread-local, and so are their on_commit callbacks
+        self._local = threading.local()
+
+    @property
+    def _pending(self) -> Dict[Tuple[str, str], partial]:
+        return self._local.__dict__.setdefault('pending', {})
+
+    def schedule(self, group_name: str, event_type: str, send: Callable[[], None]):
+        key = (group_name, event_type)
+        with self._condition:
+            self._senders[key] = send
+        callback = self._pending.get(key)
+        # A rolled back callback is dropped from run_on_commit without ever running
+        if callback and any(func is callback for _, func, _ in transaction.get_connection().run_on_commit):
+            return
+        callback = partial(self._on_commit, key)
+        self._pending[key] = callback
+        transaction.on_commit(callback)
 
-class QueueConsumer(JsonWebsocketConsumer):
+    def _on_commit(self, key: Tuple[str, str]):
+        self._pending.pop(key, None)
+        self._dispatch(key)
+
+    def _dispatch(self, key: Tuple[str, str]):
+        if self.window <= 0:
+            self._send(key)
+            return
+        with self._condition:
+            if key in self._deadlines:
+                return
+            self._deadlines[key] = time.monotonic() + self.window
+            # Started on first use, and again in a process forked after that
+            if self._dispatcher is None or not self._dispatcher.is_alive():
+                self._dispatcher = threading.Thread(
+                    target=self._run, name=f'{type(self).__name__}-dispatcher', daemon=True
+                )
+                self._dispatcher.start()
+            self._condition.notify()
+
+    def _take_due(self) -> List[Tuple[str, str]]:
+        '''
+        Wait for the earliest deadline, then remove and return the keys that are due.
+        '''
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                due = [key for key, deadline in self._deadlines.items() if deadline <= now]
+                if due:
+                    for key in due:
+                        del self._deadlines[key]
+                    return due
+                timeout = min(self._deadlines.values()) - now if self._deadlines else None
+                self._condition.wait(timeout)
+
+    def _run(self):
+        while True:
+            for key in self._take_due():
+                self._send(key)
+            # Keep the connection between flushes, but replace it once it's broken
+            for connection in connections.all(initialized_only=True):
+                if connection.errors_occurred and not connection.is_usable():
+                    connection.close()
+
+    def _send(self, key: Tuple[str, str]):
+        group_name, event_type = key
+        with self._condition:
+            send = self._senders[key]
+        try:
+            send()
+        except Exception:
+            logger.exception(f'Error while broadcasting {event_type} to {group_name}')
+
+
+broadcaster = BroadcastCoalescer(settings.WEBSOCKET_BROADCAST_WINDOW)
+# Snapshot invalidation must not wait for the broadcast window, but is still
+# worth collapsing to one cache write per queue and transaction.
+invalidator = BroadcastCoalescer(0)
+
+
+def diff_queue(previous: dict, current: dict) -> Optional[List[Tuple[str, dict]]]:
+    '''
+    Describe the change between two renderings of a queue for the same user as
+    delta messages. Returns None if the renderings don't have the same fields
+    (e.g. the user was added as a host), meaning a full snapshot is needed.
+    '''
+    if previous.keys() != current.keys():
+        return None
+    changes: List[Tuple[str, dict]] = []
+    changed_fields = {
+        field: value for field, value in current.items()
+        if field != 'meeting_set' and value != previous[field]
+    }
+    if changed_fields:
+        changes.append(('queue_fields_changed', changed_fields))
+    if 'meeting_set' in current:
+        previous_meetings = {meeting['id']: meeting for meeting in previous['meeting_set']}
+        current_ids = {meeting['id'] for meeting in current['meeting_set']}
+        for meeting_id in sorted(previous_meetings.keys() - current_ids):
+            changes.append(('meeting_removed', {'id': meeting_id}))
+        for meeting in current['meeting_set']:
+            if meeting['id'] not in previous_meetings:
+                changes.append(('meeting_added', meeting))
+            elif meeting != previous_meetings[meeting['id']]:
+                changes.append(('meeting_changed', meeting))
+    return changes
+
+
+class QueueConsumer(AsyncJsonWebsocketConsumer):
+    '''
+    Sends the full queue in an "init" message on connect, then only the
+    changes in sequenced delta messages. A client that misses a sequence
+    number sends {"type": "resync"} to receive a full "update" snapshot.
+    Only connect touches the database; events carry the rendered queue.
+    '''
     _queue_id: int
     _user: User
+    _queue_state: dict
+    _seq: int
 
     @staticmethod
     def get_group_name(queue_id):
@@ -40,99 +185,97 @@ class QueueConsumer(JsonWebsocketConsumer):
     def user(self):
         return self._user
 
-    def connect(self):
+    async def connect(self):
         try:
             self._queue_id = int(self.scope['url_route']['kwargs']['queue_id'])
             self._user = self.scope["user"]
-            queue = Queue.objects.get(pk=self.queue_id)
-        except (Queue.DoesNotExist):
-            self.accept()
-            self.close(code=4404)
-            return
         except (ValueError):
-            self.accept()
-            self.close(code=4405)
+            await self.accept()
+            await self.close(code=4405)
+            return
+        content = await database_sync_to_async(get_queue_snapshot)(self.queue_id)
+        if content is None:
+            await self.accept()
+            await self.close(code=4404)
             return
 
-        QueueSerializer = (
-            QueueHostSerializer
-            if is_host(self.user, queue)
-            else QueueAttendeeSerializer
-        )
-
-        async_to_sync(self.channel_layer.group_add)(
+        await self.channel_layer.group_add(
             self.group_name,
             self.channel_name
         )
-        self.accept()
-        queue_data = QueueSerializer(queue, context={'user': self.user}).data
-        self.send_json({
+        await self.accept()
+        self._queue_state = self.render_queue(content)
+        self._seq = 0
+        await self.send_json({
             'type': 'init',
-            'content': queue_data,
+            'seq': self._seq,
+            'content': self._queue_state,
+        })
+
+    async def receive_json(self, content, **kwargs):
+        if content.get('type') == 'resync' and hasattr(self, '_queue_state'):
+            await self.send_sequenced('update', self._queue_state)
+
+    async def send_sequenced(self, message_type: str, content: dict):
+        self._seq += 1
+        await self.send_json({
+            'type': message_type,
+            'seq': self._seq,
+            'content': content,
         })
 
-    def disconnect(self, close_code):
+    async def disconnect(self, close_code):
         try:
-            async_to_sync(self.channel_layer.group_discard)(
+            await self.channel_layer.group_discard(
                 self.group_name,
                 self.channel_name
             )
         except:
             pass # queue_id not set yet
 
-    def queue_update(self, event):
-        try:
-            queue = Queue.objects.get(pk=self.queue_id)
-        except Queue.DoesNotExist:
-            self.send_json({
-                'type': 'deleted',
-            })
+    def render_queue(self, content: dict) -> dict:
+        return render_queue_for_user(content, self.user)
+
+    async def queue_update(self, event):
+        content = event['content']
+        queue_data = self.render_queue(content)
+        changes = diff_queue(self._queue_state, queue_data)
+        self._queue_state = queue_data
+        if changes is None:
+            await self.send_sequenced('update', queue_data)
             return
-        QueueSerializer = (
-            QueueHostSerializer
-            if is_host(self.user, queue)
-            else QueueAttendeeSerializer
-        )
-        queue_data = QueueSerializer(
-            queue,
-            context={'user': self.user},
-        ).data
-        self.send_json({
-            'type': 'update',
-            'content': queue_data,
-        })
+        for message_type, content in changes:
+            await self.send_sequenced(message_type, content)
 
-    def queue_deleted(self, event):
-        self.send_json({
+    async def queue_deleted(self, event):
+        await self.send_json({
             'type': 'deleted',
         })
 
-    def announcement_update(self, event):
-        try:
-            queue = Queue.objects.get(pk=self.queue_id)
-        except Queue.DoesNotExist:
-            return
-        QueueSerializer = (
-            QueueHostSerializer
-            if is_host(self.user, queue)
-            else QueueAttendeeSerializer
+    async def announcement_update(self, event):
+        content = event['content']
+        host_view = self.user.is_superuser or self.user.id in content['host_ids']
+        my_meeting = (
+            content['my_meetings'].get(str(self.user.id))
+            if self.user.is_authenticated else None
         )
-        queue_data = QueueSerializer(
-            queue,
-            context={'user': self.user},
-        ).data
-        self.send_json({
+        await self.send_json({
             'type': 'announcement_update',
-            'content': queue_data.get('current_announcement'),
+            'content': render_announcements(content, self.user, host_view, my_meeting),
         })
 
 
 def send_queue_update(queue_id: int, channel_layer=None):
+    content = get_queue_snapshot(queue_id)
+    if content is None:
+        send_queue_delete(queue_id, channel_layer)
+        return
     channel_layer = channel_layer or get_channel_layer()
     async_to_sync(channel_layer.group_send)(
         QueueConsumer.get_group_name(queue_id),
         {
             'type': 'queue.update',
+            'content': content,
         }
     )
 
@@ -148,29 +291,70 @@ def send_queue_delete(queue_id: int, channel_layer=None):
 
 
 def send_announcement_update(queue_id: int, channel_layer=None):
+    try:
+        queue = Queue.objects.get(pk=queue_id)
+    except Queue.DoesNotExist:
+        return
+    assignees = (
+        queue.meeting_set
+        .filter(attendees__isnull=False)
+        .values_list('attendees__id', 'assignee_id')
+    )
     channel_layer = channel_layer or get_channel_layer()
     async_to_sync(channel_layer.group_send)(
         QueueConsumer.get_group_name(queue_id),
         {
             'type': 'announcement.update',
+            'content': {
+                'host_ids': list(queue.hosts.values_list('id', flat=True)),
+                'announcements': get_active_announcements(queue),
+                'my_meetings': {
+                    str(attendee_id): {'assignee': assignee_id}
+                    for attendee_id, assignee_id in assignees
+                },
+            },
         }
     )
 
 
+def schedule_snapshot_invalidation(queue_id: int):
+    invalidator.schedule(
+        QueueConsumer.get_group_name(queue_id), 'snapshot.invalidate',
+        partial(invalidate_queue_snapshot, queue_id),
+    )
+
+
+def schedule_queue_update(queue_id: int):
+    schedule_snapshot_invalidation(queue_id)
+    broadcaster.schedule(
+        QueueConsumer.get_group_name(queue_id), 'queue.update',
+        partial(send_queue_update, queue_id),
+    )
+
+
+def schedule_announcement_update(queue_id: int):
+    broadcaster.schedule(
+        QueueConsumer.get_group_name(queue_id), 'announcement.update',
+        partial(send_announcement_update, queue_id),
+    )
+
+
 @receiver(post_save, sender=Queue)
 def trigger_queue_update(sender, instance: Queue, created, **kwargs):
     if instance.deleted:
         return
-    transaction.on_commit(lambda: send_queue_update(instance.id))
-    for host in instance.hosts.all():
-        transaction.on_commit(lambda: send_user_update(host.id))
+    schedule_queue_update(instance.id)
+    for host_id in instance.hosts.values_list('id', flat=True):
+        schedule_user_update(host_id)
 
 
 @receiver(post_softdelete, sender=Queue)
 def trigger_queue_delete(sender, instance: Queue, **kwargs):
-    transaction.on_commit(lambda: send_queue_delete(instance.id))
-    for host in instance.hosts.all():
-        transaction.on_commit(lambda: send_user_update(host.id))
+    queue_id = instance.id
+    transaction.on_commit(lambda: invalidate_queue_snapshot(queue_id))
+    transaction.on_commit(lambda: send_queue_delete(queue_id))
+    for host_id in instance.hosts.values_list('id', flat=True):
+        schedule_user_update(host_id)
 
 
 @receiver(post_save, sender=Meeting)
@@ -178,21 +362,22 @@ def trigger_queue_delete(sender, instance: Queue, **kwargs):
 def trigger_queue_update_for_meeting(sender, instance: Meeting, **kwargs):
     if instance.queue_id is None:
         return
-    transaction.on_commit(lambda: send_queue_update(instance.queue_id))
+    schedule_queue_update(instance.queue_id)
 
 
 @receiver(m2m_changed, sender=Queue.hosts.through)
 def trigger_queue_update_for_hosts(sender, instance, action, pk_set, **kwargs):
     if action not in ["post_remove", "post_clear", "post_add"]:
         return
+    invalidate_host_memberships()
     if isinstance(instance, Queue):
-        transaction.on_commit(lambda: send_queue_update(instance.id))
-        for host_id in pk_set:
-            transaction.on_commit(lambda: send_user_update(host_id))
+        schedule_queue_update(instance.id)
+        for host_id in pk_set or ():
+            schedule_user_update(host_id)
     else:
-        transaction.on_commit(lambda: send_user_update(instance.id))
-        for queue_id in pk_set:
-            transaction.on_commit(lambda: send_queue_update(queue_id))
+        schedule_user_update(instance.id)
+        for queue_id in pk_set or ():
+            schedule_queue_update(queue_id)
 
 
 @receiver(post_save, sender=QueueAnnouncement)
@@ -200,11 +385,11 @@ def trigger_queue_update_for_hosts(sender, instance, action, pk_set, **kwargs):
 def trigger_queue_update_for_announcement(sender, instance: QueueAnnouncement, **kwargs):
     if instance.queue_id is None:
         return
-    transaction.on_commit(lambda: send_queue_update(instance.queue_id))
-    transaction.on_commit(lambda: send_announcement_update(instance.queue_id))
+    schedule_queue_update(instance.queue_id)
+    schedule_announcement_update(instance.queue_id)
 
 
-class UserConsumer(JsonWebsocketConsumer):
+class UserConsumer(AsyncJsonWebsocketConsumer):
     _user_id: int
     _user: User
 
@@ -224,46 +409,61 @@ class UserConsumer(JsonWebsocketConsumer):
     def user(self):
         return self._user
 
-    def connect(self):
+    async def connect(self):
         self._user_id = int(self.scope['url_route']['kwargs']['user_id'])
         self._user = self.scope["user"]
-        async_to_sync(self.channel_layer.group_add)(
+        await self.channel_layer.group_add(
             self.group_name,
             self.channel_name
         )
-        self.accept()
+        await self.accept()
         try:
-            user_data = MyUserSerializer(
-                User.objects.get(pk=self.user_id), context={'user': self.user}
-            ).data
+            user_data = await self.serialize_user()
         except User.DoesNotExist:
-            self.close(code=4404)
+            await self.close(code=4404)
             return
-        self.send_json({
+        await self.send_json({
             'type': 'init',
             'content': user_data,
         })
 
-    def disconnect(self, close_code):
-        async_to_sync(self.channel_layer.group_discard)(
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(
             self.group_name,
             self.channel_name
         )
 
-    def user_update(self, event):
-        user_data = MyUserSerializer(
+    @database_sync_to_async
+    def serialize_user(self) -> dict:
+        # Fetch and render in one trip to the thread pool
+        return MyUserSerializer(
             User.objects.get(pk=self.user_id), context={'user': self.user}
         ).data
-        self.send_json({
+
+    async def user_update(self, event):
+        user_data = await self.serialize_user()
+        await self.send_json({
             'type': 'update',
             'content': user_data,
         })
 
-    def user_deleted(self, event):
-        self.send_json({
+    async def user_deleted(self, event):
+        await self.send_json({
             'type': 'deleted',
         })
 
+    async def meeting_started(self, event):
+        await self.send_json({
+            'type': 'meeting_started',
+            'content': event['content'],
+        })
+
+    async def meeting_start_failed(self, event):
+        await self.send_json({
+            'type': 'meeting_start_failed',
+            'content': event['content'],
+        })
+
 
 def send_user_update(user_id: int, channel_layer=None):
     channel_layer = channel_layer or get_channel_layer()
@@ -275,6 +475,13 @@ def send_user_update(user_id: int, channel_layer=None):
     )
 
 
+def schedule_user_update(user_id: int):
+    broadcaster.schedule(
+        UserConsumer.get_group_name(user_id), 'user.update',
+        partial(send_user_update, user_id),
+    )
+
+
 def send_user_deleted(user_id: int, channel_layer=None):
     channel_layer = channel_layer or get_channel_layer()
     async_to_sync(channel_layer.group_send)(
@@ -285,9 +492,49 @@ def send_user_deleted(user_id: int, channel_layer=None):
     )
 
 
+def send_meeting_start_result(user_id: int, meeting_id: int, error: Optional[str] = None, channel_layer=None):
+    '''
+    Tell the assignee's sockets how an asynchronous meeting start went.
+    The meeting itself reaches them in the usual queue and user updates.
+    '''
+    channel_layer = channel_layer or get_channel_layer()
+    async_to_sync(channel_layer.group_send)(
+        UserConsumer.get_group_name(user_id),
+        {
+            'type': 'meeting.start_failed' if error else 'meeting.started',
+            'content': {'id': meeting_id, 'detail': error} if error else {'id': meeting_id},
+        }
+    )
+
+
 @receiver(post_save, sender=User)
-def trigger_user_update(sender, instance: User, **kwargs):
-    transaction.on_commit(lambda: send_user_update(instance.id))
+def trigger_user_update(sender, instance: User, update_fields=None, **kwargs):
+    schedule_user_update(instance.id)
+    # Only names appear in queue snapshots; skip e.g. the last_login update on every login
+    if update_fields is not None and not set(update_fields) & {'username', 'first_name', 'last_name'}:
+        return
+    queue_ids = (
+        Queue.objects
+        .filter(Q(hosts=instance) | Q(meeting__attendees=instance))
+        .values_list('id', flat=True)
+        .distinct()
+    )
+    for queue_id in queue_ids:
+        schedule_snapshot_invalidation(queue_id)
+
+
+@receiver(pre_delete, sender=User)
+def trigger_queue_update_for_deleted_user(sender, instance: User, **kwargs):
+    # Deleting the user unassigns meetings and removes host and attendee rows without
+    # signals that reach schedule_queue_update, so collect the queues while the rows remain
+    queue_ids = (
+        Queue.objects
+        .filter(Q(hosts=instance) | Q(meeting__attendees=instance) | Q(meeting__assignee=instance))
+        .values_list('id', flat=True)
+        .distinct()
+    )
+    for queue_id in queue_ids:
+        schedule_queue_update(queue_id)
 
 
 @receiver(post_delete, sender=User)
@@ -299,8 +546,7 @@ def trigger_user_deleted(sender, instance: User, **kwargs):
 @receiver(post_delete, sender=Profile)
 def trigger_user_update_for_profile(sender, instance: Profile, **kwargs):
     # Get user_id before commit in case user or profile are deleted or unlinked
-    user_id = instance.user.id
-    transaction.on_commit(lambda: send_user_update(user_id))
+    schedule_user_update(instance.user.id)
 
 
 @receiver(m2m_changed, sender=User.meeting_set.through)
@@ -315,7 +561,11 @@ def trigger_user_update_for_meetings(
     ):
         return
     if isinstance(instance, User):
-        transaction.on_commit(lambda: send_user_update(instance.id))
+        schedule_user_update(instance.id)
+        queue_ids = Meeting.objects.filter(pk__in=pk_set or ()).values_list('queue_id', flat=True)
     else:  # is Meeting
-        for user_id in pk_set:
-            transaction.on_commit(lambda: send_user_update(user_id))
+        for user_id in pk_set or ():
+            schedule_user_update(user_id)
+        queue_ids = [instance.queue_id]
+    for queue_id in set(queue_ids) - {None}:
+        schedule_queue_update(queue_id)
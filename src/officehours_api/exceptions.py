@@ -19,6 +19,15 @@ class BackendException(Exception):
         )
 
 
+class BackendUnavailableException(BackendException):
+    def __init__(self, backend_type: IMPLEMENTED_BACKEND_NAME):
+        super().__init__(backend_type)
+        self.message = (
+            f'{self.backend_type.capitalize()} has been failing, so meetings can\'t be started with it right now. '
+            f'Please try again in a few minutes, or check the ITS Status page (https://status.its.umich.edu/).'
+        )
+
+
 class DisabledBackendException(Exception):
 
     def __init__(self, backend_type: IMPLEMENTED_BACKEND_NAME):
@@ -48,6 +57,10 @@ class TwilioClientNotInitializedException(Exception):
             self.message = "Twilio client not initialized."
 
 def backend_error_handler(exc, context):
+    if isinstance(exc, BackendUnavailableException):
+        # Failing fast while the backend's circuit is open = Service Unavailable
+        logger.warning(exc.message)
+        return Response({'detail': exc.message}, status=503)
     if isinstance(exc, BackendException):
         # BackendException = Bad Gateway
         logger.exception(exc.message)
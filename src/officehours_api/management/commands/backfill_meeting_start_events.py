@@ -0,0 +1,85 @@
+import json
+from typing import Dict, Iterable, Type
+
+from django.core.management.base import BaseCommand
+from django.db import models
+from rest_framework_tracking.models import APIRequestLog
+
+from officehours_api.models import MeetingStartEvent, Queue, meeting_start_event_fields
+
+
+def backfill_meeting_start_events(
+    request_log_model: Type[models.Model], event_model: Type[models.Model], queue_ids: Iterable[int],
+    batch_size: int, update_conflicts: bool = True,
+) -> int:
+    '''
+    Create events from the responses of MeetingStart requests in the API request log.
+    Takes the models so the 0045 migration can run it with its historical ones.
+    Events already recorded are overwritten only with update_conflicts.
+    '''
+    queue_ids = set(queue_ids)
+    logged_responses = (
+        request_log_model.objects
+        .filter(view='officehours_api.views.MeetingStart')
+        .order_by('id')
+        .values_list('response', 'requested_at')
+        .iterator(chunk_size=batch_size)
+    )
+    # Keyed by meeting, as one upsert can't touch the same row twice
+    batch: Dict[int, models.Model] = {}
+    created = 0
+    for logged_response, requested_at in logged_responses:
+        try:
+            data = json.loads(logged_response)
+        except (TypeError, ValueError):
+            continue
+        if not isinstance(data, dict) or not data.get('created_at') or data.get('queue') not in queue_ids:
+            continue
+        event = event_model(**meeting_start_event_fields(data), started_at=requested_at)
+        batch[event.meeting_id] = event
+        if len(batch) >= batch_size:
+            created += save_events(event_model, batch, update_conflicts)
+    created += save_events(event_model, batch, update_conflicts)
+    return created
+
+
+def save_events(event_model: Type[models.Model], batch: Dict[int, models.Model], update_conflicts: bool) -> int:
+    if update_conflicts:
+        update_fields = [
+            field.name for field in event_model._meta.concrete_fields
+            if not field.primary_key and field.name != 'meeting_id'
+        ]
+        event_model.objects.bulk_create(
+            batch.values(),
+            update_conflicts=True,
+            unique_fields=['meeting_id'],
+            update_fields=update_fields,
+        )
+    else:
+        event_model.objects.bulk_create(batch.values(), ignore_conflicts=True)
+    count = len(batch)
+    batch.clear()
+    return count
+
+
+class Command(BaseCommand):
+    help = (
+        'Create MeetingStartEvent rows for meetings started before they were recorded, '
+        'from the responses of MeetingStart requests in the API request log. '
+        'Migrations already do this once; safe to run more than once, and later starts of the same meeting win.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            dest='batch_size',
+            type=int,
+            default=1000,
+            help='Number of log rows to read and events to write at a time.'
+        )
+
+    def handle(self, *args, **options):
+        created = backfill_meeting_start_events(
+            APIRequestLog, MeetingStartEvent, Queue.all_objects.values_list('id', flat=True), options['batch_size']
+        )
+        self.stdout.write(f'Backfilled {created} meeting start events.')
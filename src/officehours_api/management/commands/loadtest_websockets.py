@@ -0,0 +1,278 @@
+import asyncio
+import statistics
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from channels.auth import AuthMiddlewareStack
+from channels.routing import URLRouter
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from safedelete import HARD_DELETE
+
+import officehours_api.routing
+from officehours_api.consumers import broadcaster
+from officehours_api.models import Meeting, Queue
+
+
+USER_PREFIX = 'loadtest-'
+
+
+class QueryCounter:
+    '''
+    Database execute wrapper counting queries on every connection it's installed on,
+    including the ones opened by broadcast timer threads.
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+class Socket:
+    def __init__(self, application, path: str, client: Client):
+        session_cookie = client.cookies[settings.SESSION_COOKIE_NAME]
+        self.communicator = ApplicationCommunicator(application, {
+            'type': 'websocket',
+            'path': path,
+            'headers': [(b'cookie', f'{session_cookie.key}={session_cookie.value}'.encode())],
+        })
+        self.arrivals: List[float] = []
+        self.received = asyncio.Event()
+        self._reader: Optional[asyncio.Task] = None
+
+    async def connect(self):
+        await self.communicator.send_input({'type': 'websocket.connect'})
+        self._reader = asyncio.create_task(self._read())
+
+    async def _read(self):
+        while True:
+            message = await self.communicator.receive_output(timeout=None)
+            if message['type'] != 'websocket.send':
+                continue
+            self.arrivals.append(time.perf_counter())
+            self.received.set()
+
+    async def close(self):
+        self._reader.cancel()
+        await self.communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await self.communicator.wait(timeout=5)
+
+
+class LoadTestQueue:
+    def __init__(self, queue: Queue, hosts: List[User], attendees: List[User]):
+        self.queue = queue
+        self.hosts = hosts
+        self.attendees = attendees
+        self.clients: Dict[int, Client] = {}
+        for user in hosts + attendees:
+            client = Client()
+            client.force_login(user)
+            self.clients[user.id] = client
+        self.queue_sockets: Dict[int, Socket] = {}
+        self.user_sockets: List[Socket] = []
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure websocket fan-out: open queue (and optionally user) sockets against '
+        'the ASGI websocket application, drive meetings through create/assign/start/delete '
+        'via the REST views, and report delivery latency, queries per event and messages per second. '
+        f'Creates "{USER_PREFIX}*" users and queues in the configured database and then deletes the ones it created; '
+        'do not run it against production.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queues', type=int, default=1, help='Number of queues.')
+        parser.add_argument('--hosts', type=int, default=2, help='Hosts (each with a queue socket) per queue.')
+        parser.add_argument('--attendees', type=int, default=50, help='Attendees (each with a queue socket) per queue.')
+        parser.add_argument('--rounds', type=int, default=5, help='Meeting lifecycles to drive per queue.')
+        parser.add_argument(
+            '--user-sockets', dest='user_sockets', action='store_true',
+            help='Also open a user socket for every host and attendee.'
+        )
+        parser.add_argument(
+            '--layer', choices=['memory', 'configured'], default='memory',
+            help=(
+                'Channel layer and queue cache to use. "memory" runs in-process without the broadcast window; '
+                '"configured" uses CHANNEL_LAYERS, CACHES (e.g. Redis) and WEBSOCKET_BROADCAST_WINDOW.'
+            )
+        )
+        parser.add_argument('--timeout', type=float, default=10, help='Seconds to wait for an event to reach every socket.')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        counter = QueryCounter()
+        connection_created.connect(counter.install)
+        # Reconnect so this thread's connection gets the counter too
+        connections.close_all()
+        overrides = {}
+        window = broadcaster.window
+        if options['layer'] == 'memory':
+            overrides['CHANNEL_LAYERS'] = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+            overrides['CACHES'] = {
+                **settings.CACHES,
+                'queues': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'queues'},
+            }
+            # The dispatcher thread runs its own event loop, which an in-memory layer can't deliver from
+            broadcaster.window = 0
+        # Rows this run created, recorded as they're created so a failed setup is cleaned up too
+        self.user_ids: List[int] = []
+        self.queue_ids: List[int] = []
+        try:
+            with override_settings(**overrides):
+                try:
+                    queues = self.create_queues(options)
+                    async_to_sync(self.run)(queues, counter, options)
+                finally:
+                    self.delete_created()
+        finally:
+            broadcaster.window = window
+            connection_created.disconnect(counter.install)
+            teardown_test_environment()
+
+    def create_user(self, username: str) -> User:
+        user = User.objects.create(username=username)
+        self.user_ids.append(user.id)
+        return user
+
+    def create_queues(self, options) -> List[LoadTestQueue]:
+        # Unique per run, so runs alongside each other don't collide on usernames
+        prefix = f'{USER_PREFIX}{uuid.uuid4().hex[:8]}-'
+        queues = []
+        for q in range(options['queues']):
+            hosts = [self.create_user(f'{prefix}q{q}-host{h}') for h in range(options['hosts'])]
+            attendees = [self.create_user(f'{prefix}q{q}-attendee{a}') for a in range(options['attendees'])]
+            queue = Queue.objects.create(name=f'{prefix}{q}', allowed_backends=['inperson'])
+            self.queue_ids.append(queue.id)
+            queue.hosts.set(hosts)
+            queues.append(LoadTestQueue(queue, hosts, attendees))
+        return queues
+
+    def delete_created(self):
+        Meeting.all_objects.filter(queue_id__in=self.queue_ids).delete(force_policy=HARD_DELETE)
+        Queue.all_objects.filter(id__in=self.queue_ids).delete(force_policy=HARD_DELETE)
+        User.objects.filter(id__in=self.user_ids).delete()
+
+    async def run(self, queues: List[LoadTestQueue], counter: QueryCounter, options):
+        application = AuthMiddlewareStack(URLRouter(officehours_api.routing.websocket_urlpatterns))
+        sockets: List[Socket] = []
+        for load_test_queue in queues:
+            for user in load_test_queue.hosts + load_test_queue.attendees:
+                client = load_test_queue.clients[user.id]
+                queue_socket = Socket(application, f'/ws/queues/{load_test_queue.queue.id}/', client)
+                load_test_queue.queue_sockets[user.id] = queue_socket
+                if options['user_sockets']:
+                    load_test_queue.user_sockets.append(Socket(application, f'/ws/users/{user.id}/', client))
+            sockets += list(load_test_queue.queue_sockets.values()) + load_test_queue.user_sockets
+        for socket in sockets:
+            await socket.connect()
+        # Every socket sends an init message once connected
+        await self.wait_for(sockets, options['timeout'])
+        self.stdout.write(f'Opened {len(sockets)} sockets.')
+
+        latencies: List[float] = []
+        queries: List[int] = []
+        timeouts = 0
+        start_arrivals = sum(len(socket.arrivals) for socket in sockets)
+        started = time.perf_counter()
+        for round_number in range(options['rounds']):
+            for load_test_queue in queues:
+                for request, recipients in self.meeting_lifecycle(load_test_queue, round_number):
+                    for socket in recipients:
+                        socket.received.clear()
+                    counter.count = 0
+                    sent = time.perf_counter()
+                    response = await sync_to_async(request)()
+                    if response.status_code >= 400:
+                        raise RuntimeError(f'{response.status_code} {response.content!r}')
+                    if not await self.wait_for(recipients, options['timeout']):
+                        timeouts += 1
+                    queries.append(counter.count)
+                    latencies += [
+                        next(arrival for arrival in socket.arrivals if arrival >= sent) - sent
+                        for socket in recipients
+                        if socket.received.is_set()
+                    ]
+        elapsed = time.perf_counter() - started
+        messages = sum(len(socket.arrivals) for socket in sockets) - start_arrivals
+
+        for socket in sockets:
+            await socket.close()
+        self.report(latencies, queries, timeouts, messages, elapsed)
+
+    def meeting_lifecycle(self, load_test_queue: LoadTestQueue, round_number: int):
+        '''
+        Yields the REST requests for one meeting, from creation to deletion, each
+        with the queue sockets whose view it changes. Sockets only receive deltas,
+        so other attendees hear nothing of an assignment or of a started meeting
+        being deleted. Each request is only built once the previous one has been sent.
+        '''
+        attendee = load_test_queue.attendees[round_number % len(load_test_queue.attendees)]
+        host = load_test_queue.hosts[round_number % len(load_test_queue.hosts)]
+        attendee_client = load_test_queue.clients[attendee.id]
+        host_client = load_test_queue.clients[host.id]
+        everyone = list(load_test_queue.queue_sockets.values())
+        hosts_and_attendee = [
+            load_test_queue.queue_sockets[user.id]
+            for user in load_test_queue.hosts + [attendee]
+        ]
+        meeting_ids = []
+
+        def create():
+            response = attendee_client.post('/api/meetings/', {
+                'queue': load_test_queue.queue.id,
+                'attendee_ids': [attendee.id],
+                'assignee_id': None,
+                'backend_type': 'inperson',
+            }, content_type='application/json')
+            meeting_ids.append(response.json().get('id'))
+            return response
+
+        yield create, everyone
+        meeting_url = f'/api/meetings/{meeting_ids[0]}/'
+        yield lambda: host_client.patch(meeting_url, {'assignee_id': host.id}, content_type='application/json'), hosts_and_attendee
+        yield lambda: host_client.post(f'{meeting_url}start/'), everyone
+        yield lambda: host_client.delete(meeting_url), hosts_and_attendee
+
+    async def wait_for(self, sockets: List[Socket], timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(socket.received.wait() for socket in sockets)),
+                timeout,
+            )
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def report(self, latencies: List[float], queries: List[int], timeouts: int, messages: int, elapsed: float):
+        self.stdout.write(f'Events: {len(queries)} ({timeouts} not delivered to every socket within the timeout)')
+        if len(latencies) > 1:
+            percentiles = statistics.quantiles(latencies, n=100)
+            self.stdout.write(
+                'Delivery latency (ms): '
+                f'p50 {percentiles[49] * 1000:.1f}, '
+                f'p90 {percentiles[89] * 1000:.1f}, '
+                f'p99 {percentiles[98] * 1000:.1f}, '
+                f'max {max(latencies) * 1000:.1f}'
+            )
+        if queries:
+            self.stdout.write(f'Queries per event: mean {statistics.mean(queries):.1f}, max {max(queries)}')
+        self.stdout.write(f'Messages delivered: {messages} in {elapsed:.2f}s ({messages / elapsed:.0f}/s)')
@@ -0,0 +1,104 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from pyzoom.err import APIError as ZoomAPIError
+from requests.exceptions import RequestException
+
+from officehours_api.backends.zoom import Backend as ZoomBackend
+from officehours_api.models import ProvisionedMeeting
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        'Keep ZOOM_MEETING_POOL_SIZE Zoom meetings ready for each host of an open queue, '
+        'give claimed meetings their topics, and replace meetings left unused. '
+        'Runs until stopped unless --once is passed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Update the pools once and exit.'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=15,
+            help='Seconds to wait between updates.'
+        )
+
+    def handle(self, *args, **options):
+        if not settings.ZOOM_MEETING_POOL_SIZE:
+            raise CommandError('The meeting pool is turned off; set ZOOM_MEETING_POOL_SIZE.')
+        while True:
+            self.update_topics()
+            active_hosts = ZoomBackend.get_active_hosts()
+            self.recycle(active_hosts)
+            self.refill(active_hosts)
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+            # Drop connections the database closed while we were idle
+            close_old_connections()
+
+    @staticmethod
+    def update_topics():
+        claimed = ProvisionedMeeting.objects.filter(claimed_at__isnull=False).select_related('host__profile')
+        for provisioned in claimed:
+            try:
+                ZoomBackend.update_meeting_topic(
+                    provisioned.host, provisioned.backend_metadata['meeting_id'], provisioned.topic
+                )
+            except (ZoomAPIError, RequestException, KeyError):
+                # The topic is cosmetic; don't retry it forever
+                logger.exception(f'Could not update the topic of provisioned meeting {provisioned.id}')
+            provisioned.delete()
+
+    @staticmethod
+    def recycle(active_hosts):
+        cutoff = timezone.now() - timedelta(days=settings.ZOOM_MEETING_POOL_MAX_AGE)
+        unused = ProvisionedMeeting.objects.filter(claimed_at__isnull=True).filter(
+            Q(created_at__lt=cutoff) | ~Q(host__in=active_hosts.values('id'))
+        )
+        for provisioned_id in unused.values_list('id', flat=True):
+            with transaction.atomic():
+                # Skip meetings being claimed right now
+                provisioned = (
+                    ProvisionedMeeting.objects
+                    .select_for_update(skip_locked=True, of=('self',))
+                    .select_related('host__profile')
+                    .filter(id=provisioned_id, claimed_at__isnull=True)
+                    .first()
+                )
+                if not provisioned:
+                    continue
+                if ZoomBackend.is_authorized(provisioned.host):
+                    try:
+                        ZoomBackend.delete_meeting(provisioned.host, provisioned.backend_metadata['meeting_id'])
+                    except (ZoomAPIError, RequestException):
+                        logger.exception(f'Could not delete provisioned meeting {provisioned.id} from Zoom')
+                provisioned.delete()
+
+    @staticmethod
+    def refill(active_hosts):
+        hosts = active_hosts.annotate(
+            ready=Count(
+                'provisioned_meetings', filter=Q(provisioned_meetings__claimed_at__isnull=True), distinct=True
+            )
+        ).filter(ready__lt=settings.ZOOM_MEETING_POOL_SIZE)
+        for host in hosts:
+            for _ in range(settings.ZOOM_MEETING_POOL_SIZE - host.ready):
+                try:
+                    ZoomBackend.provision_meeting(host)
+                except (ZoomAPIError, RequestException):
+                    logger.exception(f'Could not provision a meeting for user {host.id}')
+                    break
@@ -0,0 +1,113 @@
+import gzip
+import json
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_tracking.models import APIRequestLog
+
+
+class Command(BaseCommand):
+    help = (
+        'Archive API request log rows older than the retention period to gzipped JSON lines files, '
+        'then delete them in bounded batches. Safe to run on a schedule; each run picks up where the last stopped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.API_REQUEST_LOG_RETENTION_DAYS,
+            help='Keep rows requested within this many days (default: API_REQUEST_LOG_RETENTION_DAYS).'
+        )
+        parser.add_argument(
+            '--archive-dir',
+            dest='archive_dir',
+            default=settings.API_REQUEST_LOG_ARCHIVE_DIR,
+            help='Directory to write archives to (default: API_REQUEST_LOG_ARCHIVE_DIR).'
+        )
+        parser.add_argument(
+            '--no-archive',
+            dest='no_archive',
+            action='store_true',
+            help='Delete rows without archiving them.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            dest='batch_size',
+            type=int,
+            default=1000,
+            help='Number of rows to archive and delete per transaction.'
+        )
+        parser.add_argument(
+            '--max-batches',
+            dest='max_batches',
+            type=int,
+            default=None,
+            help='Stop after this many batches, to bound the time and WAL of one run.'
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0,
+            help='Seconds to sleep between batches, to let replication and autovacuum keep up.'
+        )
+        parser.add_argument(
+            '--dry-run',
+            dest='dry_run',
+            action='store_true',
+            help='Only report how many rows would be pruned.'
+        )
+
+    def handle(self, *args, **options):
+        if not options['archive_dir'] and not options['no_archive']:
+            raise CommandError('Set --archive-dir (or API_REQUEST_LOG_ARCHIVE_DIR), or pass --no-archive.')
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        expired = APIRequestLog.objects.filter(requested_at__lt=cutoff)
+        if options['dry_run']:
+            self.stdout.write(f'Would prune {expired.count()} request log rows older than {cutoff.isoformat()}.')
+            return
+
+        archive = None
+        if not options['no_archive']:
+            os.makedirs(options['archive_dir'], exist_ok=True)
+            archive_path = os.path.join(
+                options['archive_dir'], f'apirequestlog_{timezone.now().strftime("%Y%m%dT%H%M%S%f")}.jsonl.gz'
+            )
+            archive = gzip.open(archive_path, 'wt', encoding='utf-8')
+        pruned = 0
+        batches = 0
+        try:
+            while options['max_batches'] is None or batches < options['max_batches']:
+                with transaction.atomic():
+                    # Lock the batch so rows are archived exactly as they are deleted
+                    rows = list(
+                        expired.order_by('id').select_for_update(skip_locked=True).values()[:options['batch_size']]
+                    )
+                    if not rows:
+                        break
+                    if archive:
+                        for row in rows:
+                            archive.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+                        # Make sure the batch is on disk before its rows are gone
+                        archive.flush()
+                        os.fsync(archive.fileno())
+                    APIRequestLog.objects.filter(id__in=[row['id'] for row in rows]).delete()
+                pruned += len(rows)
+                batches += 1
+                if options['pause']:
+                    time.sleep(options['pause'])
+        finally:
+            if archive:
+                archive.close()
+                if not pruned:
+                    os.remove(archive_path)
+
+        self.stdout.write(f'Pruned {pruned} request log rows older than {cutoff.isoformat()}.')
+        if archive and pruned:
+            self.stdout.write(f'Archived them to {archive_path}.')
@@ -0,0 +1,65 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from pyzoom.err import APIError as ZoomAPIError
+from requests.exceptions import RequestException
+
+from officehours_api.backends.zoom import Backend as ZoomBackend
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        'Refresh the Zoom access tokens of hosts of open queues that are about to expire, '
+        'so starting a meeting rarely has to wait on a refresh. Runs until stopped unless --once is passed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Refresh expiring tokens once and exit.'
+        )
+        parser.add_argument(
+            '--ahead',
+            type=float,
+            default=settings.ZOOM_TOKEN_REFRESH_AHEAD,
+            help='Refresh tokens expiring within this many seconds (default: ZOOM_TOKEN_REFRESH_AHEAD).'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=300,
+            help='Seconds to wait between checks.'
+        )
+
+    def handle(self, *args, **options):
+        refreshed = 0
+        while True:
+            refreshed += self.refresh_expiring(options['ahead'])
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+            # Drop connections the database closed while we were idle
+            close_old_connections()
+        self.stdout.write(f'Refreshed {refreshed} Zoom access tokens.')
+
+    @staticmethod
+    def refresh_expiring(ahead: float) -> int:
+        # Other hosts' tokens are refreshed when they next need one, so dormant ones are left to expire
+        hosts = ZoomBackend.get_active_hosts().filter(
+            profile__backend_metadata__zoom__access_token_expires__lt=time.time() + ahead
+        )
+        refreshed = 0
+        for host in hosts:
+            try:
+                ZoomBackend.refresh_access_token(host, refresh_ahead=ahead)
+            except (ZoomAPIError, RequestException):
+                logger.exception(f'Could not refresh the Zoom access token for user {host.id}')
+                continue
+            refreshed += 1
+        return refreshed
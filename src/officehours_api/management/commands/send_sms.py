@@ -0,0 +1,56 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from officehours_api import notifications
+
+
+class Command(BaseCommand):
+    help = (
+        'Deliver SMS notifications queued in the outbox through Twilio, '
+        'several at a time, retrying failures with backoff. Runs until stopped unless --once is passed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once no messages are due, instead of polling for more.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            dest='batch_size',
+            type=int,
+            default=100,
+            help='Number of messages to claim from the outbox at a time.'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=settings.SMS_CONCURRENCY,
+            help='Number of messages to send at once (default: SMS_CONCURRENCY).'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=1,
+            help='Seconds to wait before polling again when no messages are due.'
+        )
+
+    def handle(self, *args, **options):
+        if notifications.twilio is None:
+            raise CommandError('Twilio is not configured; set the TWILIO_* settings or TWILIO_STAND_IN.')
+        sent = 0
+        while True:
+            count = notifications.deliver_pending_sms(options['batch_size'], options['concurrency'])
+            sent += count
+            if count:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+            # Drop connections the database closed while we were idle
+            close_old_connections()
+        self.stdout.write(f'Attempted {sent} messages.')
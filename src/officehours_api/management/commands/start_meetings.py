@@ -0,0 +1,78 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, transaction
+
+from officehours_api.consumers import send_meeting_start_result
+from officehours_api.exceptions import BackendException, DisabledBackendException
+from officehours_api.models import Meeting, MeetingStartEvent, MeetingStatus
+from officehours_api.serializers import MeetingSerializer
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        'Start meetings whose start was requested while ASYNC_MEETING_START is on, '
+        'and tell their assignees how it went. Runs until stopped unless --once is passed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once no meetings are waiting to start, instead of polling for more.'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=0.5,
+            help='Seconds to wait before polling again when no meetings are waiting to start.'
+        )
+
+    def handle(self, *args, **options):
+        started = 0
+        while True:
+            if self.start_next_meeting():
+                started += 1
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+            # Drop connections the database closed while we were idle
+            close_old_connections()
+        self.stdout.write(f'Attempted to start {started} meetings.')
+
+    @staticmethod
+    def start_next_meeting() -> bool:
+        with transaction.atomic():
+            # Other workers skip the meeting while it's being started, and it can't be deleted meanwhile
+            meeting = (
+                Meeting.objects
+                .select_for_update(skip_locked=True)
+                .filter(status_code=MeetingStatus.STARTING.value)
+                .order_by('id')
+                .first()
+            )
+            if not meeting:
+                return False
+            error = None
+            try:
+                meeting.start()
+            except DisabledBackendException as e:
+                error = e.message
+            except Exception as e:
+                error = e.message if isinstance(e, BackendException) else BackendException(meeting.backend_type).message
+                logger.exception(f'Could not start meeting {meeting.id}')
+            if error:
+                # Back to assigned, so the host can try again
+                meeting.backend_metadata = {}
+                meeting.save()
+            else:
+                meeting.save()
+                MeetingStartEvent.record(MeetingSerializer(meeting).data)
+            transaction.on_commit(
+                lambda: send_meeting_start_result(meeting.assignee_id, meeting.id, error)
+            )
+        return True
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.15 on 2026-10-17 17:21
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Q
+
+
+def populate_status_code(apps, schema_editor):
+    # Mirrors the Meeting.status property: unassigned, assigned, then started once backend metadata is set
+    Meeting = apps.get_model('officehours_api', 'Meeting')
+    Meeting.objects.filter(assignee__isnull=False).update(status_code=1)
+    Meeting.objects.filter(assignee__isnull=False)\
+        .exclude(Q(backend_metadata__isnull=True) | Q(backend_metadata={}))\
+        .update(status_code=2)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('officehours_api', '0033_update_simpler_meeting_start_logs_view'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='meeting',
+            name='status_code',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Unassigned'), (1, 'Assigned'), (2, 'Started')], default=0),
+        ),
+        migrations.RunPython(populate_status_code, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='meeting',
+            index=models.Index(fields=['queue', 'status_code'], name='meeting_queue_status_idx'),
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.2.15 on 2026-10-17 17:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('officehours_api', '0034_meeting_status_code'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MeetingStartEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('meeting_id', models.IntegerField(unique=True)),
+                ('attendee_id', models.IntegerField(null=True)),
+                ('attendee_user_id', models.IntegerField(null=True)),
+                ('attendee_uniqname', models.CharField(max_length=150, null=True)),
+                ('attendee_last_name', models.CharField(max_length=150, null=True)),
+                ('attendee_first_name', models.CharField(max_length=150, null=True)),
+                ('host_id', models.IntegerField(null=True)),
+                ('host_uniqname', models.CharField(max_length=150, null=True)),
+                ('host_last_name', models.CharField(max_length=150, null=True)),
+                ('host_first_name', models.CharField(max_length=150, null=True)),
+                ('meeting_type', models.CharField(max_length=20)),
+                ('meeting_url', models.TextField(null=True)),
+                ('agenda', models.CharField(blank=True, max_length=100)),
+                ('meeting_created_at', models.DateTimeField()),
+                ('queue', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='meeting_start_events', to='officehours_api.queue')),
+            ],
+        ),
+        migrations.DeleteModel(
+            name='MeetingStartLogsView',
+        ),
+        # Historic rows are copied from the API request log by 0045_backfill_meeting_start_events
+        migrations.RunSQL(
+            sql="""
+                DROP VIEW meeting_start_logs;
+            """,
+            reverse_sql="""
+                CREATE VIEW meeting_start_logs AS
+                WITH parsed_response AS (
+                    SELECT
+                        response::jsonb AS response
+                    FROM
+                        rest_framework_tracking_apirequestlog
+                    WHERE
+                        view::text = 'officehours_api.views.MeetingStart'
+                        AND (response::jsonb ->> 'created_at') IS NOT NULL
+                )
+                SELECT DISTINCT
+                    (response -> 'queue')::int AS queue_id,
+                    q.name AS queue_name,
+                    q.status AS queue_status,
+                    (response -> 'attendees' -> 0 ->> 'id')::int AS attendee_id,
+                    (response -> 'attendees' -> 0 ->> 'user_id')::int AS attendee_user_id,
+                    response -> 'attendees' -> 0 ->> 'username' AS attendee_uniqname,
+                    response -> 'attendees' -> 0 ->> 'last_name' AS attendee_last_name,
+                    response -> 'attendees' -> 0 ->> 'first_name' AS attendee_first_name,
+                    (response -> 'assignee' ->> 'id')::int AS host_id,
+                    response -> 'assignee' ->> 'username' AS host_uniqname,
+                    response -> 'assignee' ->> 'last_name' AS host_last_name,
+                    response -> 'assignee' ->> 'first_name' AS host_first_name,
+                    response -> 'backend_type' AS meeting_type,
+                    response -> 'backend_metadata' ->> 'meeting_url' AS meeting_url,
+                    response -> 'agenda' AS agenda,
+                    to_timestamp(response::jsonb ->> 'created_at'::text, 'YYYY-MM-DD"T"HH24:MI:SS.US'::text) AS meeting_created_at,
+                    q.deleted as queue_deleted_at
+                FROM
+                    parsed_response
+                JOIN officehours_api_queue q ON (response -> 'queue')::int = q.id
+            """
+        ),
+        migrations.AddIndex(
+            model_name='meetingstartevent',
+            index=models.Index(fields=['queue', 'meeting_created_at'], name='meeting_start_queue_time_idx'),
+        ),
+    ]
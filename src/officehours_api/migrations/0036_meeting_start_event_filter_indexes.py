@@ -0,0 +1,21 @@
+# Generated by Django 5.2.15 on 2026-10-17 17:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('officehours_api', '0035_meeting_start_event'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='meetingstartevent',
+            index=models.Index(fields=['queue', 'host_id', 'meeting_created_at'], name='meeting_start_queue_host_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='meetingstartevent',
+            index=models.Index(fields=['queue', 'attendee_uniqname'], name='meeting_start_queue_att_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.15 on 2026-10-17 17:49
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('officehours_api', '0036_meeting_start_event_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='meetingstartevent',
+            name='started_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='meetingstartevent',
+            index=models.Index(fields=['queue', 'started_at', 'id'], name='meeting_start_queue_start_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.15 on 2026-10-17 18:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('officehours_api', '0038_outbound_sms'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='otp_sms',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='officehours_api.outboundsms'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.15 on 2026-10-17 18:15
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('officehours_api', '0039_profile_otp_sms'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProvisionedMeeting',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('backend_metadata', models.JSONField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('topic', models.CharField(blank=True, max_length=200)),
+                ('host', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='provisioned_meetings', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['host', 'claimed_at', 'created_at'], name='provisioned_meeting_host_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.15 on 2026-10-17 18:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('officehours_api', '0040_provisioned_meeting'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='meeting',
+            name='status_code',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Unassigned'), (1, 'Assigned'), (2, 'Started'), (3, 'Starting')], default=0),
+        ),
+    ]
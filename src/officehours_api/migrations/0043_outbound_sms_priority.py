@@ -0,0 +1,18 @@
+# Generated by Django 5.2.15 on 2026-10-17 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('officehours_api', '0042_outbound_sms_dedupe_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboundsms',
+            name='priority',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations
+
+from officehours_api.management.commands.backfill_meeting_start_events import backfill_meeting_start_events
+
+
+def backfill(apps, schema_editor):
+    # Brings back the history the meeting_start_logs view showed before 0035 dropped it;
+    # events recorded since are newer than their logged starts, so they're kept
+    APIRequestLog = apps.get_model('rest_framework_tracking', 'APIRequestLog')
+    MeetingStartEvent = apps.get_model('officehours_api', 'MeetingStartEvent')
+    Queue = apps.get_model('officehours_api', 'Queue')
+    backfill_meeting_start_events(
+        APIRequestLog, MeetingStartEvent, Queue.objects.values_list('id', flat=True),
+        batch_size=1000, update_conflicts=False,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('officehours_api', '0044_outbound_sms_claimed_at'),
+        ('rest_framework_tracking', '0007_merge_20180419_1646'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
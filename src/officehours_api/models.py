@@ -1,20 +1,24 @@
 from enum import Enum
-from typing import List, Optional, Set, Tuple
+from typing import Dict, List, Optional, Set, Tuple
 
 from django.conf import settings
 from django.db import models
+from django.db.models import Prefetch
 from django.contrib.auth.models import User
 from django.contrib.postgres.fields import ArrayField
 from django.dispatch import receiver
-from django.db.models.signals import post_save, m2m_changed
+from django.db.models.signals import post_save, pre_delete, m2m_changed
 from django.core.validators import MaxLengthValidator
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from safedelete.managers import SafeDeleteManager
 from safedelete.models import (
     SafeDeleteModel, SOFT_DELETE_CASCADE, HARD_DELETE,
 )
-from requests.exceptions import RequestException
+from safedelete.queryset import SafeDeleteQueryset
 
 from officehours_api.exceptions import (
-    BackendException, DisabledBackendException, MeetingStartedException,
+    BackendException, BackendUnavailableException, DisabledBackendException, MeetingStartedException,
     NotAllowedBackendException
 )
 from officehours_api import backends
@@ -61,6 +65,8 @@ class Profile(models.Model):
     otp_phone_number = models.CharField(max_length=20, default="", blank=True, null=True)
     otp_token = models.CharField(max_length=4, default="", blank=True, null=True)
     otp_expiration = models.DateTimeField(null=True, blank=True, default=None)
+    # The text carrying the latest one-time password, whose delivery the client polls
+    otp_sms = models.ForeignKey('OutboundSMS', null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
 
     @property
     def authorized_backends(self):
@@ -79,10 +85,41 @@ def get_users_with_emails(manager: models.Manager):
         .exclude(profile__phone_number__exact='')
 
 
+def get_prefetched(instance: models.Model, related_name: str) -> Optional[List[models.Model]]:
+    '''
+    Returns the objects prefetched for a relation, or None if it wasn't prefetched.
+    '''
+    cache = getattr(instance, '_prefetched_objects_cache', {})
+    return list(cache[related_name]) if related_name in cache else None
+
+
+class QueueQuerySet(SafeDeleteQueryset):
+    def prefetch_for_serializers(self):
+        '''
+        Prefetch everything QueueHostSerializer and QueueAttendeeSerializer read,
+        so a queue renders in a constant number of queries however long it is.
+        '''
+        return self.prefetch_related(
+            'hosts',
+            Prefetch(
+                'meeting_set',
+                queryset=Meeting.objects.select_related('assignee').prefetch_related('attendees').order_by('id'),
+            ),
+            Prefetch(
+                'announcements',
+                queryset=QueueAnnouncement.objects.filter(active=True)
+                .select_related('created_by').order_by('-created_at'),
+                to_attr='active_announcements',
+            ),
+        )
+
+
 class Queue(SafeDeleteModel):
     _safedelete_policy = SOFT_DELETE_CASCADE
     deleted_by_cascade = None
 
+    objects = SafeDeleteManager.from_queryset(QueueQuerySet)()
+
     name = models.CharField(max_length=100)
     hosts = models.ManyToManyField(User)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -109,6 +146,23 @@ class Queue(SafeDeleteModel):
     def hosts_with_phone_numbers(self):
         return get_users_with_emails(self.hosts)
 
+    def get_line_places(self) -> Dict[int, int]:
+        '''
+        Returns the place in line of every unstarted meeting in the queue, keyed by meeting id.
+        '''
+        meetings = get_prefetched(self, 'meeting_set')
+        if meetings is not None:
+            meeting_ids = sorted(
+                meeting.id for meeting in meetings if meeting.status_code not in STARTED_STATUS_CODES
+            )
+            return {meeting_id: place for place, meeting_id in enumerate(meeting_ids)}
+        meeting_ids = (
+            self.meeting_set.unstarted()
+            .order_by('id')
+            .values_list('id', flat=True)
+        )
+        return {meeting_id: place for place, meeting_id in enumerate(meeting_ids)}
+
     def replace_allowed_backend_with_default(self, backend_name: IMPLEMENTED_BACKEND_NAME):
         new_allowed_backends = list(filter(lambda x: x != backend_name, self.allowed_backends))
         default_backend = get_default_backend()
@@ -128,6 +182,20 @@ class MeetingStatus(Enum):
     UNASSIGNED = 0
     ASSIGNED = 1
     STARTED = 2
+    # Waiting on the start_meetings command; after STARTED so its assignee and backend can't change
+    STARTING = 3
+
+
+# Starting meetings have left the line just like started ones
+STARTED_STATUS_CODES = (MeetingStatus.STARTED.value, MeetingStatus.STARTING.value)
+
+
+class MeetingQuerySet(SafeDeleteQueryset):
+    def started(self):
+        return self.filter(status_code__in=STARTED_STATUS_CODES)
+
+    def unstarted(self):
+        return self.exclude(status_code__in=STARTED_STATUS_CODES)
 
 
 class Meeting(SafeDeleteModel):
@@ -152,6 +220,18 @@ class Meeting(SafeDeleteModel):
         default=get_default_backend,
     )
     backend_metadata = models.JSONField(null=True, default=dict)
+    # Persisted copy of the status property, kept in sync by save() so meetings can be filtered by status in SQL
+    status_code = models.PositiveSmallIntegerField(
+        choices=[(status.value, status.name.capitalize()) for status in MeetingStatus],
+        default=MeetingStatus.UNASSIGNED.value,
+    )
+
+    objects = SafeDeleteManager.from_queryset(MeetingQuerySet)()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['queue', 'status_code'], name='meeting_queue_status_idx'),
+        ]
 
     @property
     def attendees_with_phone_numbers(self):
@@ -192,9 +272,23 @@ class Meeting(SafeDeleteModel):
             if not self.assignee
             else MeetingStatus.ASSIGNED
             if not self.backend_metadata
+            else MeetingStatus.STARTING
+            if self.backend_metadata.get('starting')
             else MeetingStatus.STARTED
         )
 
+    def request_start(self):
+        '''
+        Marks the meeting as starting, for the start_meetings command to start it.
+        Started and starting meetings are left as they are.
+        '''
+        if not self.assignee:
+            raise Exception("Can't start meeting before assignee is set!")
+        if self.backend_type not in BACKEND_INSTANCES:
+            raise DisabledBackendException(self.backend_type)
+        if self.status == MeetingStatus.ASSIGNED:
+            self.backend_metadata = {'starting': True}
+
     def start(self):
         if not self.assignee:
             raise Exception("Can't start meeting before assignee is set!")
@@ -205,14 +299,28 @@ class Meeting(SafeDeleteModel):
             f"{user.first_name} {user.last_name}".strip() or user.username
             for user in self.attendees.all()
         ])
+        backend_metadata = {
+            key: value for key, value in (self.backend_metadata or {}).items() if key != 'starting'
+        }
+        breaker = backend.circuit_breaker
+        permit = breaker.allow()
+        if not permit:
+            raise BackendUnavailableException(self.backend_type)
         try:
             self.backend_metadata = backend.save_user_meeting(
-                self.backend_metadata,
+                backend_metadata,
                 self.assignee,
                 attendee_names=attendee_names
             )
-        except RequestException as ex:
+        except backend.failure_exceptions as ex:
+            breaker.record_failure(permit)
             raise BackendException(self.backend_type) from ex
+        except Exception:
+            # The backend answered, even if it turned the request down
+            breaker.record_success(permit)
+            raise
+        breaker.record_success(permit)
+        self.status_code = self.status.value
 
     def save(self, *args, **kwargs):
         if self.saved_status.value >= MeetingStatus.STARTED.value:
@@ -220,6 +328,10 @@ class Meeting(SafeDeleteModel):
                 raise MeetingStartedException("backend_type")
             if self.assignee != self._saved_assignee:
                 raise MeetingStartedException("assignee")
+        self.status_code = self.status.value
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'assignee', 'backend_metadata'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'status_code'}
         super().save(*args, **kwargs)
         self.saved_status = self.status
         self._saved_backend_type = self.backend_type
@@ -233,17 +345,14 @@ class Meeting(SafeDeleteModel):
 
     @property
     def line_place(self) -> Optional[int]:
-        if not self.queue:
+        if not self.queue_id or not self.pk or self.status.value in STARTED_STATUS_CODES:
             return None
-        meetings = self.queue.meeting_set.order_by('id')
-        unstarted_meetings: List[Meeting] = [
-            meeting for meeting in meetings if meeting.status != MeetingStatus.STARTED
-        ]
-        for i in range(0, len(unstarted_meetings)):
-            m = unstarted_meetings[i]
-            if m == self:
-                return i
-        return None
+        # Use Queue.get_line_places when the places of many meetings are needed
+        return (
+            Meeting.objects.unstarted()
+            .filter(queue_id=self.queue_id, id__lt=self.pk)
+            .count()
+        )
 
     def __str__(self):
         return f'{self.id}: {self.backend_type} {self.backend_metadata}'
@@ -274,13 +383,85 @@ def post_save_user_signal_handler(sender, instance: User, created, **kwargs):
         instance.profile = Profile.objects.create(user=instance)
 
 
-if settings.TWILIO_ACCOUNT_SID and settings.TWILIO_AUTH_TOKEN and settings.TWILIO_MESSAGING_SERVICE_SID:
-    import officehours_api.notifications
+@receiver(pre_delete, sender=User)
+def pre_delete_user_signal_handler(sender, instance: User, **kwargs):
+    # Deleting the assignee nulls it without saving the meetings, so keep status_code in step here
+    Meeting.all_objects.filter(assignee=instance).update(status_code=MeetingStatus.UNASSIGNED.value)
+
+
+def meeting_start_event_fields(data: dict) -> dict:
+    '''
+    MeetingStartEvent fields for a meeting as rendered by MeetingSerializer, which is
+    also what the API request log holds for historic MeetingStart requests.
+    '''
+    attendee = (data.get('attendees') or [{}])[0]
+    host = data.get('assignee') or {}
+    created_at = data['created_at']
+    return {
+        'queue_id': data['queue'],
+        'meeting_id': data['id'],
+        'attendee_id': attendee.get('id'),
+        'attendee_user_id': attendee.get('user_id'),
+        'attendee_uniqname': attendee.get('username'),
+        'attendee_last_name': attendee.get('last_name'),
+        'attendee_first_name': attendee.get('first_name'),
+        'host_id': host.get('id'),
+        'host_uniqname': host.get('username'),
+        'host_last_name': host.get('last_name'),
+        'host_first_name': host.get('first_name'),
+        'meeting_type': data['backend_type'],
+        'meeting_url': (data.get('backend_metadata') or {}).get('meeting_url'),
+        'agenda': data.get('agenda') or '',
+        'meeting_created_at': parse_datetime(created_at) if isinstance(created_at, str) else created_at,
+    }
+
+
+class MeetingStartEvent(models.Model):
+    '''
+    A meeting start, kept after the meeting is deleted, with the attendee and
+    host as they were when it started. Exported as the meeting start logs.
+    '''
+    queue = models.ForeignKey(Queue, on_delete=models.CASCADE, related_name='meeting_start_events')
+    # Restarting a meeting updates its event rather than adding another one
+    meeting_id = models.IntegerField(unique=True)
+    attendee_id = models.IntegerField(null=True)
+    attendee_user_id = models.IntegerField(null=True)
+    attendee_uniqname = models.CharField(max_length=150, null=True)
+    attendee_last_name = models.CharField(max_length=150, null=True)
+    attendee_first_name = models.CharField(max_length=150, null=True)
+    host_id = models.IntegerField(null=True)
+    host_uniqname = models.CharField(max_length=150, null=True)
+    host_last_name = models.CharField(max_length=150, null=True)
+    host_first_name = models.CharField(max_length=150, null=True)
+    meeting_type = models.CharField(max_length=20)
+    meeting_url = models.TextField(null=True)
+    agenda = models.CharField(max_length=100, blank=True)
+    meeting_created_at = models.DateTimeField()
+    # When the meeting was (last) started; incremental exports resume from here
+    started_at = models.DateTimeField(default=timezone.now)
 
-class MeetingStartLogsView(models.Model):
     class Meta:
-        managed = False
-        db_table = 'meeting_start_logs'
+        indexes = [
+            models.Index(fields=['queue', 'meeting_created_at'], name='meeting_start_queue_time_idx'),
+            models.Index(fields=['queue', 'started_at', 'id'], name='meeting_start_queue_start_idx'),
+            models.Index(fields=['queue', 'host_id', 'meeting_created_at'], name='meeting_start_queue_host_idx'),
+            models.Index(fields=['queue', 'attendee_uniqname'], name='meeting_start_queue_att_idx'),
+        ]
+
+    @classmethod
+    def from_meeting_data(cls, data: dict) -> 'MeetingStartEvent':
+        return cls(**meeting_start_event_fields(data))
+
+    @classmethod
+    def record(cls, data: dict) -> 'MeetingStartEvent':
+        event = cls.from_meeting_data(data)
+        fields = {
+            field.attname: getattr(event, field.attname)
+            for field in cls._meta.concrete_fields
+            if not field.primary_key and field.name != 'meeting_id'
+        }
+        event, _ = cls.objects.update_or_create(meeting_id=event.meeting_id, defaults=fields)
+        return event
 
 
 class QueueAnnouncement(models.Model):
@@ -297,6 +478,70 @@ class QueueAnnouncement(models.Model):
         ordering = ['-created_at']
 
 
+class OutboundSMS(models.Model):
+    '''
+    An SMS notification waiting to be sent, or the record of one that was.
+    Written by the notification signal handlers and delivered by the send_sms command.
+    '''
+    to = models.CharField(max_length=20)
+    body = models.TextField()
+    status = models.CharField(
+        max_length=10,
+        choices=[
+            ('pending', 'Pending'),
+            ('sending', 'Sending'),
+            ('sent', 'Sent'),
+            ('failed', 'Failed'),
+            ('skipped', 'Skipped'),
+        ],
+        default='pending',
+    )
+    # Notifications of the same kind for the same queue share a key, and are checked against
+    # the dedupe window and rate limit when first claimed; blank for one-time passwords
+    dedupe_key = models.CharField(max_length=100, blank=True)
+    # Sent before any due message with a lower priority, so one-time passwords don't wait behind announcements
+    priority = models.PositiveSmallIntegerField(default=0)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    # When a worker last claimed it to send
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'outbound SMS'
+        verbose_name_plural = 'outbound SMS'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbound_sms_due_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.status} SMS to {self.to}'
+
+
+class ProvisionedMeeting(models.Model):
+    '''
+    A Zoom meeting created ahead of time for a host of an open queue, so starting a meeting
+    can claim one instead of waiting on Zoom. Claimed meetings stay until the
+    provision_zoom_meetings command has given them their topic.
+    '''
+    host = models.ForeignKey(User, on_delete=models.CASCADE, related_name='provisioned_meetings')
+    # Same shape as a started Meeting's backend_metadata
+    backend_metadata = models.JSONField()
+    created_at = models.DateTimeField(default=timezone.now)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    topic = models.CharField(max_length=200, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['host', 'claimed_at', 'created_at'], name='provisioned_meeting_host_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.backend_metadata.get("meeting_id")} for {self.host.username}'
+
+
 @receiver(m2m_changed, sender=Queue.hosts.through)
 def handle_queue_hosts_changed(sender, instance, action, pk_set, **kwargs):
     """
@@ -308,3 +553,11 @@ def handle_queue_hosts_changed(sender, instance, action, pk_set, **kwargs):
             queue=instance,
             created_by__id__in=pk_set
         ).delete()
+
+
+# Imported last, as the notification handlers use the models above
+if (
+    settings.TWILIO_ACCOUNT_SID and settings.TWILIO_AUTH_TOKEN and settings.TWILIO_MESSAGING_SERVICE_SID
+    or settings.TWILIO_STAND_IN
+):
+    import officehours_api.notifications
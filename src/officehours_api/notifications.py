@@ -1,26 +1,69 @@
 import asyncio
+import itertools
 import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+from functools import lru_cache
+from types import SimpleNamespace
+from typing import Dict, Iterable, List, NamedTuple, Optional
 
-from asgiref.sync import sync_to_async
+import redis
 from django.conf import settings
 from django.dispatch import receiver
-from django.db.models.signals import pre_delete, post_save
+from django.db.models.signals import pre_delete, post_delete, post_save
+from django.contrib.postgres.aggregates import BoolOr
 from django.contrib.sites.models import Site
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from django.db import transaction
 from django.http import HttpResponseServerError
 from django.urls import reverse
+from django.utils import timezone
 
 from officehours_api.exceptions import TwilioClientNotInitializedException
+from twilio.base.exceptions import TwilioRestException
 from twilio.rest import Client as TwilioClient
 from django.db.models import Q
+from django.db.models.functions import Coalesce
 
-from officehours_api.models import Queue, Meeting, MeetingStatus
+from officehours_api.models import Attendee, Queue, Meeting, MeetingStatus, OutboundSMS, STARTED_STATUS_CODES
 
 logger = logging.getLogger(__name__)
 
+
+class LocalTwilioMessages:
+    def __init__(self):
+        self.sent: List[dict] = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def create(self, messaging_service_sid=None, to=None, body=None):
+        with self._lock:
+            message = {'sid': f'SMlocal{next(self._ids)}', 'to': to, 'body': body}
+            self.sent.append(message)
+        logger.info('Local Twilio stand-in sent %s to %s: %s', message['sid'], to, body)
+        return SimpleNamespace(**message)
+
+
+class LocalTwilioClient:
+    '''
+    Stand-in for the Twilio client that logs and records messages instead of sending them,
+    for development and tests. Enabled with TWILIO_STAND_IN when Twilio isn't configured.
+    '''
+    def __init__(self):
+        self.messages = LocalTwilioMessages()
+
+
 def initialize_twilio():
     if (settings.TWILIO_ACCOUNT_SID and settings.TWILIO_AUTH_TOKEN and settings.TWILIO_MESSAGING_SERVICE_SID):
         twilio_client = TwilioClient(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
         logger.info("Twilio client initialized.")
+    elif settings.TWILIO_STAND_IN:
+        twilio_client = LocalTwilioClient()
+        logger.info("Twilio settings values are not set; using the local Twilio stand-in.")
     else:
         logger.warning("Twilio client setup skipped. Twilio settings values are not set (TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_MESSAGING_SERVICE_SID).")
         twilio_client = None
@@ -28,61 +71,153 @@ def initialize_twilio():
 
 twilio = initialize_twilio()
 
+class SMSTemplates(NamedTuple):
+    domain: str
+    addendum: str
+    # Format with queue_id
+    queue_url: str
+    edit_url: str
+
+    def build_message_body(self, message: str) -> str:
+        """Build a complete SMS message with U-M identifier and opt-out info."""
+        return f"{settings.UM_SMS_IDENTIFIER} {message}{self.addendum}"
+
+
 # `reverse()` at the module level breaks `/admin`, so defer it by wrapping it in a function.
-def build_addendum(domain: str):
-    pref_url = f"{domain}{reverse('preferences')}"
-    return (
-        f"\n\nYou opted in to receive these texts from U-M. "
-        f"Opt out at {pref_url}"
+@lru_cache(maxsize=1)
+def get_sms_templates() -> SMSTemplates:
+    '''
+    The parts of SMS messages that depend on the current Site and the URLconf, built once per
+    process so that building a message is only string formatting. Like Django's own Site cache,
+    it's cleared when the Site is changed in this process; other processes see it on restart.
+    '''
+    domain = Site.objects.get_current().domain
+    placeholder = 'QUEUE_ID'
+    return SMSTemplates(
+        domain=domain,
+        addendum=(
+            f"\n\nYou opted in to receive these texts from U-M. "
+            f"Opt out at {domain}{reverse('preferences')}"
+        ),
+        queue_url=f"{domain}{reverse('queue', kwargs={'queue_id': placeholder})}".replace(placeholder, '{queue_id}'),
+        edit_url=f"{domain}{reverse('edit', kwargs={'queue_id': placeholder})}".replace(placeholder, '{queue_id}'),
     )
 
-def build_message_body(message: str, domain: str) -> str:
-    """Build a complete SMS message with U-M identifier and opt-out info."""
-    return f"{settings.UM_SMS_IDENTIFIER} {message}{build_addendum(domain)}"
 
-async def send_one_time_password(phone_number: str, otp_token: str):
+@receiver(post_save, sender=Site)
+@receiver(post_delete, sender=Site)
+def clear_sms_templates(sender, **kwargs):
+    get_sms_templates.cache_clear()
+
+
+# OutboundSMS.priority of one-time passwords; notifications keep the default of 0
+OTP_PRIORITY = 1
+
+
+def queue_one_time_password(phone_number: str, otp_token: str) -> OutboundSMS:
     '''
-    Send a one-time password to a phone number.
-    Returns True if the message was sent successfully, False otherwise.
+    Add a one-time password text to the outbox and return it, so its delivery status can be followed.
+    Unlike notifications, it's never deduplicated or rate limited here; the client enforces a wait between codes.
+    It goes ahead of queued notifications, as the user is waiting on it.
     '''
-    @sync_to_async # This decorator is necessary to use Django ORM in an async function.
-    def get_current_domain(site: Site): 
-        return site.objects.get_current().domain
+    logger.info("queue_one_time_password: %s", phone_number)
+    if twilio is None:
+        raise TwilioClientNotInitializedException()
+    return OutboundSMS.objects.create(
+        to=phone_number,
+        body=get_sms_templates().build_message_body(f"Your verification code is {otp_token}"),
+        priority=OTP_PRIORITY,
+    )
 
-    logger.info("send_one_time_password: %s", phone_number)
 
-    domain = await get_current_domain(Site)
+# Refills a number's bucket at `rate` tokens per second up to `capacity`, and takes a token if there is one
+TAKE_TOKEN_SCRIPT = """
+local capacity, rate, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = math.min(capacity, (tonumber(bucket[1]) or capacity) + (now - (tonumber(bucket[2]) or now)) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return allowed
+"""
+
+
+@lru_cache
+def get_redis_client(location: str) -> redis.Redis:
+    return redis.Redis.from_url(location)
+
+
+def take_sms_token(phone_number: str) -> bool:
+    '''
+    Take a token from the phone number's bucket in the "notifications" cache, returning False
+    if it's empty. Buckets hold SMS_RATE_LIMIT_BURST tokens and refill at SMS_RATE_LIMIT_PER_HOUR.
+    The check is atomic on Redis; other cache backends (as in tests) are only safe within a process.
+    '''
+    cache = caches['notifications']
+    capacity = settings.SMS_RATE_LIMIT_BURST
+    rate = settings.SMS_RATE_LIMIT_PER_HOUR / 3600
+    key = f'bucket:{phone_number}'
+    now = time.time()
+    if isinstance(cache, RedisCache):
+        # Like RedisCache, write to the first of the configured servers
+        location = settings.CACHES['notifications']['LOCATION']
+        servers = location.split(',') if isinstance(location, str) else location
+        client = get_redis_client(servers[0])
+        return bool(client.eval(TAKE_TOKEN_SCRIPT, 1, cache.make_key(key), capacity, rate, now))
+    tokens, updated = cache.get(key, (capacity, now))
+    tokens = min(capacity, tokens + (now - updated) * rate)
+    if tokens < 1:
+        return False
+    cache.set(key, (tokens - 1, now), timeout=math.ceil(capacity / rate) + 1)
+    return True
+
+
+def should_send_sms(phone_number: str, dedupe_key: str) -> bool:
+    '''
+    Whether to text a notification, given the number hasn't had one with the same dedupe key
+    within SMS_DEDUPE_WINDOW and isn't over its rate limit. If the cache is unreachable,
+    texts are sent rather than lost.
+    '''
     try:
-        if twilio is None:
-            raise TwilioClientNotInitializedException()
-        twilio.messages.create(
-            messaging_service_sid=settings.TWILIO_MESSAGING_SERVICE_SID,
-            to=phone_number,
-            body=build_message_body(f"Your verification code is {otp_token}", domain),
-        )
-        return True
+        if not caches['notifications'].add(f'dedupe:{dedupe_key}:{phone_number}', 1, settings.SMS_DEDUPE_WINDOW):
+            logger.info(f"Skipping duplicate {dedupe_key} SMS to {phone_number}")
+            return False
+        if not take_sms_token(phone_number):
+            logger.warning(f"Skipping {dedupe_key} SMS to {phone_number}: rate limit reached")
+            return False
     except Exception as e:
-        logger.exception(f"Error while sending OTP to {phone_number}:{e}")
-        raise e
+        logger.warning(f'Notifications cache unavailable: {e}')
+    return True
+
+
+def queue_sms(phone_numbers: Iterable[str], message: str, queue_id: int, kind: str):
+    '''
+    Add a message for each phone number to the outbox, for the send_sms command to deliver.
+    Saved in the caller's transaction, so nothing is sent for changes that roll back.
+    Duplicates and rate-limited numbers are skipped by the worker, once the messages are committed.
+    '''
+    if twilio is None:
+        logger.warning("Twilio not configured, skipping SMS to %s", ', '.join(phone_numbers))
+        return
+    body = get_sms_templates().build_message_body(message)
+    OutboundSMS.objects.bulk_create([
+        OutboundSMS(to=p, body=body, dedupe_key=f'{kind}:{queue_id}') for p in phone_numbers
+    ])
+
 
 def notify_meeting_started(started: Meeting):
     phone_numbers = list(
         u.profile.phone_number for u in
         started.attendees_with_phone_numbers.filter(profile__notify_me_attendee__exact=True)
     )
-    queue_path = reverse('queue', kwargs={'queue_id': started.queue.id})
-    domain = Site.objects.get_current().domain
-    queue_url = f"{domain}{queue_path}"
+    queue_url = get_sms_templates().queue_url.format(queue_id=started.queue_id)
     for p in phone_numbers:
-        try:
-            logger.info('notify_meeting_started: %s', p)
-            twilio.messages.create(
-                messaging_service_sid=settings.TWILIO_MESSAGING_SERVICE_SID,
-                to=p,
-                body=build_message_body(f"It's your turn in queue {queue_url}", domain),
-            )
-        except:
-            logger.exception(f"Error while sending attendee notification to {p} for queue {started.queue.id}")
+        logger.info('notify_meeting_started: %s', p)
+    queue_sms(phone_numbers, f"It's your turn in queue {queue_url}", started.queue_id, 'meeting_started')
 
 
 def notify_queue_no_longer_empty(first: Meeting):
@@ -90,44 +225,36 @@ def notify_queue_no_longer_empty(first: Meeting):
         h.profile.phone_number for h in
         first.queue.hosts_with_phone_numbers.filter(profile__notify_me_host__exact=True)
     )
-    edit_path = reverse('edit', kwargs={'queue_id': first.queue.id})
-    domain = Site.objects.get_current().domain
-    edit_url = f"{domain}{edit_path}"
+    edit_url = get_sms_templates().edit_url.format(queue_id=first.queue_id)
     for p in phone_numbers:
-        try:
-            logger.info('notify_queue_no_longer_empty: %s', p)
-            twilio.messages.create(
-                messaging_service_sid=settings.TWILIO_MESSAGING_SERVICE_SID,
-                to=p,
-                body=build_message_body(f"Someone joined your queue {edit_url}", domain),
-            )
-        except:
-            logger.exception(f"Error while sending host notification to {p} for queue {first.queue.id}")
+        logger.info('notify_queue_no_longer_empty: %s', p)
+    queue_sms(phone_numbers, f"Someone joined your queue {edit_url}", first.queue_id, 'queue_no_longer_empty')
 
 
-def notify_announcement_posted(announcement):
-    assigned_meetings = Meeting.objects.filter(
-        queue=announcement.queue,
-        assignee=announcement.created_by,
-    ).filter(
-        Q(backend_metadata__isnull=True) | Q(backend_metadata={})
-    )
-    
-    unassigned_meetings = Meeting.objects.filter(
-        queue=announcement.queue,
-        assignee__isnull=True,
-    ).filter(
-        Q(backend_metadata__isnull=True) | Q(backend_metadata={})
+def get_announcement_recipients(announcement) -> Dict[str, bool]:
+    '''
+    Phone numbers of opted-in attendees waiting in the announcement's queue, either unassigned
+    or assigned to its author, each with whether they're assigned to the author. One query.
+    '''
+    creator_id = announcement.created_by_id
+    return dict(
+        Attendee.objects.filter(
+            meeting__queue_id=announcement.queue_id,
+            user__profile__notify_me_announcement=True,
+        )
+        .exclude(meeting__status_code__in=STARTED_STATUS_CODES)
+        .filter(Q(meeting__assignee_id=creator_id) | Q(meeting__assignee__isnull=True))
+        .exclude(user__profile__phone_number='')
+        .values('user__profile__phone_number')
+        # Comparing a null assignee gives null, hence the coalesce
+        .annotate(assigned=Coalesce(BoolOr(Q(meeting__assignee_id=creator_id)), False))
+        .values_list('user__profile__phone_number', 'assigned')
     )
-    
-    all_relevant_meetings = assigned_meetings.union(unassigned_meetings)
-    
-    phone_numbers = []
-    for meeting in all_relevant_meetings:
-        for attendee in meeting.attendees_with_phone_numbers.filter(profile__notify_me_announcement__exact=True):
-            phone_numbers.append(attendee.profile.phone_number)
-    
-    if not phone_numbers:
+
+
+def notify_announcement_posted(announcement):
+    recipients = get_announcement_recipients(announcement)
+    if not recipients:
         logger.info(f"No attendees to notify for announcement {announcement.id}")
         return
     
@@ -138,30 +265,11 @@ def notify_announcement_posted(announcement):
     else:
         creator_name += f" ({creator.username})"
     
-    # Check if attendees are assigned to this host
-    assigned_attendees = set()
-    for meeting in all_relevant_meetings:
-        for attendee in meeting.attendees.all():
-            if meeting.assignee == announcement.created_by:
-                assigned_attendees.add(attendee.profile.phone_number)
-    
     message = f"Announcement from {creator_name} - {announcement.text}"
-    domain = Site.objects.get_current().domain
     
-    for phone_number in phone_numbers:
-        try:
-            logger.info(f'notify_announcement_posted: sending to {phone_number}')
-            if twilio is None:
-                logger.warning(f"Twilio not configured, skipping SMS to {phone_number}")
-                continue
-                
-            twilio.messages.create(
-                messaging_service_sid=settings.TWILIO_MESSAGING_SERVICE_SID,
-                to=phone_number,
-                body=build_message_body(message, domain),
-            )
-        except Exception as e:
-            logger.exception(f"Error while sending announcement notification to {phone_number} for announcement {announcement.id}: {e}")
+    for phone_number, assigned in recipients.items():
+        logger.info(f'notify_announcement_posted: queueing SMS to {phone_number} ({"assigned" if assigned else "unassigned"})')
+    queue_sms(list(recipients), message, announcement.queue_id, 'announcement')
 
 
 @receiver(post_save, sender=Meeting)
@@ -170,10 +278,8 @@ def trigger_notification_create(sender, instance: Meeting, created, **kwargs):
         return
     if created and instance.line_place == 0:
         notify_queue_no_longer_empty(instance)
-    if (
-        instance.saved_status.value < MeetingStatus.STARTED.value
-        and instance.status.value >= MeetingStatus.STARTED.value
-    ):
+    # Not when an asynchronous start is requested, but when it completes
+    if instance.saved_status != MeetingStatus.STARTED and instance.status == MeetingStatus.STARTED:
         notify_meeting_started(instance)
 
 
@@ -184,4 +290,92 @@ def trigger_announcement_notification(sender, instance, created, **kwargs):
     Sends notifications for both newly created announcements and updates to existing ones.
     """
     if instance.active:
-        notify_announcement_posted(instance)
\ No newline at end of file
+        notify_announcement_posted(instance)
+
+
+def is_retryable(error: Exception) -> bool:
+    # Twilio rejects bad numbers and bodies with 4xx errors that won't succeed on retry
+    return not (
+        isinstance(error, TwilioRestException)
+        and 400 <= error.status < 500 and error.status != 429
+    )
+
+
+def send_sms(sms: OutboundSMS):
+    twilio.messages.create(
+        messaging_service_sid=settings.TWILIO_MESSAGING_SERVICE_SID,
+        to=sms.to,
+        body=sms.body,
+    )
+
+
+def claim_due_sms(batch_size: int) -> List[OutboundSMS]:
+    '''
+    Mark a batch of due messages as sending and return them, highest priority first, along with
+    messages a worker claimed more than SMS_CLAIM_TIMEOUT seconds ago without recording how they went.
+    Committed before anything is sent, so workers can run side by side without sending a message twice,
+    and no row locks or transaction are held while Twilio is called.
+    '''
+    now = timezone.now()
+    with transaction.atomic():
+        due = list(
+            OutboundSMS.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(status='pending', next_attempt_at__lte=now)
+                | Q(status='sending', claimed_at__lt=now - timedelta(seconds=settings.SMS_CLAIM_TIMEOUT))
+            )
+            .order_by('-priority', 'next_attempt_at', 'id')[:batch_size]
+        )
+        for sms in due:
+            sms.status = 'sending'
+            sms.claimed_at = now
+            sms.attempts += 1
+        OutboundSMS.objects.bulk_update(due, ['status', 'claimed_at', 'attempts'])
+    return due
+
+
+def record_sms_result(sms: OutboundSMS, error: Optional[BaseException]):
+    now = timezone.now()
+    if error is None:
+        sms.status = 'sent'
+        sms.sent_at = now
+        sms.last_error = ''
+    elif is_retryable(error) and sms.attempts < settings.SMS_MAX_ATTEMPTS:
+        sms.status = 'pending'
+        sms.last_error = str(error)
+        sms.next_attempt_at = now + timedelta(seconds=settings.SMS_RETRY_DELAY * 2 ** (sms.attempts - 1))
+        logger.warning(f"Error while sending SMS {sms.id} to {sms.to}, will retry: {error}")
+    else:
+        sms.status = 'failed'
+        sms.last_error = str(error)
+        logger.error(f"Error while sending SMS {sms.id} to {sms.to}", exc_info=error)
+    sms.save(update_fields=['status', 'next_attempt_at', 'last_error', 'sent_at'])
+
+
+def deliver_pending_sms(batch_size: int = 100, concurrency: int = None) -> int:
+    '''
+    Claim a batch of due messages from the outbox and send them, up to `concurrency` at a time,
+    recording each outcome as it comes in. Notifications that are duplicates or over their number's
+    rate limit are skipped. Failures are retried with exponential backoff up to SMS_MAX_ATTEMPTS.
+    A message whose worker stopped before recording it is sent again once its claim times out.
+    Returns the number of messages claimed.
+    '''
+    if twilio is None:
+        raise TwilioClientNotInitializedException()
+    concurrency = concurrency or settings.SMS_CONCURRENCY
+    due = claim_due_sms(batch_size)
+    to_send = []
+    for sms in due:
+        # Checked on the first claim only, so a message reclaimed after its worker stopped isn't
+        # taken for a duplicate of itself
+        if sms.attempts == 1 and sms.dedupe_key and not should_send_sms(sms.to, sms.dedupe_key):
+            sms.status = 'skipped'
+            sms.save(update_fields=['status'])
+        else:
+            to_send.append(sms)
+    # Only Twilio calls happen in the pool; the database is updated from this thread
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(send_sms, sms): sms for sms in to_send}
+        for future in as_completed(futures):
+            record_sms_result(futures[future], future.exception())
+    return len(due)
@@ -1,5 +1,116 @@
+from functools import lru_cache
+from json import JSONDecodeError
+import logging
+from typing import Dict, Optional
+
+from django.conf import settings
+import pyzoom.oauth
+from pyzoom import err
+from pyzoom._base import APIClientBase
 from pyzoom._client import MeetingsComponent
 from pyzoom import schemas
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+class ZoomServerError(err.APIError):
+    '''Zoom failed (5xx) or kept rate limiting us (429) through all retries.'''
+
+
+class ZoomRetry(Retry):
+    '''
+    Retries rate limited (429) requests whatever their method, as Zoom didn't act on them,
+    but other failures only for idempotent methods, so a meeting is never created twice.
+    Waits no longer than ZOOM_HTTP_TIMEOUT for a Retry-After; the circuit breaker takes over
+    when Zoom keeps rate limiting, as with its daily limits that reset hours later.
+    '''
+
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        if status_code == 429:
+            return True
+        return super().is_retry(method, status_code, has_retry_after)
+
+    def get_retry_after(self, response) -> Optional[float]:
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, settings.ZOOM_HTTP_TIMEOUT)
+
+
+@lru_cache(maxsize=1)
+def get_session() -> requests.Session:
+    '''
+    Gets the session shared by every Zoom request in this process,
+    so connections (and their TLS handshakes) are kept alive and reused.
+    '''
+    retry = ZoomRetry(
+        total=settings.ZOOM_HTTP_RETRIES,
+        backoff_factor=settings.ZOOM_HTTP_BACKOFF,
+        status_forcelist=(500, 502, 503, 504),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=2,
+        pool_maxsize=settings.ZOOM_HTTP_POOL_SIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def patched_make_request(
+    self: APIClientBase,
+    endpoint: str,
+    method: str,
+    query: Dict = None,
+    body: Dict = None,
+    raise_on_error=True,
+) -> requests.Response:
+    # Same as APIClientBase.make_request, but through the shared session and with a timeout
+    headers = {"Authorization": f"Bearer {self.access_token}"}
+    url = self.base_url + endpoint
+    logger.debug(f"Making {method} request to {endpoint}")
+    r = get_session().request(
+        method, url, headers=headers, params=query, json=body, timeout=settings.ZOOM_HTTP_TIMEOUT
+    )
+
+    if 200 <= r.status_code < 300:
+        return r
+
+    try:
+        body = r.json()
+        try:
+            message = body["_error"]["message"]
+        except (KeyError, TypeError):
+            message = body
+    except JSONDecodeError:
+        message = r.text
+
+    logger.error(f"Unsuccessful request to {r.url}: [{r.status_code}] {message}")
+    if not raise_on_error:
+        return r
+    if r.status_code in err.HTTP_ERRORS_MAP:
+        raise err.HTTP_ERRORS_MAP[r.status_code](message)
+    if r.status_code >= 500 or r.status_code == 429:
+        raise ZoomServerError(message)
+    raise err.APIError(message)
+
+
+def patched_oauth_request(headers, data):
+    # Same as pyzoom.oauth._oauth_request, but through the shared session and with a timeout
+    response = get_session().post(
+        f"{settings.ZOOM_OAUTH_URL}/oauth/token", headers=headers, data=data, timeout=settings.ZOOM_HTTP_TIMEOUT
+    )
+    if response.status_code == 200:
+        return response.json()
+    error = ZoomServerError if response.status_code >= 500 or response.status_code == 429 else err.APIError
+    raise error(f"Failed to refresh tokens: {response.status_code} {response.text}")
+
 
 def patched_create_meeting(
     self: MeetingsComponent,
@@ -36,4 +147,6 @@ def patched_create_meeting(
     
     return response.json()
 
-MeetingsComponent.create_meeting = patched_create_meeting
\ No newline at end of file
+MeetingsComponent.create_meeting = patched_create_meeting
+APIClientBase.make_request = patched_make_request
+pyzoom.oauth._oauth_request = patched_oauth_request
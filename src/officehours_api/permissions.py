@@ -3,11 +3,40 @@ from rest_framework import permissions
 from .models import Queue, Meeting, Profile
 
 
+# Bumped whenever Queue.hosts changes in this process; memoized memberships
+# recorded under an older generation are discarded. Memberships are only
+# memoized for one request, so changes made by other processes need not reach them.
+_host_generation = 0
+
+
+def invalidate_host_memberships():
+    global _host_generation
+    _host_generation += 1
+
+
+def _host_memberships(user: User) -> dict:
+    generation, memberships = getattr(user, '_host_memberships', (None, None))
+    if generation != _host_generation:
+        memberships = {}
+        user._host_memberships = (_host_generation, memberships)
+    return memberships
+
+
 def is_host(user: User, queue: Queue):
-    return (
-        user.is_superuser
-        or user in queue.hosts.all()
-    )
+    '''
+    Memoized on the user object, so a membership is looked up at most once
+    per request (request.user).
+    '''
+    if user.is_superuser:
+        return True
+    if user.pk is None:
+        return False
+    memberships = _host_memberships(user)
+    if queue.pk not in memberships:
+        memberships[queue.pk] = Queue.hosts.through.objects.filter(
+            queue_id=queue.pk, user_id=user.pk
+        ).exists()
+    return memberships[queue.pk]
 
 
 def is_attendee(user: User, meeting: Meeting):
@@ -1,11 +1,19 @@
-from typing import TypedDict, Literal
+import logging
+import time
+from typing import List, Literal, Optional, TypedDict
 
 from django.contrib.auth.models import User
+from django.core.cache import caches
 from django.db.models import QuerySet
 from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
 
-from officehours_api.models import Queue, QueueAnnouncement, Meeting, MeetingStatus, Attendee, get_backend_types
+from officehours_api.models import (
+    Queue, QueueAnnouncement, Meeting, Attendee, STARTED_STATUS_CODES, get_backend_types,
+    get_prefetched,
+)
+
+logger = logging.getLogger(__name__)
 
 
 class UserContext(TypedDict):
@@ -47,8 +55,13 @@ class NestedMeetingSerializer(serializers.ModelSerializer):
 
 
 class NestedMyMeetingSerializer(serializers.ModelSerializer):
+    '''
+    Pass the queue's line places in the "line_places" context (see Queue.get_line_places)
+    when serializing many meetings from the same queue.
+    '''
     backend_metadata = serializers.JSONField(read_only=True)
     status = serializers.SerializerMethodField(read_only=True)
+    line_place = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Meeting
@@ -61,6 +74,13 @@ class NestedMyMeetingSerializer(serializers.ModelSerializer):
     def get_status(self, obj):
         return obj.status.value
 
+    @extend_schema_field(serializers.IntegerField(allow_null=True))
+    def get_line_place(self, obj):
+        line_places = self.context.get('line_places')
+        if line_places is None:
+            return obj.line_place
+        return line_places.get(obj.id)
+
 
 class NestedMeetingSetSerializer(serializers.ModelSerializer):
     queue = serializers.ReadOnlyField(source='queue.name')
@@ -97,11 +117,39 @@ class QueueAnnouncementSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at', 'created_by']
 
 
+def get_active_announcements(queue: Queue) -> List[dict]:
+    announcements = getattr(queue, 'active_announcements', None)  # Set by Queue.objects.prefetch_for_serializers
+    if announcements is None:
+        announcements = queue.announcements.filter(active=True).select_related('created_by').order_by('-created_at')
+    return QueueAnnouncementSerializer(announcements, many=True).data
+
+
+def get_user_meeting(queue: Queue, user: User) -> Optional[Meeting]:
+    meetings = get_prefetched(queue, 'meeting_set')
+    if meetings is None:
+        return queue.meeting_set.filter(attendees__in=[user]).first()
+    return next(
+        (meeting for meeting in meetings if any(a.id == user.id for a in meeting.attendees.all())),
+        None,
+    )
+
+
+def order_announcements_for_assignee(announcements: List[dict], assigned_host_id: Optional[int]) -> List[dict]:
+    '''
+    Move the announcements of an attendee's assigned host to the front,
+    keeping the chronological order within each group.
+    '''
+    if not assigned_host_id:
+        return list(announcements)
+    return sorted(announcements, key=lambda ann: ann['created_by']['id'] != assigned_host_id)
+
+
 class QueueAttendeeSerializer(serializers.ModelSerializer):
     '''
     Serializer used when viewing queue as an attendee.
     '''
     context: UserContext
+    user_specific_fields = ('my_meeting', 'current_announcement')
 
     hosts = NestedUserSerializer(many=True, read_only=True)
     line_length = serializers.SerializerMethodField(read_only=True)
@@ -116,18 +164,20 @@ class QueueAttendeeSerializer(serializers.ModelSerializer):
 
     @extend_schema_field(serializers.IntegerField)
     def get_line_length(self, obj):
-        return len([meeting for meeting in obj.meeting_set.all() if meeting.status != MeetingStatus.STARTED])
+        meetings = get_prefetched(obj, 'meeting_set')
+        if meetings is None:
+            return obj.meeting_set.unstarted().count()
+        return len([meeting for meeting in meetings if meeting.status_code not in STARTED_STATUS_CODES])
 
     @extend_schema_field(NestedMyMeetingSerializer)
     def get_my_meeting(self, obj):
         user = self.context['user']
-        my_meeting = (
-            obj.meeting_set.filter(attendees__in=[self.context['user']]).first()
-            if user.is_authenticated else None
-        )
+        my_meeting = get_user_meeting(obj, user) if user.is_authenticated else None
         if not my_meeting:
             return None
-        serializer = NestedMyMeetingSerializer(my_meeting, context=self.context)
+        serializer = NestedMyMeetingSerializer(
+            my_meeting, context={**self.context, 'line_places': obj.get_line_places()}
+        )
         return serializer.data
 
     @extend_schema_field(QueueAnnouncementSerializer(many=True))
@@ -139,18 +189,20 @@ class QueueAttendeeSerializer(serializers.ModelSerializer):
             return []
         
         # Get all active announcements
-        announcements = list(obj.announcements.filter(active=True).order_by('-created_at'))
+        announcements = get_active_announcements(obj)
 
         # If user is assigned to a host, sort so that host's announcements are first
-        my_meeting = obj.meeting_set.filter(attendees__in=[user]).first()
-        assigned_host_id = my_meeting.assignee.id if my_meeting and my_meeting.assignee else None
+        my_meeting = get_user_meeting(obj, user)
+        assigned_host_id = my_meeting.assignee_id if my_meeting else None
+        return order_announcements_for_assignee(announcements, assigned_host_id)
 
-        if assigned_host_id:
-            announcements.sort(
-                key=lambda ann: (ann.created_by.id != assigned_host_id, -ann.created_at.timestamp())
-            )
-
-        return [QueueAnnouncementSerializer(announcement).data for announcement in announcements]
+    def get_fields(self):
+        fields = super().get_fields()
+        # A shared rendering is sent to every socket watching the queue, which fill in their own user fields
+        if self.context.get('shared'):
+            for field_name in self.user_specific_fields:
+                fields.pop(field_name, None)
+        return fields
 
 
 class MyUserSerializer(serializers.ModelSerializer):
@@ -179,8 +231,10 @@ class MyUserSerializer(serializers.ModelSerializer):
             meeting = obj.meeting_set.get()
         except Meeting.DoesNotExist:
             return None
-        serializer = QueueAttendeeSerializer(meeting.queue, context=self.context)
-        return serializer.data
+        content = get_queue_snapshot(meeting.queue_id)
+        if content is None:
+            return None
+        return render_queue_for_user(content, self.context['user'], host_view=False)
 
     @extend_schema_field(ShallowUserSerializer)
     def get_hosted_queues(self, obj):
@@ -209,10 +263,19 @@ class PhoneOTPSerializer(serializers.ModelSerializer):
     otp_phone_number = serializers.CharField(source='profile.otp_phone_number', allow_blank=True, required=False)
     otp_token = serializers.CharField(source='profile.otp_token', allow_blank=True, required=False)
     otp_expiration = serializers.DateTimeField(source='profile.otp_expiration', required=False)
+    otp_delivery_status = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = User
-        fields = ['phone_number', 'otp_phone_number', 'otp_token', 'otp_expiration']
+        fields = ['phone_number', 'otp_phone_number', 'otp_token', 'otp_expiration', 'otp_delivery_status']
+
+    def get_otp_delivery_status(self, obj):
+        '''pending, sent or failed for the latest code, or None if none was requested.'''
+        otp_sms = obj.profile.otp_sms
+        if not otp_sms:
+            return None
+        # A claimed code is still on its way
+        return 'pending' if otp_sms.status == 'sending' else otp_sms.status
 
     def update(self, instance, validated_data):
         profile = validated_data['profile']
@@ -220,6 +283,8 @@ class PhoneOTPSerializer(serializers.ModelSerializer):
         instance.profile.otp_phone_number = profile.get('otp_phone_number', instance.profile.otp_phone_number)
         instance.profile.otp_token = profile.get('otp_token', instance.profile.otp_token)
         instance.profile.otp_expiration = profile.get('otp_expiration', instance.profile.otp_expiration)
+        # Passed to save() by the view when it queues a code
+        instance.profile.otp_sms = validated_data.get('otp_sms', instance.profile.otp_sms)
         instance.profile.save()
         return instance
 
@@ -253,8 +318,7 @@ class QueueHostSerializer(QueueAttendeeSerializer):
         if not user.is_authenticated:
             return []
         # Hosts see all active announcements in chronological order
-        announcements = obj.announcements.filter(active=True).order_by('-created_at')
-        return [QueueAnnouncementSerializer(announcement).data for announcement in announcements]
+        return get_active_announcements(obj)
 
     class Meta:
         model = Queue
@@ -356,3 +420,99 @@ class MeetingSerializer(serializers.ModelSerializer):
         if attrs.get("backend_type") and attrs["backend_type"] not in queue.allowed_backends:
             raise serializers.ValidationError(f"{attrs['backend_type']} is not one of the queue's allowed backend types ({queue.allowed_backends})")
         return attrs
+
+
+def serialize_queue_broadcast(queue: Queue) -> dict:
+    '''
+    Render everything QueueConsumer needs to answer an event for every
+    connected user: the host and attendee views without their user-specific
+    fields, the active announcements, and each attendee's meeting.
+    Expects a queue loaded with Queue.objects.prefetch_for_serializers().
+    '''
+    context = {'shared': True}
+    meeting_context = {'line_places': queue.get_line_places()}
+    my_meetings = {}
+    for meeting in queue.meeting_set.all():
+        meeting_data = NestedMyMeetingSerializer(meeting, context=meeting_context).data
+        for attendee in meeting.attendees.all():
+            my_meetings[str(attendee.id)] = meeting_data
+    return {
+        'host': QueueHostSerializer(queue, context=context).data,
+        'attendee': QueueAttendeeSerializer(queue, context=context).data,
+        'host_ids': [host.id for host in queue.hosts.all()],
+        'announcements': get_active_announcements(queue),
+        'my_meetings': my_meetings,
+    }
+
+
+def render_queue_for_user(content: dict, user: User, host_view: Optional[bool] = None) -> dict:
+    '''
+    Build a user's view of the queue from the shared broadcast content,
+    adding the fields that depend on the user. By default, hosts and
+    superusers get the host view.
+    '''
+    if host_view is None:
+        host_view = user.is_superuser or user.id in content['host_ids']
+    queue_data = dict(content['host'] if host_view else content['attendee'])
+    my_meeting = (
+        content['my_meetings'].get(str(user.id))
+        if user.is_authenticated else None
+    )
+    queue_data['my_meeting'] = my_meeting
+    queue_data['current_announcement'] = render_announcements(content, user, host_view, my_meeting)
+    return queue_data
+
+
+def render_announcements(content: dict, user: User, host_view: bool, my_meeting: Optional[dict]) -> List[dict]:
+    if not user.is_authenticated:
+        return []
+    if host_view:
+        return content['announcements']
+    return order_announcements_for_assignee(
+        content['announcements'],
+        my_meeting['assignee'] if my_meeting else None,
+    )
+
+
+def _snapshot_version_key(queue_id: int) -> str:
+    return f'{queue_id}:version'
+
+
+def get_queue_snapshot(queue_id: int) -> Optional[dict]:
+    '''
+    Return serialize_queue_broadcast() content for a queue, or None if the queue
+    doesn't exist. Snapshots are kept in the "queues" cache under the queue's
+    current version, which invalidate_queue_snapshot replaces; a snapshot
+    rendered from data that was already outdated is stored under a version
+    nobody reads anymore. If the cache is unreachable, the queue is rendered
+    from the database.
+    '''
+    cache = caches['queues']
+    key = f'{queue_id}:snapshot'
+    version = None
+    try:
+        version = cache.get_or_set(_snapshot_version_key(queue_id), time.time_ns, timeout=None)
+        content = cache.get(key, version=version)
+    except Exception as e:
+        logger.warning(f'Queue cache unavailable: {e}')
+        content = None
+    if content is not None:
+        return content
+    try:
+        queue = Queue.objects.prefetch_for_serializers().get(pk=queue_id)
+    except Queue.DoesNotExist:
+        return None
+    content = serialize_queue_broadcast(queue)
+    if version is not None:
+        try:
+            cache.set(key, content, version=version)
+        except Exception as e:
+            logger.warning(f'Queue cache unavailable: {e}')
+    return content
+
+
+def invalidate_queue_snapshot(queue_id: int):
+    try:
+        caches['queues'].set(_snapshot_version_key(queue_id), time.time_ns(), timeout=None)
+    except Exception as e:
+        logger.warning(f'Queue cache unavailable: {e}')
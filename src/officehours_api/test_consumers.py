@@ -0,0 +1,318 @@
+import json
+import threading
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from django.contrib.auth.models import AnonymousUser, User
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from officehours_api.consumers import (
+    BroadcastCoalescer, QueueConsumer, broadcaster, diff_queue, send_meeting_start_result,
+)
+from officehours_api.routing import websocket_urlpatterns
+from officehours_api.models import Meeting, Queue, QueueAnnouncement
+from officehours_api.serializers import (
+    QueueAttendeeSerializer, QueueHostSerializer, get_queue_snapshot, serialize_queue_broadcast,
+)
+
+
+class BroadcastCoalescingTestCase(TestCase):
+    def setUp(self):
+        window_patcher = mock.patch.object(broadcaster, 'window', 0)
+        send_patcher = mock.patch.object(BroadcastCoalescer, '_send')
+        window_patcher.start()
+        self.mock_send = send_patcher.start()
+        self.addCleanup(window_patcher.stop)
+        self.addCleanup(send_patcher.stop)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.host = User.objects.create(username='host', email='host@example.com')
+            self.attendee = User.objects.create(username='attendee', email='attendee@example.com')
+            self.queue = Queue.objects.create(name='BroadcastTest')
+            self.queue.hosts.set([self.host])
+        self.mock_send.reset_mock()
+
+    def get_sends(self, key):
+        return [c for c in self.mock_send.call_args_list if c.args[0] == key]
+
+    def test_queue_updates_coalesced_within_transaction(self):
+        key = (QueueConsumer.get_group_name(self.queue.id), 'queue.update')
+        with self.captureOnCommitCallbacks(execute=True):
+            meeting = Meeting.objects.create(queue=self.queue, backend_type='inperson')
+            meeting.attendees.set([self.attendee])
+            meeting.assignee = self.host
+            meeting.save()
+            meeting.start()
+            meeting.save()
+            self.queue.description = 'Updated'
+            self.queue.save()
+        self.assertEqual(len(self.get_sends(key)), 1)
+
+    def test_separate_transactions_broadcast_separately(self):
+        key = (QueueConsumer.get_group_name(self.queue.id), 'queue.update')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.queue.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.queue.save()
+        self.assertEqual(len(self.get_sends(key)), 2)
+
+
+class BroadcastWindowTestCase(SimpleTestCase):
+    def setUp(self):
+        self.coalescer = BroadcastCoalescer(window=0.05)
+        self.sent = []
+        self.sent_event = threading.Event()
+        send_patcher = mock.patch.object(self.coalescer, '_send', side_effect=self.record_send)
+        send_patcher.start()
+        self.addCleanup(send_patcher.stop)
+
+    def record_send(self, key):
+        self.sent.append(key)
+        self.sent_event.set()
+
+    def wait_for_sends(self, count):
+        while len(self.sent) < count:
+            self.assertTrue(self.sent_event.wait(timeout=5))
+            self.sent_event.clear()
+
+    def test_dispatches_within_window_send_once(self):
+        key = ('queue_1', 'queue.update')
+        self.coalescer._dispatch(key)
+        self.coalescer._dispatch(key)
+        self.coalescer._dispatch(('queue_2', 'queue.update'))
+        self.wait_for_sends(2)
+        self.assertCountEqual(self.sent, [key, ('queue_2', 'queue.update')])
+
+    def test_flush_allows_next_window_on_the_same_thread(self):
+        key = ('queue_1', 'queue.update')
+        self.coalescer._dispatch(key)
+        self.wait_for_sends(1)
+        dispatcher = self.coalescer._dispatcher
+        self.coalescer._dispatch(key)
+        self.wait_for_sends(2)
+        self.assertEqual(self.sent, [key, key])
+        self.assertIs(self.coalescer._dispatcher, dispatcher)
+
+
+class QueueBroadcastTestCase(TestCase):
+    def setUp(self):
+        self.host = User.objects.create(username='host', email='host@example.com')
+        self.attendee_one = User.objects.create(username='attendeeone', email='attendeeone@example.com')
+        self.attendee_two = User.objects.create(username='attendeetwo', email='attendeetwo@example.com')
+        self.queue = Queue.objects.create(name='BroadcastTest', allowed_backends=['inperson'])
+        self.queue.hosts.set([self.host])
+        self.first = Meeting.objects.create(queue=self.queue, backend_type='inperson')
+        self.first.attendees.set([self.attendee_one])
+        self.second = Meeting.objects.create(queue=self.queue, backend_type='inperson')
+        self.second.attendees.set([self.attendee_two])
+        self.host_announcement = QueueAnnouncement.objects.create(
+            queue=self.queue, text='From host', created_by=self.host,
+        )
+
+    def render_for(self, user, content):
+        consumer = QueueConsumer()
+        consumer._user = user
+        return consumer.render_queue(content)
+
+    def test_shared_content_matches_per_user_serializers(self):
+        content = serialize_queue_broadcast(self.queue)
+        self.assertNotIn('my_meeting', content['host'])
+        self.assertNotIn('my_meeting', content['attendee'])
+        for user, serializer_class in [
+            (self.host, QueueHostSerializer),
+            (self.attendee_one, QueueAttendeeSerializer),
+            (self.attendee_two, QueueAttendeeSerializer),
+        ]:
+            expected = serializer_class(self.queue, context={'user': user}).data
+            self.assertEqual(
+                json.loads(json.dumps(self.render_for(user, content))),
+                json.loads(json.dumps(expected)),
+            )
+
+    def test_anonymous_user_gets_no_user_fields(self):
+        content = serialize_queue_broadcast(self.queue)
+        queue_data = self.render_for(AnonymousUser(), content)
+        self.assertIsNone(queue_data['my_meeting'])
+        self.assertEqual(queue_data['current_announcement'], [])
+        self.assertNotIn('meeting_set', queue_data)
+
+    def test_rendering_for_each_socket_does_not_query(self):
+        content = json.loads(json.dumps(serialize_queue_broadcast(self.queue)))
+        with self.assertNumQueries(0):
+            for user in [self.host, self.attendee_one, self.attendee_two]:
+                self.render_for(user, content)
+
+
+class DiffQueueTestCase(SimpleTestCase):
+    def setUp(self):
+        self.meeting_one = {'id': 1, 'agenda': '', 'assignee': None, 'status': 0}
+        self.meeting_two = {'id': 2, 'agenda': '', 'assignee': None, 'status': 0}
+        self.queue = {
+            'id': 1, 'name': 'Queue', 'status': 'open', 'line_length': 2,
+            'meeting_set': [self.meeting_one, self.meeting_two],
+        }
+
+    def test_unchanged_queue_has_no_changes(self):
+        self.assertEqual(diff_queue(self.queue, dict(self.queue)), [])
+
+    def test_queue_fields_changed(self):
+        current = {**self.queue, 'status': 'closed'}
+        self.assertEqual(diff_queue(self.queue, current), [('queue_fields_changed', {'status': 'closed'})])
+
+    def test_meetings_added_removed_and_changed(self):
+        changed_one = {**self.meeting_one, 'status': 1}
+        added = {'id': 3, 'agenda': 'New', 'assignee': None, 'status': 0}
+        current = {**self.queue, 'meeting_set': [changed_one, added]}
+        self.assertEqual(diff_queue(self.queue, current), [
+            ('meeting_removed', {'id': 2}),
+            ('meeting_changed', changed_one),
+            ('meeting_added', added),
+        ])
+
+    def test_changed_view_needs_snapshot(self):
+        attendee_view = {k: v for k, v in self.queue.items() if k != 'meeting_set'}
+        self.assertIsNone(diff_queue(attendee_view, self.queue))
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'queues': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'queues'},
+})
+class QueueSnapshotCacheTestCase(TestCase):
+    def setUp(self):
+        send_patcher = mock.patch.object(broadcaster, '_send')
+        send_patcher.start()
+        self.addCleanup(send_patcher.stop)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.host = User.objects.create(username='host', email='host@example.com')
+            self.attendee = User.objects.create(username='attendee', email='attendee@example.com')
+            self.queue = Queue.objects.create(name='SnapshotTest', allowed_backends=['inperson'])
+            self.queue.hosts.set([self.host])
+
+    def test_snapshot_is_cached(self):
+        content = get_queue_snapshot(self.queue.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_queue_snapshot(self.queue.id), content)
+
+    def test_changes_invalidate_snapshot(self):
+        get_queue_snapshot(self.queue.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            meeting = Meeting.objects.create(queue=self.queue, backend_type='inperson')
+        with self.captureOnCommitCallbacks(execute=True):
+            meeting.attendees.set([self.attendee])
+        content = get_queue_snapshot(self.queue.id)
+        self.assertEqual(len(content['host']['meeting_set']), 1)
+        self.assertIn(str(self.attendee.id), content['my_meetings'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.attendee.first_name = 'Renamed'
+            self.attendee.save()
+        content = get_queue_snapshot(self.queue.id)
+        self.assertEqual(content['host']['meeting_set'][0]['attendees'][0]['first_name'], 'Renamed')
+
+    @mock.patch('officehours_api.consumers.send_user_deleted')
+    def test_deleting_a_user_invalidates_snapshot(self, mock_send_user_deleted: mock.MagicMock):
+        with self.captureOnCommitCallbacks(execute=True):
+            meeting = Meeting.objects.create(queue=self.queue, backend_type='inperson', assignee=self.host)
+            meeting.attendees.set([self.attendee])
+        content = get_queue_snapshot(self.queue.id)
+        self.assertEqual(content['host']['meeting_set'][0]['assignee']['id'], self.host.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.host.delete()
+        content = get_queue_snapshot(self.queue.id)
+        self.assertIsNone(content['host']['meeting_set'][0]['assignee'])
+        self.assertEqual(content['host_ids'], [])
+
+    @mock.patch('officehours_api.consumers.send_queue_delete')
+    def test_deleted_queue_has_no_snapshot(self, mock_send_queue_delete: mock.MagicMock):
+        get_queue_snapshot(self.queue.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.queue.delete()
+        self.assertIsNone(get_queue_snapshot(self.queue.id))
+
+
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'queues': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'queues'},
+    },
+)
+class QueueConsumerTestCase(TransactionTestCase):
+    # database_sync_to_async closes connections, which TestCase's transaction doesn't survive
+    def setUp(self):
+        # Updates are sent explicitly below rather than from the broadcast timer thread
+        send_patcher = mock.patch.object(broadcaster, '_send')
+        send_patcher.start()
+        self.addCleanup(send_patcher.stop)
+        self.host = User.objects.create(username='host', email='host@example.com')
+        self.queue = Queue.objects.create(name='ConsumerTest', allowed_backends=['inperson'])
+        self.queue.hosts.set([self.host])
+
+    # channels.testing needs daphne, so speak the ASGI websocket protocol directly
+    async def connect(self, queue_id, path=None):
+        communicator = ApplicationCommunicator(URLRouter(websocket_urlpatterns), {
+            'type': 'websocket',
+            'path': path or f'/ws/queues/{queue_id}/',
+            'user': self.host,
+        })
+        await communicator.send_input({'type': 'websocket.connect'})
+        return communicator
+
+    async def receive_json(self, communicator):
+        message = await communicator.receive_output()
+        self.assertEqual(message['type'], 'websocket.send')
+        return json.loads(message['text'])
+
+    async def test_init_then_sequenced_deltas(self):
+        communicator = await self.connect(self.queue.id)
+        self.assertEqual((await communicator.receive_output())['type'], 'websocket.accept')
+        init = await self.receive_json(communicator)
+        self.assertEqual((init['type'], init['seq']), ('init', 0))
+        self.assertIn('meeting_set', init['content'])
+
+        await database_sync_to_async(Meeting.objects.create)(queue=self.queue, backend_type='inperson')
+        content = await database_sync_to_async(serialize_queue_broadcast)(
+            await database_sync_to_async(Queue.objects.prefetch_for_serializers().get)(pk=self.queue.id)
+        )
+        await get_channel_layer().group_send(
+            QueueConsumer.get_group_name(self.queue.id), {'type': 'queue.update', 'content': content},
+        )
+        fields = await self.receive_json(communicator)
+        self.assertEqual((fields['type'], fields['seq']), ('queue_fields_changed', 1))
+        self.assertEqual(fields['content'], {'line_length': 1})
+        added = await self.receive_json(communicator)
+        self.assertEqual((added['type'], added['seq']), ('meeting_added', 2))
+
+        await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({'type': 'resync'})})
+        resync = await self.receive_json(communicator)
+        self.assertEqual((resync['type'], resync['seq']), ('update', 3))
+        self.assertEqual(len(resync['content']['meeting_set']), 1)
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait()
+
+    async def test_missing_queue_closes(self):
+        communicator = await self.connect(0)
+        await communicator.receive_output()  # accept
+        self.assertEqual(await communicator.receive_output(), {'type': 'websocket.close', 'code': 4404})
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 4404})
+        await communicator.wait()
+
+    async def test_user_socket_hears_meeting_start_result(self):
+        communicator = await self.connect(None, path=f'/ws/users/{self.host.id}/')
+        self.assertEqual((await communicator.receive_output())['type'], 'websocket.accept')
+        self.assertEqual((await self.receive_json(communicator))['type'], 'init')
+
+        await sync_to_async(send_meeting_start_result)(self.host.id, 7)
+        self.assertEqual(await self.receive_json(communicator), {'type': 'meeting_started', 'content': {'id': 7}})
+        await sync_to_async(send_meeting_start_result)(self.host.id, 8, 'Zoom is down')
+        self.assertEqual(
+            await self.receive_json(communicator),
+            {'type': 'meeting_start_failed', 'content': {'id': 8, 'detail': 'Zoom is down'}},
+        )
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait()
@@ -2,18 +2,27 @@ from datetime import datetime, timedelta, timezone
 import csv
 import io
 import json
+from importlib import import_module
 from unittest import skipIf
 
 from unittest.mock import patch
+from asgiref.sync import sync_to_async
+from django.apps import apps
 from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db.models import F
 from django.test import Client, TestCase, override_settings
+from requests.exceptions import RequestException
 from rest_framework import status
+from twilio.base.exceptions import TwilioRestException
 from typing import List
 
 from officehours.settings import ENABLED_BACKENDS
 from officehours_api import notifications
-from officehours_api.models import Meeting, Queue
+from officehours_api.exceptions import BackendException
+from officehours_api.models import BACKEND_INSTANCES, Meeting, MeetingStartEvent, MeetingStatus, Queue
 
+@override_settings(MEETING_START_LOG_EXPORT_DELAY=0)
 class MeetingTestCase(TestCase):
 
     def create_test_queue(self, queue_name="Test Queue", allowed_backends=['inperson', 'zoom']):
@@ -150,7 +159,7 @@ class MeetingTestCase(TestCase):
         # Start the meeting through the api to generate logs
         response = self.client.get(f'/api/export_meeting_start_logs/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        response_csv = self.read_csv_from_response(response.content)
+        response_csv = self.read_csv_from_response(response.getvalue())
         # Just check right now that there's a header row and a data row, perhaps do more validation later
         self.assertEqual(len(response_csv), 3)
         self.client.login(username='hosttwo', password='rohqtest')
@@ -164,7 +173,7 @@ class MeetingTestCase(TestCase):
         # Now just try on one queue, there should only be one extra row
         response = self.client.get(f'/api/export_meeting_start_logs/{self.queue.id}/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        response_csv = self.read_csv_from_response(response.content)
+        response_csv = self.read_csv_from_response(response.getvalue())
         # Just check right now that there's a header row and a data row, perhaps do more validation later
         self.assertEqual(len(response_csv), 2)
 
@@ -179,7 +188,7 @@ class MeetingTestCase(TestCase):
         self.test_export_setup()
         response = self.client.get(f'/api/export_meeting_start_logs/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        response_csv = self.read_csv_from_response(response.content)
+        response_csv = self.read_csv_from_response(response.getvalue())
         # Just check right now that there's a header row and a data row, perhaps do more validation later
         self.assertEqual(len(response_csv), 3)
         
@@ -189,7 +198,7 @@ class MeetingTestCase(TestCase):
         # Use a past date as start_date; all meetings were just created so they should all appear
         response = self.client.get(f'/api/export_meeting_start_logs/?start_date=2000-01-01')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        response_csv = self.read_csv_from_response(response.content)
+        response_csv = self.read_csv_from_response(response.getvalue())
         # Should have the same results as without a filter (header row + 2 data rows)
         self.assertEqual(len(response_csv), 3)
 
@@ -200,10 +209,172 @@ class MeetingTestCase(TestCase):
         future_date = (datetime.now(timezone.utc) + timedelta(days=1)).strftime('%Y-%m-%d')
         response = self.client.get(f'/api/export_meeting_start_logs/?start_date={future_date}')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        response_csv = self.read_csv_from_response(response.content)
+        response_csv = self.read_csv_from_response(response.getvalue())
         # Should only have the header row, no data rows
         self.assertEqual(len(response_csv), 1)
 
+    def test_restarting_meeting_keeps_one_event(self):
+        self.test_export_setup()
+        self.client.login(username='hosttwo', password='rohqtest')
+        response = self.client.post(f'/api/meetings/{self.meeting.id}/start/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(MeetingStartEvent.objects.filter(meeting_id=self.meeting.id).count(), 1)
+
+    @override_settings(ASYNC_MEETING_START=True)
+    @patch('officehours_api.management.commands.start_meetings.send_meeting_start_result')
+    def test_async_meeting_start(self, send_result):
+        self.client.login(username='hosttwo', password='rohqtest')
+        response = self.client.post(f'/api/meetings/{self.meeting.id}/start/')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.json()['backend_metadata'], {'starting': True})
+        self.assertFalse(MeetingStartEvent.objects.exists())
+        # Asking again while it's starting changes nothing
+        response = self.client.post(f'/api/meetings/{self.meeting.id}/start/')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('start_meetings', once=True, stdout=io.StringIO())
+
+        self.meeting.refresh_from_db()
+        self.assertEqual(self.meeting.status, MeetingStatus.STARTED)
+        self.assertEqual(self.meeting.backend_metadata, {'started': True})
+        self.assertTrue(MeetingStartEvent.objects.filter(meeting_id=self.meeting.id).exists())
+        send_result.assert_called_once_with(self.host_two.id, self.meeting.id, None)
+        response = self.client.post(f'/api/meetings/{self.meeting.id}/start/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(ASYNC_MEETING_START=True)
+    @patch('officehours_api.management.commands.start_meetings.send_meeting_start_result')
+    def test_async_meeting_start_failure_is_reported(self, send_result):
+        self.client.login(username='hosttwo', password='rohqtest')
+        self.client.post(f'/api/meetings/{self.meeting.id}/start/')
+
+        with patch.object(
+            BACKEND_INSTANCES['inperson'], 'save_user_meeting', side_effect=RequestException('down')
+        ), self.captureOnCommitCallbacks(execute=True):
+            call_command('start_meetings', once=True, stdout=io.StringIO())
+
+        self.meeting.refresh_from_db()
+        self.assertEqual(self.meeting.status, MeetingStatus.ASSIGNED)
+        send_result.assert_called_once_with(
+            self.host_two.id, self.meeting.id, BackendException('inperson').message
+        )
+
+    def test_backfill_meeting_start_events_from_request_log(self):
+        self.test_export_setup()
+        self.client.login(username='hostone', password='rohqtest')
+        exported = self.client.get('/api/export_meeting_start_logs/').getvalue()
+        MeetingStartEvent.objects.all().delete()
+        call_command('backfill_meeting_start_events', stdout=io.StringIO())
+        self.assertEqual(self.client.get('/api/export_meeting_start_logs/').getvalue(), exported)
+
+    def test_backfill_migration_keeps_recorded_events(self):
+        self.test_export_setup()
+        migration = import_module('officehours_api.migrations.0045_backfill_meeting_start_events')
+        MeetingStartEvent.objects.update(agenda='recorded')
+        MeetingStartEvent.objects.earliest('id').delete()
+        migration.backfill(apps, None)
+        self.assertEqual(MeetingStartEvent.objects.count(), 2)
+        self.assertEqual(MeetingStartEvent.objects.filter(agenda='recorded').count(), 1)
+
+    async def test_export_meeting_start_logs_streams_over_asgi(self):
+        await sync_to_async(self.test_export_setup)()
+        await self.async_client.aforce_login(self.host_one)
+        response = await self.async_client.get('/api/export_meeting_start_logs/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(self.read_csv_from_response(content)), 3)
+
+    def test_export_meeting_start_logs_filters(self):
+        self.test_export_setup()
+        self.client.login(username='hostone', password='rohqtest')
+        expected_rows = {
+            f'host_id={self.host_two.id}': 2,
+            f'host_id={self.host_one.id}': 0,
+            'attendee=attendeeone': 2,
+            'backend_type=zoom': 0,
+            'end_date=2000-01-01': 0,
+            f"end_date={datetime.now(timezone.utc).strftime('%Y-%m-%d')}": 2,
+        }
+        for query, rows in expected_rows.items():
+            response = self.client.get(f'/api/export_meeting_start_logs/?{query}')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(self.read_csv_from_response(response.getvalue())), rows + 1, query)
+        response = self.client.get('/api/export_meeting_start_logs/?host_id=hosttwo')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_meeting_start_logs_json_pages(self):
+        self.test_export_setup()
+        self.client.login(username='hostone', password='rohqtest')
+        response = self.client.get('/api/export_meeting_start_logs/?format=json&page_size=1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first_page = response.json()
+        self.assertEqual(len(first_page['results']), 1)
+        self.assertEqual(first_page['results'][0]['host_uniqname'], 'hosttwo')
+        second_page = self.client.get(first_page['next']).json()
+        self.assertEqual(len(second_page['results']), 1)
+        self.assertGreater(second_page['results'][0]['id'], first_page['results'][0]['id'])
+        self.assertIsNone(second_page['next'])
+        self.assertNotIn('X-Continuation-Token', response)
+
+    def test_export_meeting_start_logs_incremental_pages_keep_their_bound(self):
+        self.test_export_setup()
+        self.client.login(username='hostone', password='rohqtest')
+        response = self.client.get('/api/export_meeting_start_logs/?format=json&page_size=1&since=')
+        token = response['X-Continuation-Token']
+        # A meeting restarted while paging is left for the next export
+        self.client.login(username='hosttwo', password='rohqtest')
+        self.client.post(f'/api/meetings/{self.meeting.id}/start/')
+        self.client.login(username='hostone', password='rohqtest')
+        response = self.client.get(response.json()['next'])
+        self.assertEqual(response['X-Continuation-Token'], token)
+        self.assertIsNone(response.json()['next'])
+        response = self.client.get(f'/api/export_meeting_start_logs/?format=json&since={token}')
+        self.assertEqual([row['queue_id'] for row in response.json()['results']], [self.queue.id])
+
+    def test_export_meeting_start_logs_incrementally(self):
+        self.test_export_setup()
+        self.client.login(username='hostone', password='rohqtest')
+        response = self.client.get('/api/export_meeting_start_logs/?format=json&since=')
+        token = response['X-Continuation-Token']
+        first_id = min(row['id'] for row in response.json()['results'])
+
+        response = self.client.get(f'/api/export_meeting_start_logs/?format=json&since={token}')
+        self.assertEqual(response.json()['results'], [])
+        token = response['X-Continuation-Token']
+
+        # Restarting a meeting moves it past the token
+        self.client.login(username='hosttwo', password='rohqtest')
+        self.client.post(f'/api/meetings/{self.meeting.id}/start/')
+        self.client.login(username='hostone', password='rohqtest')
+        response = self.client.get(f'/api/export_meeting_start_logs/?since={token}')
+        header, *rows = self.read_csv_from_response(response.getvalue())
+        self.assertEqual([row[header.index('queue_id')] for row in rows], [str(self.queue.id)])
+        self.assertNotEqual(response['X-Continuation-Token'], token)
+
+        response = self.client.get(f'/api/export_meeting_start_logs/?format=json&since_id={first_id}')
+        self.assertEqual(len(response.json()['results']), 1)
+
+    def test_export_leaves_out_starts_that_may_be_committing(self):
+        self.test_export_setup()
+        self.client.login(username='hostone', password='rohqtest')
+        with self.settings(MEETING_START_LOG_EXPORT_DELAY=60):
+            response = self.client.get('/api/export_meeting_start_logs/?format=json&since=')
+            self.assertEqual(response.json()['results'], [])
+            # Exports that won't be resumed don't wait
+            response = self.client.get('/api/export_meeting_start_logs/?format=json')
+            self.assertEqual(len(response.json()['results']), 2)
+            MeetingStartEvent.objects.update(started_at=F('started_at') - timedelta(minutes=2))
+            response = self.client.get('/api/export_meeting_start_logs/?format=json&since=')
+            self.assertEqual(len(response.json()['results']), 2)
+
+    def test_export_meeting_start_logs_with_invalid_since(self):
+        self.test_export_setup()
+        self.client.login(username='hostone', password='rohqtest')
+        for query in ('since=not-a-token', 'since_id=abc', 'since_timestamp=yesterday'):
+            response = self.client.get(f'/api/export_meeting_start_logs/?{query}')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_export_meeting_start_logs_with_invalid_start_date(self):
         self.test_export_setup()
         self.client.login(username='hostone', password='rohqtest')
@@ -241,6 +412,9 @@ class UserOTPTestCase(TestCase):
         self.user.refresh_from_db()
 
         self.assertEqual(response.status_code, status.HTTP_200_OK) # status code correct
+        self.assertEqual(response.data['otp_delivery_status'], 'pending') # queued, not sent yet
+        self.assertEqual(mock_send_message.call_count, 0)
+        notifications.deliver_pending_sms()
         self.assertEqual(mock_send_message.call_count, 1) # send_message called once
         self.assertEqual(mock_send_message.call_args[1]['to'], "1234567890") # correct phone number
         self.assertTrue(str(otp_token) in mock_send_message.call_args[1]['body']) # correct message
@@ -248,9 +422,9 @@ class UserOTPTestCase(TestCase):
         self.assertEqual(self.user.profile.otp_token, "1234") # otp_token saved
         self.assertEqual(self.user.profile.otp_expiration, otp_expiration) # otp_expiration saved
 
-    @patch("officehours_api.views.send_one_time_password")
-    def test_send_otp_failure(self, mock_send_one_time_password):
-        mock_send_one_time_password.side_effect = Exception('Failed to send OTP')
+    @patch("officehours_api.views.queue_one_time_password")
+    def test_send_otp_failure(self, mock_queue_one_time_password):
+        mock_queue_one_time_password.side_effect = Exception('Failed to send OTP')
 
         url = f'/api/users/{self.user.id}/otp/'
         data = {
@@ -269,6 +443,19 @@ class UserOTPTestCase(TestCase):
         self.assertEqual(self.user.profile.otp_phone_number, "") # otp_phone_number not saved
         self.assertEqual(self.user.profile.otp_token, "") # otp_token not saved
 
+    @patch("officehours_api.notifications.twilio.messages.create")
+    def test_send_otp_delivery_failure_is_polled(self, mock_send_message):
+        mock_send_message.side_effect = TwilioRestException(400, '', msg='Invalid number')
+        url = f'/api/users/{self.user.id}/otp/'
+        self.client.login(username='testuser', password='testpassword')
+        response = self.client.patch(
+            url, {"action": "send", "otp_phone_number": "123"}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertLogs('officehours_api.notifications', level='ERROR'):
+            notifications.deliver_pending_sms()
+        self.assertEqual(self.client.get(url).data['otp_delivery_status'], 'failed')
+
     @patch("officehours_api.notifications.twilio.messages.create")
     @patch("officehours_api.views.UserOTP.generate_otp")
     def test_verify_otp_expired(self, mock_generate_otp, _):
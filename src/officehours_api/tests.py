@@ -1,17 +1,54 @@
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import time
 from unittest import mock, skipIf
 
-from django.test import TestCase, override_settings
+from django.contrib.sites.models import Site
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
 from rest_framework.exceptions import ValidationError
+from rest_framework_tracking.models import APIRequestLog
+from pyzoom import ZoomClient
+from pyzoom.err import APIError as ZoomAPIError
+from pyzoom.oauth import refresh_tokens
+from requests.exceptions import ConnectTimeout
 from twilio.base.exceptions import TwilioRestException
 
 from officehours.settings import ENABLED_BACKENDS
-from officehours_api.models import User, Queue, Meeting
-from officehours_api.serializers import MeetingSerializer
+from officehours_api.backends.backend_base import CircuitBreaker
+from officehours_api.backends.zoom import Backend as ZoomBackend
+from officehours_api.checks import backends as backend_checks
+from officehours_api.exceptions import BackendException, BackendUnavailableException
+from officehours_api.models import (
+    BACKEND_INSTANCES, User, Queue, Meeting, MeetingStatus, OutboundSMS, ProvisionedMeeting, QueueAnnouncement,
+)
+from officehours_api.notifications import (
+    LocalTwilioClient, deliver_pending_sms, get_announcement_recipients, get_sms_templates, queue_one_time_password,
+    queue_sms, should_send_sms,
+)
+from officehours_api.patches.pyzoom_patch import get_session
+from officehours_api.permissions import is_host
+from officehours_api.serializers import (
+    MeetingSerializer, QueueAttendeeSerializer, QueueHostSerializer,
+)
 
 
-@override_settings(TWILIO_ACCOUNT_SID='aaa', TWILIO_AUTH_TOKEN='bbb', TWILIO_MESSAGING_SERVICE_SID='ccc')
+@override_settings(
+    TWILIO_ACCOUNT_SID='aaa', TWILIO_AUTH_TOKEN='bbb', TWILIO_MESSAGING_SERVICE_SID='ccc',
+)
 class NotificationTestCase(TestCase):
     def setUp(self):
+        caches['notifications'].clear()
         self.foo = User.objects.create(username='foo', email='foo@example.com')
         self.configure_profile(self.foo, '+15555550000')
         self.bar = User.objects.create(username='bar', email='bar@example.com')
@@ -55,17 +92,20 @@ class NotificationTestCase(TestCase):
             m.assignee = self.hostie
             m.start()
             m.save()
+        deliver_pending_sms()
         return m
 
     @staticmethod
     def get_receivers(mock_twilio: mock.MagicMock):
+        deliver_pending_sms()
         return {c.kwargs['to'] for c in mock_twilio.mock_calls if 'to' in c.kwargs}
 
     def setup_bad_phone_test(self, mock_twilio: mock.MagicMock):
         def side_effect(to=None, messaging_service_sid=None, body=None):
             if len(to) < 12:
                 self.exceptions += 1
-                raise TwilioRestException(500, '')
+                # Twilio rejects invalid numbers with a 400, which isn't retried
+                raise TwilioRestException(400, '')
         mock_twilio.messages.create.side_effect = side_effect
 
     def assert_twilio_exception_logged(self, do):
@@ -234,6 +274,165 @@ class NotificationTestCase(TestCase):
         receivers = self.get_receivers(mock_twilio)
         self.assertFalse('+15555550000' in receivers)
 
+    @mock.patch('officehours_api.notifications.twilio')
+    def test_announcement_recipients_take_one_query(self, mock_twilio: mock.MagicMock):
+        assigned = self.create_meeting([self.foo])
+        assigned.assignee = self.hostie
+        assigned.save()
+        self.create_meeting([self.bar])
+        other_host = self.create_meeting([self.baz])
+        other_host.assignee = self.hostacular
+        other_host.save()
+        self.create_meeting([self.attendeeoptout])
+        self.create_meeting([self.attendeebad], start=True)
+        announcement = QueueAnnouncement(queue=self.queue, text='Back in 5', created_by=self.hostie)
+        with self.assertNumQueries(1):
+            recipients = get_announcement_recipients(announcement)
+        self.assertEqual(recipients, {'+15555550000': True, '+15555550001': False})
+
+    @mock.patch('officehours_api.notifications.twilio')
+    def test_edited_announcement_isnt_texted_again(self, mock_twilio: mock.MagicMock):
+        self.create_meeting([self.foo])
+        announcement = QueueAnnouncement.objects.create(queue=self.queue, text='Back in 5', created_by=self.hostie)
+        announcement.text = 'Back in 10'
+        announcement.save()
+        self.get_receivers(mock_twilio)
+        self.assertEqual(
+            [c.kwargs['to'] for c in mock_twilio.messages.create.mock_calls].count('+15555550000'), 1
+        )
+
+    @override_settings(SMS_DEDUPE_WINDOW=0, SMS_RATE_LIMIT_BURST=2, SMS_RATE_LIMIT_PER_HOUR=1)
+    def test_rate_limits_each_number(self):
+        self.assertEqual(
+            [should_send_sms('+15555550000', f'announcement:{self.queue.id}') for _ in range(3)],
+            [True, True, False],
+        )
+        self.assertTrue(should_send_sms('+15555550001', f'announcement:{self.queue.id}'))
+
+    def test_sends_when_cache_is_unavailable(self):
+        with mock.patch.object(caches['notifications'], 'add', side_effect=ConnectionError('down')), \
+                self.assertLogs('officehours_api.notifications', level='WARNING'):
+            self.assertTrue(should_send_sms('+15555550000', f'announcement:{self.queue.id}'))
+
+    @mock.patch('officehours_api.notifications.twilio')
+    def test_rolled_back_notifications_dont_count_as_sent(self, mock_twilio: mock.MagicMock):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            queue_sms(['+15555550000'], "It's your turn", self.queue.id, 'meeting_started')
+            raise RuntimeError()
+        queue_sms(['+15555550000'], "It's your turn", self.queue.id, 'meeting_started')
+        queue_sms(['+15555550000'], "It's your turn", self.queue.id, 'meeting_started')
+        self.assertEqual(deliver_pending_sms(), 2)
+        self.assertEqual(mock_twilio.messages.create.call_count, 1)
+        self.assertEqual(
+            list(OutboundSMS.objects.order_by('id').values_list('status', flat=True)), ['sent', 'skipped']
+        )
+
+    def test_sms_templates_follow_site_changes(self):
+        get_sms_templates.cache_clear()
+        # The rollback after the test doesn't send signals, so clear the caches ourselves
+        self.addCleanup(get_sms_templates.cache_clear)
+        self.addCleanup(Site.objects.clear_cache)
+        site = Site.objects.get_current()
+        self.assertEqual(get_sms_templates().queue_url.format(queue_id=7), f'{site.domain}/queue/7/')
+        with self.assertNumQueries(0):
+            self.assertIn(f'{site.domain}/preferences/', get_sms_templates().build_message_body('hi'))
+        site.domain = 'rohq.example.edu'
+        site.save()
+        self.assertEqual(get_sms_templates().edit_url.format(queue_id=7), 'rohq.example.edu/manage/7/')
+
+    @mock.patch('officehours_api.notifications.twilio')
+    def test_notifications_wait_for_the_worker(self, mock_twilio: mock.MagicMock):
+        meeting = Meeting.objects.create(queue=self.queue, backend_type='inperson')
+        meeting.attendees.set([self.foo])
+        self.assertEqual(OutboundSMS.objects.filter(status='pending').count(), 2)
+        self.assertEqual(mock_twilio.messages.create.call_count, 0)
+        self.assertEqual(deliver_pending_sms(), 2)
+        self.assertEqual(mock_twilio.messages.create.call_count, 2)
+        self.assertEqual(OutboundSMS.objects.filter(status='sent').count(), 2)
+
+
+@override_settings(
+    TWILIO_MESSAGING_SERVICE_SID='ccc', SMS_MAX_ATTEMPTS=2, SMS_RETRY_DELAY=60,
+)
+class SendSMSTestCase(TestCase):
+    def setUp(self):
+        caches['notifications'].clear()
+        self.stand_in = LocalTwilioClient()
+        patcher = mock.patch('officehours_api.notifications.twilio', self.stand_in)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_sends_announcement_to_every_attendee(self):
+        host = User.objects.create(username='host')
+        queue = Queue.objects.create(name='big queue', allowed_backends=['inperson'])
+        queue.hosts.set([host])
+        for i in range(30):
+            attendee = User.objects.create(username=f'attendee{i}')
+            attendee.profile.phone_number = f'+1555555{i:04}'
+            attendee.profile.notify_me_announcement = True
+            attendee.profile.save()
+            Meeting.objects.create(queue=queue, backend_type='inperson').attendees.set([attendee])
+        QueueAnnouncement.objects.create(queue=queue, text='Back in 5', created_by=host)
+        self.assertEqual(self.stand_in.messages.sent, [])
+
+        call_command('send_sms', once=True, batch_size=8, concurrency=4, stdout=io.StringIO())
+        self.assertEqual(len({message['to'] for message in self.stand_in.messages.sent}), 30)
+        self.assertFalse(OutboundSMS.objects.exclude(status='sent').exists())
+
+    def test_retries_transient_errors_then_gives_up(self):
+        sms = OutboundSMS.objects.create(to='+15555550000', body='hi')
+        with mock.patch.object(
+            self.stand_in.messages, 'create', side_effect=TwilioRestException(503, '', msg='Unavailable')
+        ):
+            self.assertEqual(deliver_pending_sms(), 1)
+            sms.refresh_from_db()
+            self.assertEqual((sms.status, sms.attempts), ('pending', 1))
+            self.assertGreater(sms.next_attempt_at, timezone.now() + timedelta(seconds=50))
+            # Not due again until the backoff has passed
+            self.assertEqual(deliver_pending_sms(), 0)
+            OutboundSMS.objects.update(next_attempt_at=timezone.now())
+            with self.assertLogs('officehours_api.notifications', level='ERROR'):
+                self.assertEqual(deliver_pending_sms(), 1)
+        sms.refresh_from_db()
+        self.assertEqual((sms.status, sms.attempts), ('failed', 2))
+
+    def test_one_time_passwords_skip_the_queue(self):
+        OutboundSMS.objects.bulk_create(
+            OutboundSMS(to=f'+1555555{i:04}', body='Back in 5', dedupe_key='announcement:1') for i in range(5)
+        )
+        otp = queue_one_time_password('+15555559999', '1234')
+        self.assertEqual(deliver_pending_sms(batch_size=1), 1)
+        self.assertEqual([message['to'] for message in self.stand_in.messages.sent], ['+15555559999'])
+        otp.refresh_from_db()
+        self.assertEqual(otp.status, 'sent')
+
+    def test_resends_messages_whose_worker_stopped(self):
+        now = timezone.now()
+        in_flight = OutboundSMS.objects.create(
+            to='+15555550000', body='hi', status='sending', claimed_at=now, attempts=1, dedupe_key='announcement:1',
+        )
+        stale = OutboundSMS.objects.create(
+            to='+15555550001', body='hi', status='sending', claimed_at=now - timedelta(minutes=10), attempts=1,
+            dedupe_key='announcement:1',
+        )
+        # The stale message's first claim already took its dedupe marker
+        caches['notifications'].add('dedupe:announcement:1:+15555550001', 1)
+        self.assertEqual(deliver_pending_sms(), 1)
+        self.assertEqual([message['to'] for message in self.stand_in.messages.sent], ['+15555550001'])
+        stale.refresh_from_db()
+        self.assertEqual((stale.status, stale.attempts), ('sent', 2))
+        in_flight.refresh_from_db()
+        self.assertEqual(in_flight.status, 'sending')
+
+    def test_doesnt_retry_rejected_numbers(self):
+        sms = OutboundSMS.objects.create(to='+1555', body='hi')
+        with mock.patch.object(
+            self.stand_in.messages, 'create', side_effect=TwilioRestException(400, '', msg='Invalid number')
+        ), self.assertLogs('officehours_api.notifications', level='ERROR'):
+            deliver_pending_sms()
+        sms.refresh_from_db()
+        self.assertEqual((sms.status, sms.attempts), ('failed', 1))
+
 
 class MeetingSerializerTestCase(TestCase):
     """
@@ -313,3 +512,546 @@ class MeetingSerializerTestCase(TestCase):
             serializer.is_valid(raise_exception=True)
         error = str(cm.exception.detail['non_field_errors'][0])
         self.assertEqual(error, "zoom is not one of the queue's allowed backend types (['inperson'])")
+
+
+class LinePlaceTestCase(TestCase):
+    def setUp(self):
+        self.host = User.objects.create(username='host')
+        self.queue = Queue.objects.create(name='test queue', allowed_backends=['inperson'])
+        self.queue.hosts.add(self.host)
+        self.meetings = []
+        for i in range(4):
+            attendee = User.objects.create(username=f'attendee{i}')
+            meeting = Meeting.objects.create(queue=self.queue, backend_type='inperson')
+            meeting.attendees.add(attendee)
+            self.meetings.append(meeting)
+
+    def start(self, meeting):
+        meeting.assignee = self.host
+        meeting.start()
+        meeting.save()
+
+    def test_line_places_skip_started_meetings(self):
+        self.start(self.meetings[1])
+        expected = {
+            self.meetings[0].id: 0,
+            self.meetings[2].id: 1,
+            self.meetings[3].id: 2,
+        }
+        self.assertEqual(self.queue.get_line_places(), expected)
+        for meeting in self.meetings:
+            meeting.refresh_from_db()
+            self.assertEqual(meeting.line_place, expected.get(meeting.id))
+
+    def test_line_places_use_one_query(self):
+        with self.assertNumQueries(1):
+            self.queue.get_line_places()
+
+    def test_assigned_meeting_keeps_place(self):
+        self.meetings[0].assignee = self.host
+        self.meetings[0].save()
+        self.assertEqual(self.meetings[0].line_place, 0)
+        self.assertEqual(self.meetings[1].line_place, 1)
+
+    def test_status_code_follows_status(self):
+        meeting = self.meetings[0]
+        self.assertEqual(meeting.status_code, MeetingStatus.UNASSIGNED.value)
+        meeting.assignee = self.host
+        meeting.save(update_fields=['assignee'])
+        meeting.refresh_from_db()
+        self.assertEqual(meeting.status_code, MeetingStatus.ASSIGNED.value)
+        self.start(meeting)
+        meeting.refresh_from_db()
+        self.assertEqual(meeting.status_code, MeetingStatus.STARTED.value)
+
+    def test_deleting_the_host_unassigns_meetings(self):
+        self.start(self.meetings[1])
+        self.meetings[2].assignee = self.host
+        self.meetings[2].save()
+        self.host.delete()
+        for meeting in self.meetings:
+            meeting.refresh_from_db()
+            self.assertEqual(meeting.status_code, MeetingStatus.UNASSIGNED.value)
+        self.assertFalse(self.queue.meeting_set.started().exists())
+        self.assertEqual(list(self.queue.get_line_places().values()), [0, 1, 2, 3])
+
+    def test_started_and_unstarted_querysets(self):
+        self.start(self.meetings[2])
+        self.assertEqual(list(self.queue.meeting_set.started()), [self.meetings[2]])
+        self.assertEqual(
+            list(self.queue.meeting_set.unstarted().order_by('id')),
+            [self.meetings[0], self.meetings[1], self.meetings[3]],
+        )
+
+    def test_starting_meetings_count_as_started(self):
+        meeting = self.meetings[1]
+        meeting.assignee = self.host
+        meeting.request_start()
+        meeting.save()
+        self.assertEqual(meeting.status_code, MeetingStatus.STARTING.value)
+        self.assertEqual(list(self.queue.meeting_set.started()), [meeting])
+        self.assertNotIn(meeting, self.queue.meeting_set.unstarted())
+        self.assertEqual(
+            self.queue.get_line_places(),
+            {self.meetings[0].id: 0, self.meetings[2].id: 1, self.meetings[3].id: 2},
+        )
+        self.assertIsNone(meeting.line_place)
+
+
+class QueuePrefetchTestCase(TestCase):
+    def setUp(self):
+        self.host = User.objects.create(username='host')
+        self.queue = Queue.objects.create(name='test queue', allowed_backends=['inperson'])
+        self.queue.hosts.add(self.host)
+        self.attendees = []
+
+    def add_meetings(self, count):
+        for i in range(len(self.attendees), len(self.attendees) + count):
+            attendee = User.objects.create(username=f'attendee{i}')
+            meeting = Meeting.objects.create(queue=self.queue, backend_type='inperson')
+            meeting.attendees.add(attendee)
+            self.attendees.append(attendee)
+
+    def serialize(self):
+        queue = Queue.objects.prefetch_for_serializers().get(pk=self.queue.pk)
+        context = {'user': self.attendees[-1]}
+        QueueHostSerializer(queue, context=context).data
+        return QueueAttendeeSerializer(queue, context=context).data
+
+    def test_serializer_queries_do_not_grow_with_meetings(self):
+        self.add_meetings(2)
+        with self.assertNumQueries(5):
+            self.serialize()
+        self.add_meetings(20)
+        with self.assertNumQueries(5):
+            data = self.serialize()
+        self.assertEqual(data['line_length'], 22)
+        self.assertEqual(data['my_meeting']['line_place'], 21)
+
+
+class HostMembershipTestCase(TestCase):
+    def setUp(self):
+        self.host = User.objects.create(username='host')
+        self.queue = Queue.objects.create(name='test queue', allowed_backends=['inperson'])
+        self.queue.hosts.add(self.host)
+
+    def test_membership_is_memoized_per_user_object(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(is_host(self.host, self.queue))
+            self.assertTrue(is_host(self.host, self.queue))
+        other = User.objects.get(pk=self.host.pk)
+        with self.assertNumQueries(1):
+            self.assertTrue(is_host(other, self.queue))
+
+    def test_hosts_change_invalidates_membership(self):
+        self.assertTrue(is_host(self.host, self.queue))
+        self.queue.hosts.remove(self.host)
+        self.assertFalse(is_host(self.host, self.queue))
+        self.host.queue_set.add(self.queue)
+        self.assertTrue(is_host(self.host, self.queue))
+
+
+class PruneAPIRequestLogsTestCase(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.old = [
+            APIRequestLog.objects.create(requested_at=now - timedelta(days=200 + i), path=f'/api/old/{i}/', host='testserver')
+            for i in range(5)
+        ]
+        self.new = APIRequestLog.objects.create(requested_at=now - timedelta(days=1), path='/api/new/', host='testserver')
+
+    def test_archives_and_prunes_old_rows_in_batches(self):
+        with tempfile.TemporaryDirectory() as archive_dir:
+            call_command(
+                'prune_api_request_logs', days=180, archive_dir=archive_dir, batch_size=2, max_batches=2,
+                stdout=io.StringIO()
+            )
+            self.assertEqual(APIRequestLog.objects.count(), 2)
+            call_command('prune_api_request_logs', days=180, archive_dir=archive_dir, batch_size=2, stdout=io.StringIO())
+            self.assertEqual(list(APIRequestLog.objects.all()), [self.new])
+            archived = []
+            for name in os.listdir(archive_dir):
+                with gzip.open(os.path.join(archive_dir, name), 'rt') as archive:
+                    archived += [json.loads(line) for line in archive]
+        self.assertEqual(sorted(row['path'] for row in archived), sorted(log.path for log in self.old))
+
+    def test_requires_archive_dir_or_no_archive(self):
+        with self.assertRaises(CommandError):
+            call_command('prune_api_request_logs', archive_dir=None, stdout=io.StringIO())
+        call_command('prune_api_request_logs', no_archive=True, stdout=io.StringIO())
+        self.assertEqual(list(APIRequestLog.objects.all()), [self.new])
+
+
+@mock.patch('officehours_api.backends.zoom.refresh_tokens')
+class ZoomAccessTokenTestCase(TestCase):
+    def setUp(self):
+        self.host = User.objects.create(username='host', email='host@example.com')
+        self.set_zoom_meta(self.host, 'old', time() - 10)
+        caches['zoom_tokens'].clear()
+
+    @staticmethod
+    def set_zoom_meta(user: User, access_token: str, expires: float):
+        user.profile.backend_metadata['zoom'] = {
+            'user_id': 'zoom-host',
+            'access_token': access_token,
+            'refresh_token': f'{access_token}-refresh',
+            'access_token_expires': expires,
+        }
+        user.profile.save()
+
+    @staticmethod
+    def fresh_token(refresh_tokens):
+        refresh_tokens.return_value = {
+            'access_token': 'new', 'refresh_token': 'new-refresh', 'expires_in': 3600,
+            'token_type': 'bearer', 'scope': 'meeting:write',
+        }
+
+    def test_refreshes_expired_token_once_then_caches_it(self, refresh_tokens):
+        self.fresh_token(refresh_tokens)
+        self.assertEqual(ZoomBackend._get_access_token(self.host), 'new')
+        refresh_tokens.assert_called_once_with(ZoomBackend.client_id, ZoomBackend.client_secret, 'old-refresh')
+        self.host.profile.refresh_from_db()
+        self.assertEqual(self.host.profile.backend_metadata['zoom']['refresh_token'], 'new-refresh')
+
+        host = User.objects.get(id=self.host.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(ZoomBackend._get_access_token(host), 'new')
+        self.assertEqual(refresh_tokens.call_count, 1)
+
+    def test_uses_token_refreshed_by_another_process(self, refresh_tokens):
+        # This process loaded the profile before another one refreshed the token
+        stale_host = User.objects.select_related('profile').get(id=self.host.id)
+        self.set_zoom_meta(self.host, 'theirs', time() + 3600)
+
+        self.assertEqual(ZoomBackend._get_access_token(stale_host), 'theirs')
+        refresh_tokens.assert_not_called()
+        self.assertEqual(stale_host.profile.backend_metadata['zoom']['refresh_token'], 'theirs-refresh')
+
+    def test_uses_token_rotated_by_the_refresh_command(self, refresh_tokens):
+        self.set_zoom_meta(self.host, 'cached', time() + 300)
+        self.assertEqual(ZoomBackend._get_access_token(self.host), 'cached')
+        self.fresh_token(refresh_tokens)
+        queue = Queue.objects.create(name='zoom queue', status='open', allowed_backends=['zoom'])
+        queue.hosts.add(self.host)
+        call_command('refresh_zoom_tokens', once=True, ahead=900, stdout=io.StringIO())
+
+        with self.assertNumQueries(0):
+            self.assertEqual(ZoomBackend._get_access_token(self.host), 'new')
+
+    def test_clears_metadata_when_refresh_is_rejected(self, refresh_tokens):
+        refresh_tokens.side_effect = ZoomAPIError('invalid_grant')
+        with self.assertRaises(ZoomAPIError):
+            ZoomBackend._get_access_token(self.host)
+        self.host.profile.refresh_from_db()
+        self.assertEqual(self.host.profile.backend_metadata['zoom'], {})
+
+    def test_command_refreshes_tokens_about_to_expire(self, refresh_tokens):
+        self.fresh_token(refresh_tokens)
+        later = User.objects.create(username='later', email='later@example.com')
+        self.set_zoom_meta(later, 'later', time() + 3000)
+        soon = User.objects.create(username='soon', email='soon@example.com')
+        self.set_zoom_meta(soon, 'soon', time() + 300)
+        queue = Queue.objects.create(name='zoom queue', status='open', allowed_backends=['zoom'])
+        queue.hosts.add(self.host, later, soon)
+
+        call_command('refresh_zoom_tokens', once=True, ahead=900, stdout=io.StringIO())
+
+        self.assertEqual(
+            sorted(call.args[2] for call in refresh_tokens.call_args_list), ['old-refresh', 'soon-refresh']
+        )
+        later.profile.refresh_from_db()
+        self.assertEqual(later.profile.backend_metadata['zoom']['access_token'], 'later')
+        soon.profile.refresh_from_db()
+        self.assertEqual(soon.profile.backend_metadata['zoom']['access_token'], 'new')
+
+    def test_command_skips_hosts_without_open_zoom_queues(self, refresh_tokens):
+        self.fresh_token(refresh_tokens)
+        closed = User.objects.create(username='closed', email='closed@example.com')
+        self.set_zoom_meta(closed, 'closed', time() + 300)
+        Queue.objects.create(name='closed queue', status='closed', allowed_backends=['zoom']).hosts.add(closed)
+        inperson = User.objects.create(username='inperson', email='inperson@example.com')
+        self.set_zoom_meta(inperson, 'inperson', time() + 300)
+        Queue.objects.create(name='in person queue', status='open', allowed_backends=['inperson']).hosts.add(inperson)
+
+        # self.host expired long ago and hosts no queue
+        call_command('refresh_zoom_tokens', once=True, ahead=900, stdout=io.StringIO())
+
+        refresh_tokens.assert_not_called()
+        self.host.profile.refresh_from_db()
+        self.assertEqual(self.host.profile.backend_metadata['zoom']['access_token'], 'old')
+
+
+class FakeZoomHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def respond(self):
+        self.server.requests.append((self.command, self.path))
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        status, body, *headers = self.server.responses.pop(0) if self.server.responses else (200, {})
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in (headers[0] if headers else {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST = respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+@override_settings(ZOOM_HTTP_BACKOFF=0, ZOOM_HTTP_RETRIES=2)
+class ZoomSessionTestCase(TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeZoomHandler)
+        self.server.connections = 0
+        self.server.requests = []
+        self.server.responses = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        get_session.cache_clear()
+        self.addCleanup(get_session.cache_clear)
+        self.api_url = f'http://127.0.0.1:{self.server.server_port}/v2'
+
+    def zoom_client(self):
+        return ZoomClient('token', base_url=self.api_url)
+
+    def test_clients_share_kept_alive_connections(self):
+        for _ in range(3):
+            self.zoom_client().raw.get('/users/me')
+        self.server.responses = [(200, {'access_token': 'new'})]
+        with self.settings(ZOOM_OAUTH_URL=f'http://127.0.0.1:{self.server.server_port}'):
+            self.assertEqual(refresh_tokens('id', 'secret', 'refresh'), {'access_token': 'new'})
+        self.assertEqual(self.server.requests[-1], ('POST', '/oauth/token'))
+        self.assertEqual(len(self.server.requests), 4)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_retries_rate_limits_and_server_errors(self):
+        self.server.responses = [(503, {}), (200, {'id': 'me'})]
+        self.assertEqual(self.zoom_client().raw.get('/users/me').json(), {'id': 'me'})
+        self.server.responses = [(429, {}), (201, {'id': 1})]
+        self.assertEqual(self.zoom_client().raw.post('/users/me/meetings', body={}).json(), {'id': 1})
+        self.assertEqual(len(self.server.requests), 4)
+
+    @override_settings(ZOOM_HTTP_TIMEOUT=5)
+    def test_caps_waits_for_rate_limits(self):
+        self.server.responses = [(429, {}, {'Retry-After': '14400'}), (201, {'id': 1})]
+        with mock.patch('urllib3.util.retry.time') as urllib3_time:
+            self.assertEqual(self.zoom_client().raw.post('/users/me/meetings', body={}).json(), {'id': 1})
+        urllib3_time.sleep.assert_called_once_with(5)
+
+    def test_does_not_repeat_meeting_creation_after_server_error(self):
+        self.server.responses = [(503, {'_error': {'message': 'try later'}}), (201, {'id': 1})]
+        with self.assertRaisesMessage(ZoomAPIError, 'try later'):
+            self.zoom_client().raw.post('/users/me/meetings', body={})
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_gives_up_after_retries(self):
+        self.server.responses = [(503, {})] * 5
+        with self.assertRaises(ZoomAPIError):
+            self.zoom_client().raw.get('/users/me')
+        self.assertEqual(len(self.server.requests), 3)
+
+    @mock.patch.object(ZoomBackend, '_get_client')
+    def test_meeting_start_times_are_utc(self, get_client: mock.MagicMock):
+        # The process runs in TIME_ZONE, so local times would be hours off
+        ZoomBackend.update_meeting_topic(User(), '1000', 'Topic')
+        start_time = get_client.return_value.raw.patch.call_args.kwargs['body']['start_time']
+        started = datetime.strptime(start_time, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=dt_timezone.utc)
+        self.assertLess(abs(timezone.now() - started), timedelta(minutes=1))
+
+
+@override_settings(ZOOM_MEETING_POOL_SIZE=2)
+@mock.patch.object(ZoomBackend, 'delete_meeting')
+@mock.patch.object(ZoomBackend, 'update_meeting_topic')
+@mock.patch.object(ZoomBackend, '_create_meeting')
+class ProvisionedMeetingTestCase(TestCase):
+    def setUp(self):
+        self.host = User.objects.create(username='host', email='host@example.com')
+        self.host.profile.backend_metadata['zoom'] = {
+            'user_id': 'zoom-host', 'access_token': 'token', 'refresh_token': 'refresh',
+            'access_token_expires': time() + 3600,
+        }
+        self.host.profile.save()
+        self.queue = Queue.objects.create(name='zoom queue', status='open', allowed_backends=['zoom', 'inperson'])
+        self.queue.hosts.add(self.host)
+        self.meeting_ids = iter(range(1000, 2000))
+
+    def fake_meeting(self, user, attendee_names=None):
+        meeting_id = next(self.meeting_ids)
+        return {'id': meeting_id, 'host_id': 'zoom-host', 'join_url': f'https://zoom.example/j/{meeting_id}'}
+
+    def provision(self):
+        call_command('provision_zoom_meetings', once=True, stdout=io.StringIO())
+
+    def test_fills_pools_of_hosts_of_open_queues(self, create_meeting, update_topic, delete_meeting):
+        create_meeting.side_effect = self.fake_meeting
+        closed_host = User.objects.create(username='closed', email='closed@example.com')
+        closed_host.profile.backend_metadata['zoom'] = self.host.profile.backend_metadata['zoom']
+        closed_host.profile.save()
+        Queue.objects.create(name='closed queue', status='closed', allowed_backends=['zoom']).hosts.add(closed_host)
+
+        self.provision()
+        self.provision()
+
+        self.assertEqual(ProvisionedMeeting.objects.filter(host=self.host).count(), 2)
+        self.assertFalse(ProvisionedMeeting.objects.filter(host=closed_host).exists())
+        self.assertEqual(create_meeting.call_count, 2)
+
+    def test_start_claims_provisioned_meeting_and_topic_follows(self, create_meeting, update_topic, delete_meeting):
+        create_meeting.side_effect = self.fake_meeting
+        self.provision()
+        create_meeting.reset_mock()
+
+        metadata = ZoomBackend.save_user_meeting({}, self.host, attendee_names='Ann Arbor')
+
+        create_meeting.assert_not_called()
+        self.assertEqual(metadata['meeting_id'], 1000)
+        self.assertEqual(metadata['meeting_url'], 'https://zoom.example/j/1000')
+        claimed = ProvisionedMeeting.objects.get(claimed_at__isnull=False)
+        self.assertEqual(claimed.topic, 'Remote Office Hours Queue Meeting with Ann Arbor')
+
+        self.provision()
+        update_topic.assert_called_once_with(self.host, 1000, 'Remote Office Hours Queue Meeting with Ann Arbor')
+        self.assertEqual(
+            list(ProvisionedMeeting.objects.values_list('backend_metadata__meeting_id', 'claimed_at')),
+            [(1001, None), (1002, None)],
+        )
+
+    def test_start_creates_meeting_when_pool_is_empty(self, create_meeting, update_topic, delete_meeting):
+        create_meeting.side_effect = self.fake_meeting
+        metadata = ZoomBackend.save_user_meeting({}, self.host)
+        create_meeting.assert_called_once()
+        self.assertEqual(metadata['meeting_id'], 1000)
+
+    def test_recycles_unused_meetings(self, create_meeting, update_topic, delete_meeting):
+        create_meeting.side_effect = self.fake_meeting
+        self.provision()
+        ProvisionedMeeting.objects.filter(backend_metadata__meeting_id=1000).update(
+            created_at=timezone.now() - timedelta(days=30)
+        )
+        self.provision()
+        delete_meeting.assert_called_once_with(mock.ANY, 1000)
+        self.assertEqual(
+            sorted(ProvisionedMeeting.objects.values_list('backend_metadata__meeting_id', flat=True)), [1001, 1002]
+        )
+
+        self.queue.status = 'closed'
+        self.queue.save()
+        self.provision()
+        self.assertFalse(ProvisionedMeeting.objects.exists())
+        self.assertEqual(delete_meeting.call_count, 3)
+
+
+@mock.patch('officehours_api.backends.backend_base.monotonic')
+class CircuitBreakerTestCase(SimpleTestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker('zoom', window=60, minimum_calls=4, failure_rate=0.5, open_seconds=30)
+
+    def fail(self, times=1):
+        for _ in range(times):
+            self.breaker.record_failure(self.breaker.allow())
+
+    def test_opens_once_enough_calls_fail(self, monotonic):
+        monotonic.return_value = 0
+        self.breaker.record_success(self.breaker.allow())
+        self.fail(2)
+        self.assertEqual(self.breaker.state, 'closed')
+        self.fail()
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertIsNone(self.breaker.allow())
+
+    def test_forgets_calls_outside_the_window(self, monotonic):
+        monotonic.return_value = 0
+        self.fail(3)
+        monotonic.return_value = 100
+        self.fail()
+        self.assertEqual(self.breaker.state, 'closed')
+        self.assertEqual(self.breaker.current_failure_rate, 1)
+
+    def test_half_open_lets_one_probe_through(self, monotonic):
+        monotonic.return_value = 0
+        self.fail(4)
+        monotonic.return_value = 31
+        self.assertEqual(self.breaker.state, 'half_open')
+        probe = self.breaker.allow()
+        self.assertTrue(probe.probe)
+        self.assertIsNone(self.breaker.allow())
+
+        self.breaker.record_failure(probe)
+        self.assertEqual(self.breaker.state, 'open')
+        monotonic.return_value = 62
+        probe = self.breaker.allow()
+        self.breaker.record_success(probe)
+        self.assertEqual(self.breaker.state, 'closed')
+        self.assertFalse(self.breaker.allow().probe)
+
+    def test_only_the_probe_changes_an_open_circuit(self, monotonic):
+        monotonic.return_value = 0
+        late_calls = [self.breaker.allow() for _ in range(3)]
+        self.fail(4)
+        # Calls started before the circuit opened end while it's open or half-open
+        self.breaker.record_success(late_calls[0])
+        self.assertEqual(self.breaker.state, 'open')
+        monotonic.return_value = 31
+        probe = self.breaker.allow()
+        self.breaker.record_failure(late_calls[1])
+        self.assertIsNone(self.breaker.allow())
+        self.breaker.record_success(late_calls[2])
+        self.assertEqual(self.breaker.state, 'half_open')
+        self.breaker.record_success(probe)
+        self.assertEqual(self.breaker.state, 'closed')
+
+
+@override_settings(BACKEND_CIRCUIT_MINIMUM_CALLS=2)
+class BackendCircuitTestCase(TestCase):
+    def setUp(self):
+        self.host = User.objects.create(username='host', email='host@example.com')
+        self.attendee = User.objects.create(username='attendee', email='attendee@example.com')
+        self.queue = Queue.objects.create(name='circuit queue', allowed_backends=['inperson'])
+        self.queue.hosts.add(self.host)
+        self.meeting = Meeting.objects.create(queue=self.queue, backend_type='inperson', assignee=self.host)
+        self.meeting.attendees.add(self.attendee)
+        self.backend = BACKEND_INSTANCES['inperson']
+        original_breaker = self.backend.circuit_breaker
+        self.backend.circuit_breaker = CircuitBreaker(
+            'inperson', window=60, minimum_calls=2, failure_rate=0.5, open_seconds=30
+        )
+        self.addCleanup(setattr, self.backend, 'circuit_breaker', original_breaker)
+
+    def test_fails_fast_while_backend_is_failing(self):
+        with mock.patch.object(self.backend, 'save_user_meeting', side_effect=ConnectTimeout()) as save:
+            for _ in range(2):
+                with self.assertRaises(BackendException):
+                    self.meeting.start()
+            with self.assertRaises(BackendUnavailableException):
+                self.meeting.start()
+        self.assertEqual(save.call_count, 2)
+
+        self.client.force_login(self.host)
+        response = self.client.post(f'/api/meetings/{self.meeting.id}/start/')
+        self.assertEqual(response.status_code, 503)
+
+        health = backend_checks()['backends']
+        self.assertIn({'inperson': {
+            'ok': True, 'circuit': 'open', 'failure_rate': 1.0,
+            'detail': 'Calls to inperson are failing fast until a probe succeeds.',
+        }}, health)
+        self.assertEqual(self.client.get('/status/').status_code, 200)
+
+    def test_refused_calls_dont_count_as_failures(self):
+        with mock.patch.object(self.backend, 'save_user_meeting', side_effect=ZoomAPIError('no')):
+            for _ in range(3):
+                with self.assertRaises(ZoomAPIError):
+                    self.meeting.start()
+        self.assertEqual(self.backend.circuit_breaker.state, 'closed')
@@ -1,39 +1,48 @@
 import csv
+import itertools
 import logging
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from datetime import datetime, timezone, timedelta
 from random import randint
-from typing import Iterable, Optional
+from typing import AsyncIterator, Iterable, Iterator, Optional, Tuple
 
-from asgiref.sync import async_to_sync
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import connection
-from django.http import HttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import Q, QuerySet
+from django.http import Http404, HttpRequest, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_naive
 from django_filters.rest_framework import DjangoFilterBackend
 from drf_spectacular.utils import extend_schema, inline_serializer
 from rest_framework import generics, serializers, status, filters, viewsets
 from rest_framework.decorators import api_view
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import CursorPagination
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.views import APIView
 from rest_framework_tracking.mixins import LoggingMixin
 
 from officehours_api.exceptions import DisabledBackendException, \
     MeetingStartedException, TwilioClientNotInitializedException
-from officehours_api.models import Attendee, Meeting, Queue, QueueAnnouncement
-from officehours_api.notifications import send_one_time_password
+from officehours_api.models import Attendee, Meeting, MeetingStartEvent, MeetingStatus, Queue, QueueAnnouncement
+from officehours_api.notifications import queue_one_time_password
 from officehours_api.permissions import (IsAssignee, IsHostOrReadOnly,
                                          IsHostOrAttendee, IsHostOfQueue, is_host)
 from officehours_api.serializers import (ShallowUserSerializer,
                                          MyUserSerializer,
                                          ShallowQueueSerializer,
-                                         QueueAttendeeSerializer,
                                          QueueHostSerializer,
                                          MeetingSerializer, AttendeeSerializer,
-                                         PhoneOTPSerializer, QueueAnnouncementSerializer)
+                                         PhoneOTPSerializer, QueueAnnouncementSerializer,
+                                         get_queue_snapshot, render_queue_for_user)
 
 logger = logging.getLogger(__name__)
 
@@ -132,16 +141,17 @@ class UserOTP(DecoupledContextMixin, LoggingMixin, generics.RetrieveUpdateAPIVie
             return "Incorect Verification Code Entered."
         return True
 
-    async def send_otp(self, request, *args, **kwargs):
+    def send_otp(self, request, *args, **kwargs):
         """
-        Send the OTP to the user's phone number.
-        Returns True if the message was sent successfully, Error Response otherwise.
+        Queue the OTP for the user's phone number; the send_sms worker texts it, and the client
+        follows otp_delivery_status until it's sent or has failed.
+        Returns True if the message was queued, Error Response otherwise.
         """
         msg = ''
         self.generate_otp(request)
         try:
-            if await send_one_time_password(request.data["otp_phone_number"], request.data["otp_token"]):
-                return True
+            self.otp_sms = queue_one_time_password(request.data["otp_phone_number"], request.data["otp_token"])
+            return True
         except Exception as e:
             if isinstance(e, TwilioClientNotInitializedException):
                 msg = "Cannot send verification code. Twilio configuration is not set up properly."
@@ -149,16 +159,21 @@ class UserOTP(DecoupledContextMixin, LoggingMixin, generics.RetrieveUpdateAPIVie
                 msg = "Failed to send verification code; please check your phone number and try again."
         return Response({"detail": msg},
                                 status=status.HTTP_400_BAD_REQUEST)
+
+    def perform_update(self, serializer):
+        otp_sms = getattr(self, 'otp_sms', None)
+        serializer.save(**({'otp_sms': otp_sms} if otp_sms else {}))
+
     def update(self, request, *args, **kwargs):
         user = self.request.user
         self.check_change_permission(request, user)
 
         if request.data["action"] == "send":
-            otp_sent = async_to_sync(self.send_otp)(request, *args, **kwargs)
-            if otp_sent == True:
-                return super().update(request, *args, **kwargs)
-            else:
-                return otp_sent
+            with transaction.atomic():
+                otp_sent = self.send_otp(request, *args, **kwargs)
+                if otp_sent == True:
+                    return super().update(request, *args, **kwargs)
+            return otp_sent
         elif request.data["action"] == "verify":
             verified = self.verify_otp(request)
             if verified == True:
@@ -188,7 +203,7 @@ class QueueList(DecoupledContextMixin, LoggingMixin, generics.ListCreateAPIView)
             self.request.user
             if self.request.user.is_authenticated else None
         )
-        return Queue.objects.filter(hosts__in=list(filter(None, [user])))
+        return Queue.objects.filter(hosts__in=list(filter(None, [user]))).prefetch_for_serializers()
 
 
 class QueueListSearch(DecoupledContextMixin, generics.ListAPIView):
@@ -206,12 +221,11 @@ class QueueDetail(DecoupledContextMixin, LoggingMixin, generics.RetrieveUpdateDe
     permission_classes = (IsAuthenticated, IsHostOrReadOnly,)
 
     def get(self, request, pk, format=None):
-        queue = self.get_object()
-        if is_host(request.user, queue):
-            serializer = QueueHostSerializer(queue, context={'user': request.user})
-        else:
-            serializer = QueueAttendeeSerializer(queue, context={'user': request.user})
-        return Response(serializer.data)
+        # Anyone may read a queue, so there's no object permission to check
+        content = get_queue_snapshot(pk)
+        if content is None:
+            raise Http404
+        return Response(render_queue_for_user(content, request.user))
 
 
 class QueueHostDetail(DecoupledContextMixin, LoggingMixin, APIView):
@@ -281,14 +295,29 @@ class MeetingStart(DecoupledContextMixin, LoggingMixin, APIView):
     def post(self, request, pk):
         m = Meeting.objects.get(pk=pk)
         self.check_object_permissions(request, m)
+        if settings.ASYNC_MEETING_START:
+            return self.request_start(m)
         try:
             m.start()
         except DisabledBackendException as e:
             return Response({'Start Meeting': e.message}, status=status.HTTP_400_BAD_REQUEST)
         m.save()
         serializer = MeetingSerializer(m)
+        MeetingStartEvent.record(serializer.data)
         return Response(serializer.data)
 
+    def request_start(self, m: Meeting):
+        # The start_meetings command starts the meeting and tells the assignee how it went
+        try:
+            m.request_start()
+        except DisabledBackendException as e:
+            return Response({'Start Meeting': e.message}, status=status.HTTP_400_BAD_REQUEST)
+        m.save()
+        return Response(
+            MeetingSerializer(m).data,
+            status=status.HTTP_202_ACCEPTED if m.status == MeetingStatus.STARTING else status.HTTP_200_OK,
+        )
+
 
 class AttendeeList(DecoupledContextMixin, generics.ListAPIView):
     serializer_class = AttendeeSerializer
@@ -345,6 +374,61 @@ class QueueAnnouncementViewSet(DecoupledContextMixin, LoggingMixin, viewsets.Mod
         serializer.save()
 
 
+EXPORT_BATCH_SIZE = 2000
+CONTINUATION_TOKEN_HEADER = 'X-Continuation-Token'
+# Largest bigint, pairing a bounding started_at with every event started at it
+MAX_EVENT_ID = 2 ** 63 - 1
+
+
+class MeetingStartLogPagination(CursorPagination):
+    '''
+    Keyset pagination of the JSON meeting start logs, by event ID.
+    '''
+    ordering = 'id'
+    page_size = 1000
+    page_size_query_param = 'page_size'
+    max_page_size = 10000
+    until: Optional[str] = None
+
+    def encode_cursor(self, cursor):
+        url = super().encode_cursor(cursor)
+        # Later pages keep the first page's bound, so rows started since aren't mixed in
+        return replace_query_param(url, 'until', self.until) if self.until else url
+
+
+class Echo:
+    '''
+    Pseudo-buffer for csv.writer: write() hands back the formatted row instead of storing it.
+    '''
+
+    def write(self, value: str) -> str:
+        return value
+
+
+async def iterate_in_batches(lines: Iterator[str]) -> AsyncIterator[str]:
+    '''
+    Read a synchronous iterator of lines on the request's worker thread (where its
+    database cursor lives), EXPORT_BATCH_SIZE lines at a time.
+    '''
+    take = sync_to_async(lambda: list(itertools.islice(lines, EXPORT_BATCH_SIZE)))
+    while batch := await take():
+        yield ''.join(batch)
+
+
+def stream_csv(request: HttpRequest, header: Iterable[str], rows: Iterator[Iterable], filename: str) -> StreamingHttpResponse:
+    '''
+    Return rows as a CSV download without holding them in memory. Django reads a
+    synchronous iterator to the end before sending it over ASGI, so ASGI
+    requests get an asynchronous one.
+    '''
+    writer = csv.writer(Echo())
+    lines = (writer.writerow(row) for row in itertools.chain([header], rows))
+    content = iterate_in_batches(lines) if isinstance(request, ASGIRequest) else lines
+    response = StreamingHttpResponse(content, content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
 class ExportMeetingStartLogs(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -368,48 +452,154 @@ class ExportMeetingStartLogs(APIView):
         # Otherwise, get all the logs for the queues the user is a host of
         else:
             filename = f"meeting_start_logs_{username}.csv"
-        # Parse optional start_date query parameter in order to filter by date
-        start_date_str = request.query_params.get('start_date')
-        start_date = None
-        # If no filter chosen, return everything
-        if start_date_str:
-            try:
-                # attach UTC to avoid issues with postgres and comparing timezone-aware column against a naive datetime
-                start_date = datetime.strptime(start_date_str, '%Y-%m-%d').replace(tzinfo=timezone.utc)
-            except ValueError:
-                return Response(
-                    {'detail': 'Invalid start_date format. Use YYYY-MM-DD.'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+        filters = self.parse_filters(request.query_params)
         logger.info(f"User {username} requested to export meeting start logs for queues {queues_user_is_in}.")
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-
-        logger.info(f"User {username} successfully exported meeting start logs for queues {repr(queues_user_is_in)}.")
-        self.extract_log(queues_user_is_in, response, start_date)
+        # Incremental exports (those passing since, empty for the first one) are bounded by a fixed position,
+        # which later JSON pages keep and which is handed back as the next since token
+        continuation_token = None
+        if 'since' in request.query_params:
+            if 'until' not in filters:
+                # started_at is set before its transaction commits, so leave out recent starts that may still be
+                # committing behind a later one; otherwise the next export would resume past them
+                started_before = datetime.now(timezone.utc) - timedelta(seconds=settings.MEETING_START_LOG_EXPORT_DELAY)
+                filters['until'] = (started_before, MAX_EVENT_ID)
+            continuation_token = self.encode_continuation_token(*filters['until'])
+        response = self.export(request, queues_user_is_in, filters, filename, continuation_token)
+        if continuation_token:
+            response[CONTINUATION_TOKEN_HEADER] = continuation_token
+        return response
 
+    def export(
+        self, request, queue_ids: Iterable[int], filters: dict, filename: str, continuation_token: Optional[str] = None
+    ):
+        if request.query_params.get('format') == 'json':
+            paginator = MeetingStartLogPagination()
+            paginator.until = continuation_token
+            page = paginator.paginate_queryset(
+                self.filter_events(queue_ids, **filters).values('id', *self.log_columns.values()),
+                request, view=self,
+            )
+            rows = [
+                {'id': row['id'], **{name: row[path] for name, path in self.log_columns.items()}}
+                for row in page
+            ]
+            return paginator.get_paginated_response(rows)
+        response = stream_csv(
+            request._request, self.log_columns, self.extract_log(queue_ids, **filters), filename
+        )
+        logger.info(f"User {request.user.username} successfully exported meeting start logs for queues {repr(queue_ids)}.")
         return response
 
     @staticmethod
-    def extract_log(queue_ids: Iterable[int], response: HttpResponse, start_date: Optional[datetime] = None) -> None:
-        writer = csv.writer(response)
-        with connection.cursor() as cursor:
-            query = '''
-                SELECT * FROM meeting_start_logs
-                WHERE queue_id = ANY(%s)
-            '''
-            params = [list(queue_ids)]
+    def encode_continuation_token(started_at: datetime, event_id: int) -> str:
+        return urlsafe_b64encode(f'{started_at.isoformat()}|{event_id}'.encode()).decode()
 
-            # Only add the date filter if user asked for one 
-            if start_date:
-                query += ' AND meeting_created_at >= %s'
-                # Add datetime object to param list, Django should handle converting it to postgres compatible timestamp
-                params.append(start_date)
-
-            cursor.execute(query, params)
+    @staticmethod
+    def decode_continuation_token(token: str) -> Tuple[datetime, int]:
+        try:
+            started_at, event_id = urlsafe_b64decode(token.encode()).decode().split('|')
+            return datetime.fromisoformat(started_at), int(event_id)
+        except ValueError:
+            raise ParseError('Invalid since token. Use the X-Continuation-Token header of a previous export.')
 
-            rows = cursor.fetchall()
+    @staticmethod
+    def parse_filters(query_params) -> dict:
+        '''
+        Read the optional export filters from the query string, raising ParseError for invalid values.
+        Dates are UTC days; end_date is inclusive.
+        '''
+        filters = {}
+        for name in ('start_date', 'end_date'):
+            if query_params.get(name):
+                try:
+                    # attach UTC to avoid issues with postgres and comparing timezone-aware column against a naive datetime
+                    filters[name] = datetime.strptime(query_params[name], '%Y-%m-%d').replace(tzinfo=timezone.utc)
+                except ValueError:
+                    raise ParseError(f'Invalid {name} format. Use YYYY-MM-DD.')
+        if query_params.get('host_id'):
+            try:
+                filters['host_id'] = int(query_params['host_id'])
+            except ValueError:
+                raise ParseError('Invalid host_id. Use a user ID.')
+        for name in ('attendee', 'backend_type'):
+            if query_params.get(name):
+                filters[name] = query_params[name]
+        if query_params.get('since_id'):
+            try:
+                filters['since_id'] = int(query_params['since_id'])
+            except ValueError:
+                raise ParseError('Invalid since_id. Use an event ID.')
+        if query_params.get('since_timestamp'):
+            since_timestamp = parse_datetime(query_params['since_timestamp'])
+            if since_timestamp is None:
+                raise ParseError('Invalid since_timestamp format. Use ISO 8601.')
+            if is_naive(since_timestamp):
+                since_timestamp = since_timestamp.replace(tzinfo=timezone.utc)
+            filters['since_timestamp'] = since_timestamp
+        if query_params.get('since'):
+            filters['since'] = ExportMeetingStartLogs.decode_continuation_token(query_params['since'])
+        if query_params.get('until'):
+            filters['until'] = ExportMeetingStartLogs.decode_continuation_token(query_params['until'])
+        return filters
 
-            column_names = map(lambda λ: λ[0], cursor.description)
+    @staticmethod
+    def filter_events(
+        queue_ids: Iterable[int], start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+        host_id: Optional[int] = None, attendee: Optional[str] = None, backend_type: Optional[str] = None,
+        since_id: Optional[int] = None, since_timestamp: Optional[datetime] = None,
+        since: Optional[Tuple[datetime, int]] = None, until: Optional[Tuple[datetime, int]] = None,
+    ) -> QuerySet:
+        '''
+        since and until are (started_at, id) positions: since excludes its row, until includes it.
+        '''
+        events = MeetingStartEvent.objects.filter(queue_id__in=list(queue_ids))
+        if start_date:
+            events = events.filter(meeting_created_at__gte=start_date)
+        if end_date:
+            events = events.filter(meeting_created_at__lt=end_date + timedelta(days=1))
+        if host_id is not None:
+            events = events.filter(host_id=host_id)
+        if attendee:
+            events = events.filter(attendee_uniqname=attendee)
+        if backend_type:
+            events = events.filter(meeting_type=backend_type)
+        if since_id is not None:
+            events = events.filter(id__gt=since_id)
+        if since_timestamp:
+            events = events.filter(started_at__gte=since_timestamp)
+        if since:
+            events = events.filter(Q(started_at__gt=since[0]) | Q(started_at=since[0], id__gt=since[1]))
+        if until:
+            events = events.filter(Q(started_at__lt=until[0]) | Q(started_at=until[0], id__lte=until[1]))
+        return events
+
+    # Columns of the meeting start logs, named as in the meeting_start_logs view that preceded MeetingStartEvent
+    log_columns = {
+        'queue_id': 'queue_id',
+        'queue_name': 'queue__name',
+        'queue_status': 'queue__status',
+        'attendee_id': 'attendee_id',
+        'attendee_user_id': 'attendee_user_id',
+        'attendee_uniqname': 'attendee_uniqname',
+        'attendee_last_name': 'attendee_last_name',
+        'attendee_first_name': 'attendee_first_name',
+        'host_id': 'host_id',
+        'host_uniqname': 'host_uniqname',
+        'host_last_name': 'host_last_name',
+        'host_first_name': 'host_first_name',
+        'meeting_type': 'meeting_type',
+        'meeting_url': 'meeting_url',
+        'agenda': 'agenda',
+        'meeting_created_at': 'meeting_created_at',
+        'queue_deleted_at': 'queue__deleted',
+    }
 
-            writer.writerows([column_names] + rows)
+    @classmethod
+    def extract_log(cls, queue_ids: Iterable[int], **filters) -> Iterator[tuple]:
+        events = cls.filter_events(queue_ids, **filters)
+        # iterator() reads through a server-side cursor, EXPORT_BATCH_SIZE rows at a time
+        return (
+            events.order_by('meeting_created_at')
+            .values_list(*cls.log_columns.values())
+            .iterator(chunk_size=EXPORT_BATCH_SIZE)
+        )